@@ -1,5 +1,6 @@
-#include "config.h"
-#include "mcts.h"
+#include <cmath>
+
+#include "engine.h"
 
 #ifdef _WIN32
 #define API __declspec(dllexport)
@@ -7,44 +8,117 @@
 #define API
 #endif
 
+namespace {
+
+const Variant* FindVariant(int chessboard_size) {
+#define GOBANG_FIND_VARIANT(size) \
+  if (chessboard_size == size) return board##size::GetVariant();
+  GOBANG_SIZES(GOBANG_FIND_VARIANT)
+#undef GOBANG_FIND_VARIANT
+  return nullptr;
+}
+
+}  // namespace
+
 extern "C" {
 
-API MCTS* MCTS_new(char* chessboard, double vloss, int batch_size,
-                   void (*callback)(int, char**, double**, double**)) {
-  Chessboard new_chessboard;
-  new_chessboard.SetMemory(chessboard);
-  return new MCTS(new_chessboard, vloss, batch_size, callback);
+// returns nullptr if the library has not been compiled for chessboard_size
+API Engine* MCTS_new(int chessboard_size, int in_a_row, char* chessboard,
+                     double vloss, int batch_size,
+                     void (*callback)(int, char**, double**, double**),
+                     int evaluator) {
+  auto variant = FindVariant(chessboard_size);
+  if (variant == nullptr) return nullptr;
+  return variant->new_engine(chessboard, in_a_row, vloss, batch_size, callback,
+                             evaluator);
+}
+
+API int MCTS_Search(Engine* handle, int num_sims, double cpuct,
+                    double dirichlet_alpha) {
+  return handle->Search(num_sims, cpuct, dirichlet_alpha);
 }
 
-API void MCTS_Search(MCTS* handle, int num_sims, double cpuct,
-                     double dirichlet_alpha) {
-  handle->Search(num_sims, cpuct, dirichlet_alpha);
+API void MCTS_SetInterrupted(Engine* handle, bool interrupted) {
+  handle->SetInterrupted(interrupted);
 }
 
-API void MCTS_StepForward(MCTS* handle, int x, int y) {
+API void MCTS_SetDeferredReclamation(Engine* handle, bool deferred) {
+  handle->SetDeferredReclamation(deferred);
+}
+
+API void MCTS_SetPipelineDepth(Engine* handle, int depth) {
+  handle->SetPipelineDepth(depth);
+}
+
+API void MCTS_SetNodeBudget(Engine* handle, int64_t node_budget) {
+  handle->SetNodeBudget(node_budget);
+}
+
+API int64_t MCTS_num_nodes(Engine* handle) { return handle->num_nodes(); }
+
+API int64_t MCTS_num_bytes(Engine* handle) { return handle->num_bytes(); }
+
+API void MCTS_StepForward(Engine* handle, int x, int y) {
   handle->StepForward(x, y);
 }
 
-API void MCTS_GetPi(MCTS* handle, double temperature, double* out) {
+API void MCTS_Reset(Engine* handle, char* chessboard) {
+  handle->Reset(chessboard);
+}
+
+API void MCTS_GetPi(Engine* handle, double temperature, double* out) {
   handle->GetPi(temperature, out);
 }
 
-API bool MCTS_terminated(MCTS* handle) { return handle->terminated(); }
+API bool MCTS_terminated(Engine* handle) { return handle->terminated(); }
+
+API void MCTS_chessboard(Engine* handle, char* ptr) { handle->chessboard(ptr); }
+
+API const void* MCTS_root_stats(Engine* handle) { return handle->root_stats(); }
+
+API void MCTS_SelfPlay(Engine* handle, const SelfPlayConfig* config,
+                       char* records, double* scores, SelfPlayResult* result) {
+  handle->SelfPlay(*config, records, scores, result);
+}
+
+API void MCTS_delete(Engine* handle) { delete handle; }
 
-API void MCTS_chessboard(MCTS* handle, char* ptr) { handle->chessboard(ptr); }
+API double MCTS_v(Engine* handle) { return handle->v(); }
 
-API void MCTS_delete(MCTS* handle) { delete handle; }
+API double global_SimpleHeuristics(int chessboard_size, int in_a_row,
+                                   char* chessboard) {
+  auto variant = FindVariant(chessboard_size);
+  if (variant == nullptr) return NAN;
+  return variant->simple_heuristics(chessboard, in_a_row);
+}
+
+API void global_GreedyScores(int chessboard_size, int in_a_row,
+                             char* chessboard, double* out) {
+  auto variant = FindVariant(chessboard_size);
+  if (variant == nullptr) return;
+  variant->greedy_scores(chessboard, in_a_row, out);
+}
 
-API double MCTS_v(MCTS* handle) { return handle->v(); }
+// the sizes below return 0 for unsupported sizes
 
-struct Config {
-  int chessboard_size, in_a_row;
-};
+API int64_t global_NodeBytes(int chessboard_size) {
+  auto variant = FindVariant(chessboard_size);
+  return variant == nullptr ? 0 : variant->node_bytes;
+}
 
-API Config global_GetConfig() {
-  Config config;
-  config.chessboard_size = CHESSBOARD_SIZE;
-  config.in_a_row = IN_A_ROW;
-  return config;
+API int64_t global_RecordBytes(int chessboard_size) {
+  auto variant = FindVariant(chessboard_size);
+  return variant == nullptr ? 0 : variant->record_bytes;
+}
+
+// writes the supported sizes into out, which holds max_sizes sizes, and
+// returns their number
+API int global_SupportedSizes(int* out, int max_sizes) {
+  int n = 0;
+#define GOBANG_APPEND_SIZE(size) \
+  if (n < max_sizes) out[n++] = size;
+  GOBANG_SIZES(GOBANG_APPEND_SIZE)
+#undef GOBANG_APPEND_SIZE
+  return n;
+}
 }
-}
\ No newline at end of file
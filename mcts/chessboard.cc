@@ -1,10 +1,13 @@
 #include "chessboard.h"
 
 #include <algorithm>
+#include <cstdio>
 #include <memory>
 
 #include "config.h"
 
+namespace GOBANG_NS {
+
 int Chessboard::GetWinner() const {
   int tot = 0;
   for (int who : {0, 1})
@@ -12,7 +15,7 @@ int Chessboard::GetWinner() const {
       for (int y = 0; y < CHESSBOARD_SIZE; y++) {
         tot += data_[Index(who, x, y)] > 0;
         for (int d = 0; d < 4; d++) {
-          for (int i = 0; i < IN_A_ROW; i++) {
+          for (int i = 0; i < in_a_row_; i++) {
             int nx = x + DIRS[d][0] * i;
             int ny = y + DIRS[d][1] * i;
             if (std::min(nx, ny) < 0 || std::max(nx, ny) >= CHESSBOARD_SIZE) {
@@ -37,6 +40,15 @@ void Chessboard::SetMemory(char *ptr) {
   std::copy(ptr, ptr + 2 * CHESSBOARD_SIZE * CHESSBOARD_SIZE, data_);
 }
 
+Chessboard Chessboard::NextState(int x, int y) const {
+  int half = CHESSBOARD_SIZE * CHESSBOARD_SIZE;
+  Chessboard ret(in_a_row_);
+  std::copy(data_, data_ + half, ret.data_ + half);
+  std::copy(data_ + half, data_ + 2 * half, ret.data_);
+  ret.Set(1, x, y);
+  return ret;
+}
+
 void Chessboard::Debug() {
   for (int x = 0; x < CHESSBOARD_SIZE; x++) {
     for (int y = 0; y < CHESSBOARD_SIZE; y++) {
@@ -51,4 +63,6 @@ void Chessboard::Debug() {
     printf("\n");
   }
   fflush(stdout);
-}
\ No newline at end of file
+}
+
+}  // namespace GOBANG_NS
@@ -5,12 +5,17 @@
 
 #include "config.h"
 
+namespace GOBANG_NS {
+
 class Chessboard {
  public:
-  inline Chessboard() {
+  inline explicit Chessboard(int in_a_row = IN_A_ROW) : in_a_row_(in_a_row) {
     std::fill(data_, data_ + 2 * CHESSBOARD_SIZE * CHESSBOARD_SIZE, 0);
   }
 
+  // the number of stones in a row which wins
+  inline int in_a_row() const { return in_a_row_; }
+
   inline void Set(int c, int x, int y) { data_[Index(c, x, y)] = 1; }
 
   inline int At(int c, int x, int y) const {
@@ -25,12 +30,19 @@ class Chessboard {
 
   inline char *Data() { return data_; }
 
+  // returns the chessboard after the player to move places a stone at (x, y),
+  // seen from the perspective of the opponent
+  Chessboard NextState(int x, int y) const;
+
  private:
   inline int Index(int c, int x, int y) const {
     return (c * CHESSBOARD_SIZE + x) * CHESSBOARD_SIZE + y;
   }
 
   char data_[2 * CHESSBOARD_SIZE * CHESSBOARD_SIZE];
+  int in_a_row_;
 };
 
-#endif
\ No newline at end of file
+}  // namespace GOBANG_NS
+
+#endif
@@ -1,9 +1,25 @@
 #ifndef MCTS_CONFIG_H_
 #define MCTS_CONFIG_H_
 
-constexpr int CHESSBOARD_SIZE = 15;
+// the library is compiled once for every size of GOBANG_SIZES, with
+// GOBANG_CHESSBOARD_SIZE defined to the size, see BUILD. the code of each size
+// lives in its own namespace GOBANG_NS, e.g. board15
+#ifndef GOBANG_CHESSBOARD_SIZE
+#define GOBANG_CHESSBOARD_SIZE 15
+#endif
+
+#define GOBANG_CONCAT_(a, b) a##b
+#define GOBANG_CONCAT(a, b) GOBANG_CONCAT_(a, b)
+#define GOBANG_NS GOBANG_CONCAT(board, GOBANG_CHESSBOARD_SIZE)
+
+namespace GOBANG_NS {
+
+constexpr int CHESSBOARD_SIZE = GOBANG_CHESSBOARD_SIZE;
+// the default win length, which is set per chessboard
 constexpr int IN_A_ROW = 5;
 
 const int DIRS[4][2] = {{0, 1}, {-1, 1}, {-1, 0}, {-1, -1}};
 
-#endif
\ No newline at end of file
+}  // namespace GOBANG_NS
+
+#endif
@@ -0,0 +1,99 @@
+#include "engine.h"
+
+#include "heuristics.h"
+#include "mcts.h"
+#include "selfplay.h"
+
+namespace GOBANG_NS {
+
+namespace {
+
+Chessboard MakeChessboard(char* chessboard, int in_a_row) {
+  Chessboard ret(in_a_row);
+  ret.SetMemory(chessboard);
+  return ret;
+}
+
+class EngineImpl : public Engine {
+ public:
+  EngineImpl(char* chessboard, int in_a_row, double vloss, int batch_size,
+             PolicyCallbackPtr callback, int evaluator)
+      : in_a_row_(in_a_row),
+        mcts_(MakeChessboard(chessboard, in_a_row), vloss, batch_size,
+              callback, static_cast<MCTS::Evaluator>(evaluator)) {}
+
+  int Search(int num_sims, double cpuct, double dirichlet_alpha) override {
+    return mcts_.Search(num_sims, cpuct, dirichlet_alpha);
+  }
+
+  void SetInterrupted(bool interrupted) override {
+    mcts_.set_interrupted(interrupted);
+  }
+
+  void SetDeferredReclamation(bool deferred) override {
+    mcts_.set_deferred_reclamation(deferred);
+  }
+
+  void SetPipelineDepth(int depth) override { mcts_.set_pipeline_depth(depth); }
+
+  void SetNodeBudget(int64_t node_budget) override {
+    mcts_.set_node_budget(node_budget);
+  }
+
+  int64_t num_nodes() override { return mcts_.num_nodes(); }
+
+  int64_t num_bytes() override { return mcts_.num_bytes(); }
+
+  void StepForward(int x, int y) override { mcts_.StepForward(x, y); }
+
+  void Reset(char* chessboard) override {
+    mcts_.Reset(MakeChessboard(chessboard, in_a_row_));
+  }
+
+  void GetPi(double temperature, double* out) override {
+    mcts_.GetPi(temperature, out);
+  }
+
+  bool terminated() override { return mcts_.terminated(); }
+
+  void chessboard(char* ptr) override { mcts_.chessboard(ptr); }
+
+  const void* root_stats() override { return &mcts_.root_stats(); }
+
+  double v() override { return mcts_.v(); }
+
+  void SelfPlay(const SelfPlayConfig& config, char* records, double* scores,
+                SelfPlayResult* result) override {
+    GOBANG_NS::SelfPlay(&mcts_, config, records, scores, result);
+  }
+
+ private:
+  int in_a_row_;
+  MCTS mcts_;
+};
+
+Engine* NewEngine(char* chessboard, int in_a_row, double vloss, int batch_size,
+                  PolicyCallbackPtr callback, int evaluator) {
+  return new EngineImpl(chessboard, in_a_row, vloss, batch_size, callback,
+                        evaluator);
+}
+
+double SimpleHeuristicsOf(char* chessboard, int in_a_row) {
+  return SimpleHeuristics(MakeChessboard(chessboard, in_a_row));
+}
+
+void GreedyScoresOf(char* chessboard, int in_a_row, double* out) {
+  GreedyScores(MakeChessboard(chessboard, in_a_row), out);
+}
+
+}  // namespace
+
+const Variant* GetVariant() {
+  static const Variant variant = {
+      CHESSBOARD_SIZE,    NewEngine,         SimpleHeuristicsOf,
+      GreedyScoresOf,     sizeof(MCTSNode), kRecordBytes,
+  };
+  return &variant;
+}
+
+}  // namespace GOBANG_NS
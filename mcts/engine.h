@@ -0,0 +1,110 @@
+#ifndef MCTS_ENGINE_H_
+#define MCTS_ENGINE_H_
+
+#include <cstdint>
+
+// the sizes the library is compiled for, each into the namespace board<size>,
+// keep in sync with SIZES of BUILD
+#define GOBANG_SIZES(X) X(9) X(11) X(13) X(15)
+
+// the parameters of SelfPlay of selfplay.h, moves are indexed from the empty
+// chessboard
+struct SelfPlayConfig {
+  int num_sims;
+  // the moves not searched fully are searched with fast_num_sims and without
+  // noise
+  int fast_num_sims;
+  double full_search_prob;
+  double cpuct;
+  // the Dirichlet alpha of the full searches from noise_from_move on
+  double dirichlet_alpha;
+  int noise_from_move;
+  // moves before temperature_moves are sampled from the visits, the others
+  // among the most visited moves
+  int temperature_moves;
+  // the player to move resigns once the scores of its last
+  // resign_consecutive_moves moves are below resign_threshold, 0 never resigns
+  double resign_threshold;
+  int resign_consecutive_moves;
+  // keeps playing after the resignation to calibrate the threshold
+  bool playout;
+  // the index of the first move played, the moves before have been played
+  // on the tree already, e.g. from the opening book
+  int first_move;
+  uint64_t seed;
+};
+
+struct SelfPlayResult {
+  int num_records;
+  // the index of the move after the last one
+  int num_moves;
+  int num_sims;
+  // the move at which the player to move resigned or would have resigned,
+  // -1 if none, an input for the moves before first_move
+  int resign_move;
+  bool resigned;
+};
+
+// the search of one size behind a handle of the C API, which dispatches to
+// the namespace of the size of the handle
+class Engine {
+ public:
+  virtual ~Engine() = default;
+
+  virtual int Search(int num_sims, double cpuct, double dirichlet_alpha) = 0;
+
+  virtual void SetInterrupted(bool interrupted) = 0;
+
+  virtual void SetDeferredReclamation(bool deferred) = 0;
+
+  virtual void SetPipelineDepth(int depth) = 0;
+
+  virtual void SetNodeBudget(int64_t node_budget) = 0;
+
+  virtual int64_t num_nodes() = 0;
+
+  virtual int64_t num_bytes() = 0;
+
+  virtual void StepForward(int x, int y) = 0;
+
+  // keeps the win length of the engine
+  virtual void Reset(char* chessboard) = 0;
+
+  virtual void GetPi(double temperature, double* out) = 0;
+
+  virtual bool terminated() = 0;
+
+  virtual void chessboard(char* ptr) = 0;
+
+  // MCTS::RootStats of the size
+  virtual const void* root_stats() = 0;
+
+  virtual double v() = 0;
+
+  virtual void SelfPlay(const SelfPlayConfig& config, char* records,
+                        double* scores, SelfPlayResult* result) = 0;
+};
+
+using PolicyCallbackPtr = void (*)(int n, char** chessboards, double** probs,
+                                   double** vs);
+
+// the entry points of one size
+struct Variant {
+  int chessboard_size;
+  Engine* (*new_engine)(char* chessboard, int in_a_row, double vloss,
+                        int batch_size, PolicyCallbackPtr callback,
+                        int evaluator);
+  double (*simple_heuristics)(char* chessboard, int in_a_row);
+  void (*greedy_scores)(char* chessboard, int in_a_row, double* out);
+  int64_t node_bytes;
+  int64_t record_bytes;
+};
+
+#define GOBANG_DECLARE_VARIANT(size) \
+  namespace board##size {            \
+  const Variant* GetVariant();       \
+  }
+GOBANG_SIZES(GOBANG_DECLARE_VARIANT)
+#undef GOBANG_DECLARE_VARIANT
+
+#endif
@@ -0,0 +1,57 @@
+#include "heuristics.h"
+
+#include <algorithm>
+#include <cmath>
+#include <limits>
+
+#include "config.h"
+
+namespace GOBANG_NS {
+
+double SimpleHeuristics(const Chessboard &chessboard) {
+  double heuristics[2] = {0, 0};
+
+  for (int who : {0, 1})
+    for (int x = 0; x < CHESSBOARD_SIZE; x++)
+      for (int y = 0; y < CHESSBOARD_SIZE; y++)
+        for (int d = 0; d < 4; d++) {
+          int i = 0;
+          for (; i < chessboard.in_a_row(); i++) {
+            int nx = x + DIRS[d][0] * i;
+            int ny = y + DIRS[d][1] * i;
+            if (std::min(nx, ny) < 0 || std::max(nx, ny) >= CHESSBOARD_SIZE ||
+                chessboard.At(who, nx, ny) == 0) {
+              break;
+            }
+          }
+          // 0, 0, 1, 1e2, 1e4, ... for runs of length 0, 1, 2, 3, 4, ...
+          if (i >= 2) heuristics[who] += std::pow(100.0, i - 2);
+        }
+
+  double deno = heuristics[0] + heuristics[1];
+  if (!(deno > 0)) return 0;
+  return 2 * heuristics[0] / deno - 1;
+}
+
+void GreedyScores(const Chessboard &chessboard, double *out) {
+  Chessboard tmp = chessboard;
+  char *data = tmp.Data();
+  int half = CHESSBOARD_SIZE * CHESSBOARD_SIZE;
+
+  for (int x = 0; x < CHESSBOARD_SIZE; x++)
+    for (int y = 0; y < CHESSBOARD_SIZE; y++) {
+      int idx = x * CHESSBOARD_SIZE + y;
+      if (chessboard.At(0, x, y) + chessboard.At(1, x, y) > 0) {
+        out[idx] = -std::numeric_limits<double>::infinity();
+        continue;
+      }
+      data[idx] = 1;
+      out[idx] = SimpleHeuristics(tmp);
+      data[idx] = 0;
+      data[half + idx] = 1;
+      out[idx] -= SimpleHeuristics(tmp);
+      data[half + idx] = 0;
+    }
+}
+
+}  // namespace GOBANG_NS
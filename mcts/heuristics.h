@@ -0,0 +1,18 @@
+#ifndef MCTS_HEURISTICS_H_
+#define MCTS_HEURISTICS_H_
+
+#include "chessboard.h"
+
+namespace GOBANG_NS {
+
+// run-length heuristics in [-1, 1] from the perspective of the player to move
+double SimpleHeuristics(const Chessboard &chessboard);
+
+// scores every empty cell by how much the stone improves the heuristics of the
+// player to move plus how much it would improve the heuristics of the opponent,
+// occupied cells are scored -inf
+void GreedyScores(const Chessboard &chessboard, double *out);
+
+}  // namespace GOBANG_NS
+
+#endif
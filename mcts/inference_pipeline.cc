@@ -0,0 +1,70 @@
+#include "inference_pipeline.h"
+
+namespace GOBANG_NS {
+
+InferencePipeline::InferencePipeline(const PolicyCallback& policy)
+    : policy_(policy), num_in_flight_(0), stopped_(false) {
+  thread_ = std::thread(&InferencePipeline::Loop, this);
+}
+
+InferencePipeline::~InferencePipeline() {
+  while (num_in_flight_ > 0) WaitOldest();
+  {
+    std::lock_guard<std::mutex> lock(mu_);
+    stopped_ = true;
+  }
+  cv_.notify_all();
+  thread_.join();
+}
+
+void InferencePipeline::Submit(std::vector<MCTSNode*> batch) {
+  {
+    std::lock_guard<std::mutex> lock(mu_);
+    pending_.push_back(std::move(batch));
+  }
+  num_in_flight_ += 1;
+  cv_.notify_all();
+}
+
+std::vector<MCTSNode*> InferencePipeline::WaitOldest() {
+  std::unique_lock<std::mutex> lock(mu_);
+  cv_.wait(lock, [this] { return !done_.empty(); });
+  auto batch = std::move(done_.front());
+  done_.pop_front();
+  num_in_flight_ -= 1;
+  return batch;
+}
+
+void InferencePipeline::Loop() {
+  std::vector<char*> chessboards;
+  std::vector<double*> probs;
+  std::vector<double*> vs;
+  for (;;) {
+    std::vector<MCTSNode*> batch;
+    {
+      std::unique_lock<std::mutex> lock(mu_);
+      cv_.wait(lock, [this] { return stopped_ || !pending_.empty(); });
+      if (pending_.empty()) return;
+      batch = std::move(pending_.front());
+      pending_.pop_front();
+    }
+
+    chessboards.clear();
+    probs.clear();
+    vs.clear();
+    for (auto node : batch) {
+      chessboards.push_back(node->chessboard_.Data());
+      probs.push_back(node->p_);
+      vs.push_back(&node->v_);
+    }
+    policy_(batch.size(), chessboards.data(), probs.data(), vs.data());
+
+    {
+      std::lock_guard<std::mutex> lock(mu_);
+      done_.push_back(std::move(batch));
+    }
+    cv_.notify_all();
+  }
+}
+
+}  // namespace GOBANG_NS
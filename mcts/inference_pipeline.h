@@ -0,0 +1,52 @@
+#ifndef MCTS_INFERENCE_PIPELINE_H_
+#define MCTS_INFERENCE_PIPELINE_H_
+
+#include <condition_variable>
+#include <deque>
+#include <functional>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+#include "mcts_node.h"
+
+namespace GOBANG_NS {
+
+// Evaluates batches of leaves with the policy callback on a worker thread, so
+// that the searching thread can select the next batch in the meantime.
+// Batches are evaluated and completed in submission order. The worker only
+// writes the priors and values of the leaves, everything else including the
+// backup stays on the searching thread.
+class InferencePipeline {
+ public:
+  using PolicyCallback = std::function<void(int n, char** chessboards,
+                                            double** probs, double** vs)>;
+
+  explicit InferencePipeline(const PolicyCallback& policy);
+
+  // waits for the batches in flight
+  ~InferencePipeline();
+
+  void Submit(std::vector<MCTSNode*> batch);
+
+  // blocks until the oldest batch in flight has been evaluated
+  std::vector<MCTSNode*> WaitOldest();
+
+  inline int num_in_flight() const { return num_in_flight_; }
+
+ private:
+  void Loop();
+
+  PolicyCallback policy_;
+  std::mutex mu_;
+  std::condition_variable cv_;
+  std::deque<std::vector<MCTSNode*>> pending_;
+  std::deque<std::vector<MCTSNode*>> done_;
+  int num_in_flight_;
+  bool stopped_;
+  std::thread thread_;
+};
+
+}  // namespace GOBANG_NS
+
+#endif
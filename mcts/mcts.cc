@@ -1,11 +1,19 @@
 #include "mcts.h"
 
+#include <algorithm>
 #include <cassert>
 #include <cmath>
+#include <cstdio>
+#include <cstdlib>
 #include <ctime>
 #include <iostream>
 #include <random>
 
+#include "heuristics.h"
+#include "node_reclaimer.h"
+
+namespace GOBANG_NS {
+
 void MCTS::EnsureRoot() {
   if (root_ == nullptr) {
     root_.reset(new MCTSNode(chessboard_, nullptr));
@@ -14,18 +22,79 @@ void MCTS::EnsureRoot() {
       task_queue_.PushBack(root_.get());
       DispatchBatchInference();
     }
+    UpdateRootStats();
+  }
+}
+
+void MCTS::UpdateRootStats() {
+  constexpr int LEN = CHESSBOARD_SIZE * CHESSBOARD_SIZE;
+  root_stats_.pv_length = 0;
+  if (root_ == nullptr) {
+    std::fill(root_stats_.n, root_stats_.n + LEN, 0);
+    std::fill(root_stats_.q, root_stats_.q + LEN, 0);
+    std::fill(root_stats_.p, root_stats_.p + LEN, 0);
+    std::fill(root_stats_.vloss_cnt, root_stats_.vloss_cnt + LEN, 0);
+    return;
+  }
+
+  if (root_->terminated()) {
+    // terminated nodes are never evaluated
+    std::fill(root_stats_.p, root_stats_.p + LEN, 0);
+  } else {
+    std::copy(root_->p_, root_->p_ + LEN, root_stats_.p);
+  }
+  for (int i = 0; i < LEN; i++) {
+    auto child = root_->childs_[i].get();
+    root_stats_.n[i] = child == nullptr ? 0 : child->n();
+    root_stats_.q[i] = child == nullptr ? 0 : -child->q();
+    root_stats_.vloss_cnt[i] = child == nullptr ? 0 : child->vloss_cnt_;
+  }
+
+  for (auto node = root_.get(); !node->terminated();) {
+    MCTSNode* best = nullptr;
+    int best_idx = 0;
+    for (int i = 0; i < LEN; i++) {
+      auto child = node->childs_[i].get();
+      if (child != nullptr && child->n() > 0 &&
+          (best == nullptr || child->n() > best->n())) {
+        best = child;
+        best_idx = i;
+      }
+    }
+    if (best == nullptr) break;
+    root_stats_.pv[root_stats_.pv_length][0] = best_idx / CHESSBOARD_SIZE;
+    root_stats_.pv[root_stats_.pv_length][1] = best_idx % CHESSBOARD_SIZE;
+    root_stats_.pv_length += 1;
+    node = best;
   }
 }
 
 MCTS::MCTS(const Chessboard& chessboard, double vloss, int batch_size,
-           const PolicyCallback& policy)
+           const PolicyCallback& policy, Evaluator evaluator)
     : chessboard_(chessboard),
       policy_(policy),
+      evaluator_(evaluator),
       root_(nullptr),
       vloss_(vloss),
-      batch_size_(batch_size) {}
+      batch_size_(batch_size),
+      interrupted_(false),
+      deferred_reclamation_(true),
+      node_budget_(0),
+      pipeline_depth_(1) {
+  UpdateRootStats();
+}
+
+MCTS::~MCTS() { Discard(std::move(root_)); }
+
+void MCTS::Discard(std::unique_ptr<MCTSNode> node) {
+  if (deferred_reclamation_) {
+    NodeReclaimer::Instance()->Discard(std::move(node));
+  } else {
+    NodeReclaimer::Destroy(std::move(node));
+  }
+}
 
-void MCTS::Search(int num_sims, double cpuct, double dirichlet_alpha) {
+int MCTS::Search(int num_sims, double cpuct, double dirichlet_alpha) {
   EnsureRoot();
 
   if (dirichlet_alpha > 0) {
@@ -33,12 +102,18 @@ void MCTS::Search(int num_sims, double cpuct, double dirichlet_alpha) {
     root_->set_p_noise(p_noise_);
   }
 
-  for (int i = 0; i < num_sims; i++) {
+  int i = 0;
+  for (; i < num_sims && !interrupted_.load(); i++) {
     Simulate(cpuct);
+    if (node_budget_ > 0 && num_nodes() > node_budget_) {
+      Prune();
+    }
   }
 
-  DispatchBatchInference();
+  Drain();
   CheckVlossCnt(root_.get());
+  UpdateRootStats();
+  return i;
 }
 
 void MCTS::Simulate(double cpuct) {
@@ -54,13 +129,13 @@ void MCTS::Simulate(double cpuct) {
     } else if (node->evaluating() && expanded) {
       // expand a new node
       if (task_queue_.Size() >= batch_size_) {
-        DispatchBatchInference();
+        FlushBatch();
       }
       task_queue_.PushBack(node);
       break;
     } else if (node->evaluating() && !expanded) {
       // previous evaluating node
-      DispatchBatchInference();
+      WaitForEvaluation(node);
       assert(!node->evaluating());
     }
 
@@ -71,10 +146,79 @@ void MCTS::Simulate(double cpuct) {
   }
 }
 
+void MCTS::Prune() {
+  constexpr int LEN = CHESSBOARD_SIZE * CHESSBOARD_SIZE;
+  // leaves waiting for inference must not be freed
+  Drain();
+
+  std::vector<MCTSNode*> pv;
+  for (auto node = root_.get(); node != nullptr;) {
+    pv.push_back(node);
+    MCTSNode* best = nullptr;
+    for (int i = 0; i < LEN; i++) {
+      auto child = node->childs_[i].get();
+      if (child != nullptr && (best == nullptr || child->n() > best->n())) {
+        best = child;
+      }
+    }
+    node = best;
+  }
+  std::sort(pv.begin(), pv.end());
+
+  // inner nodes off the principal variation, every child is visited less
+  // than its father, so that descendants are pruned before their ancestors
+  std::vector<MCTSNode*> candidates;
+  std::vector<MCTSNode*> stack = {root_.get()};
+  while (!stack.empty()) {
+    auto node = stack.back();
+    stack.pop_back();
+    if (node->subtree_size() == 1) continue;
+    if (!std::binary_search(pv.begin(), pv.end(), node)) {
+      candidates.push_back(node);
+    }
+    for (int i = 0; i < LEN; i++) {
+      if (node->childs_[i] != nullptr) stack.push_back(node->childs_[i].get());
+    }
+  }
+  std::sort(candidates.begin(), candidates.end(),
+            [](MCTSNode* a, MCTSNode* b) { return a->n() < b->n(); });
+
+  // the pruned nodes become leaves keeping their own statistics and priors
+  const int64_t target = node_budget_ * 3 / 4;
+  for (auto node : candidates) {
+    if (num_nodes() <= target) break;
+    int freed = node->subtree_size() - 1;
+    for (auto ancestor = node; ancestor != nullptr;
+         ancestor = ancestor->father()) {
+      ancestor->subtree_size_ -= freed;
+    }
+    for (int i = 0; i < LEN; i++) {
+      if (node->childs_[i] != nullptr) Discard(std::move(node->childs_[i]));
+    }
+  }
+}
+
 void MCTS::StepForward(int x, int y) {
-  chessboard_ = root_->child(x, y)->chessboard();
-  root_ = root_->child_ownership(x, y);
-  root_->set_father(nullptr);
+  if (root_ == nullptr || root_->child(x, y) == nullptr) {
+    // the move has not been explored, restart from the new chessboard
+    chessboard_ = chessboard_.NextState(x, y);
+    Discard(std::move(root_));
+  } else {
+    chessboard_ = root_->child(x, y)->chessboard();
+    auto old_root = std::move(root_);
+    root_ = old_root->child_ownership(x, y);
+    root_->set_father(nullptr);
+    Discard(std::move(old_root));
+  }
+  UpdateRootStats();
+}
+
+void MCTS::Reset(const Chessboard& chessboard) {
+  chessboard_ = chessboard;
+  Discard(std::move(root_));
+  task_queue_.Clear();
+  interrupted_.store(false);
+  UpdateRootStats();
 }
 
 void MCTS::GetPi(double temperature, double* out) {
@@ -159,6 +303,11 @@ void MCTS::DispatchBatchInference() {
     int to = std::min(from + batch_size_ - 1, task_queue_.rear());
     int n = to - from + 1;
 
+    if (evaluator_ != kCallback) {
+      for (int i = from; i <= to; i++) EvaluateNatively(task_queue_[i]);
+      continue;
+    }
+
     for (int i = 0; i < n; i++) {
       auto node = task_queue_[i + from];
       chessboards_buf[i] = node->chessboard_.Data();
@@ -174,6 +323,60 @@ void MCTS::DispatchBatchInference() {
   task_queue_.Clear();
 }
 
+void MCTS::set_pipeline_depth(int depth) {
+  pipeline_depth_ = std::max(depth, 1);
+  if (pipeline_depth_ > 1 && evaluator_ == kCallback) {
+    if (pipeline_ == nullptr) pipeline_.reset(new InferencePipeline(policy_));
+  } else {
+    pipeline_.reset();
+  }
+}
+
+void MCTS::FlushBatch() {
+  if (pipeline_ == nullptr) {
+    DispatchBatchInference();
+    return;
+  }
+  SubmitTaskQueue();
+  while (pipeline_->num_in_flight() >= pipeline_depth_) CompleteOldestBatch();
+}
+
+void MCTS::WaitForEvaluation(MCTSNode* node) {
+  if (pipeline_ == nullptr) {
+    DispatchBatchInference();
+    return;
+  }
+  // the node is either in task_queue_ or in flight
+  SubmitTaskQueue();
+  while (node->evaluating()) CompleteOldestBatch();
+}
+
+void MCTS::SubmitTaskQueue() {
+  if (task_queue_.Size() == 0) return;
+  pipeline_->Submit(std::vector<MCTSNode*>(
+      &task_queue_[task_queue_.front()], &task_queue_[task_queue_.rear()] + 1));
+  task_queue_.Clear();
+}
+
+void MCTS::CompleteOldestBatch() {
+  for (auto node : pipeline_->WaitOldest()) BackupFromLeaf(node);
+}
+
+void MCTS::Drain() {
+  if (pipeline_ != nullptr) {
+    SubmitTaskQueue();
+    while (pipeline_->num_in_flight() > 0) CompleteOldestBatch();
+  }
+  DispatchBatchInference();
+}
+
+void MCTS::EvaluateNatively(MCTSNode* node) {
+  constexpr int LEN = CHESSBOARD_SIZE * CHESSBOARD_SIZE;
+  std::fill(node->p_, node->p_ + LEN, 1.0 / LEN);
+  node->v_ =
+      evaluator_ == kHeuristics ? SimpleHeuristics(node->chessboard_) : 0;
+}
+
 void MCTS::BackupFromLeaf(MCTSNode* node) {
   double delta_v = node->v();
   while (node != nullptr) {
@@ -197,4 +400,6 @@ void MCTS::CheckVlossCnt(MCTSNode* node) {
     }
     CheckVlossCnt(new_node);
   }
-}
\ No newline at end of file
+}
+
+}  // namespace GOBANG_NS
@@ -1,22 +1,78 @@
 #ifndef MCTS_MCTS_H_
 #define MCTS_MCTS_H_
 
+#include <atomic>
+#include <cstdint>
+
 #include "chessboard.h"
+#include "inference_pipeline.h"
 #include "mcts_node.h"
 #include "static_queue.h"
 
+namespace GOBANG_NS {
+
 class MCTS {
  public:
   using PolicyCallback = std::function<void(int n, char** chessboards,
                                             double** probs, double** vs)>;
 
+  // leaf evaluators built into the library, which never call back into the
+  // policy callback
+  enum Evaluator {
+    // evaluates leaves with the policy callback
+    kCallback = 0,
+    // uniform prior and zero value
+    kUniform = 1,
+    // uniform prior and the value of SimpleHeuristics
+    kHeuristics = 2,
+  };
+
+  // statistics of the children of the root, indexed by x * CHESSBOARD_SIZE + y,
+  // refreshed after every search and step, so that they can be read in place
+  struct RootStats {
+    int32_t n[CHESSBOARD_SIZE * CHESSBOARD_SIZE];
+    // from the perspective of the player to move at the root
+    double q[CHESSBOARD_SIZE * CHESSBOARD_SIZE];
+    double p[CHESSBOARD_SIZE * CHESSBOARD_SIZE];
+    int32_t vloss_cnt[CHESSBOARD_SIZE * CHESSBOARD_SIZE];
+    // the principal variation following the most visited children
+    int32_t pv[CHESSBOARD_SIZE * CHESSBOARD_SIZE][2];
+    int32_t pv_length;
+  };
+
   MCTS(const Chessboard& chessboard, double vloss, int batch_size,
-       const PolicyCallback& policy);
+       const PolicyCallback& policy, Evaluator evaluator = kCallback);
 
-  void Search(int num_sims, double cpuct, double dirichlet_alpha);
+  ~MCTS();
 
+  // returns the number of simulations actually performed, which is less than
+  // num_sims if the search has been interrupted
+  int Search(int num_sims, double cpuct, double dirichlet_alpha);
+
+  // thread safe, makes the running and the following searches return as soon
+  // as the pending batch has been backed up
+  inline void set_interrupted(bool interrupted) {
+    interrupted_.store(interrupted);
+  }
+
+  // O(1), the discarded subtrees are freed by NodeReclaimer unless deferred
+  // reclamation is turned off
   void StepForward(int x, int y);
 
+  // restarts from chessboard, the tree is discarded like in StepForward and
+  // the interruption is cleared, so that one MCTS can be reused for many
+  // positions without reallocating its buffers
+  void Reset(const Chessboard& chessboard);
+
+  // the number of batches in flight including the one being selected, the
+  // others are evaluated on a worker thread in the meantime, 1 evaluates every
+  // batch synchronously, only kCallback is pipelined
+  void set_pipeline_depth(int depth);
+
+  inline void set_deferred_reclamation(bool deferred) {
+    deferred_reclamation_ = deferred;
+  }
+
   bool terminated();
 
   void chessboard(char* ptr);
@@ -25,15 +81,36 @@ class MCTS {
 
   double v();
 
+  inline const RootStats& root_stats() const { return root_stats_; }
+
+  // the tree is pruned to 3/4 of the budget once it holds more nodes,
+  // 0 means unlimited
+  inline void set_node_budget(int64_t node_budget) {
+    node_budget_ = node_budget;
+  }
+
+  inline int64_t num_nodes() const {
+    return root_ == nullptr ? 0 : root_->subtree_size();
+  }
+
+  inline int64_t num_bytes() const { return num_nodes() * sizeof(MCTSNode); }
+
  private:
   Chessboard chessboard_;
   PolicyCallback policy_;
+  Evaluator evaluator_;
   double p_noise_[CHESSBOARD_SIZE * CHESSBOARD_SIZE];
   std::unique_ptr<MCTSNode> root_;
   StaticQueue<MCTSNode*, CHESSBOARD_SIZE * CHESSBOARD_SIZE> task_queue_;
 
   double vloss_;
   int batch_size_;
+  std::atomic<bool> interrupted_;
+  RootStats root_stats_;
+  bool deferred_reclamation_;
+  int64_t node_budget_;
+  int pipeline_depth_;
+  std::unique_ptr<InferencePipeline> pipeline_;
 
   void Simulate(double cpuct);
 
@@ -41,11 +118,34 @@ class MCTS {
 
   void DispatchBatchInference();
 
+  // evaluates the batch in task_queue_ synchronously, or submits it to the
+  // pipeline and waits until less than pipeline_depth_ batches are in flight
+  void FlushBatch();
+
+  void WaitForEvaluation(MCTSNode* node);
+
+  void SubmitTaskQueue();
+
+  void CompleteOldestBatch();
+
+  // evaluates and backs up every pending leaf
+  void Drain();
+
+  void EvaluateNatively(MCTSNode* node);
+
   void EnsureRoot();
 
+  void UpdateRootStats();
+
+  void Discard(std::unique_ptr<MCTSNode> node);
+
+  void Prune();
+
   void AllocateNoise(double alpha);
 
   void CheckVlossCnt(MCTSNode *node);
 };
 
-#endif
\ No newline at end of file
+}  // namespace GOBANG_NS
+
+#endif
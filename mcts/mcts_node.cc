@@ -2,6 +2,8 @@
 
 #include <cmath>
 
+namespace GOBANG_NS {
+
 MCTSNode::MCTSNode(const Chessboard &chessboard, MCTSNode *father)
     : chessboard_(chessboard), father_(father) {
   std::fill(childs_, childs_ + CHESSBOARD_SIZE * CHESSBOARD_SIZE, nullptr);
@@ -18,20 +20,16 @@ MCTSNode::MCTSNode(const Chessboard &chessboard, MCTSNode *father)
   n_ = 0;
   sigma_v_ = 0;
   vloss_cnt_ = 0;
+  subtree_size_ = 1;
 }
 
 bool MCTSNode::Expand(int x, int y) {
   if (childs_[Index(x, y)] != nullptr) return false;
 
-  int half = CHESSBOARD_SIZE * CHESSBOARD_SIZE;
-  Chessboard new_chessboard;
-  std::copy(chessboard_.Data(), chessboard_.Data() + half,
-            new_chessboard.Data() + half);
-  std::copy(chessboard_.Data() + half, chessboard_.Data() + 2 * half,
-            new_chessboard.Data());
-  new_chessboard.Set(1, x, y);
-
-  childs_[Index(x, y)].reset(new MCTSNode(new_chessboard, this));
+  childs_[Index(x, y)].reset(new MCTSNode(chessboard_.NextState(x, y), this));
+  for (auto node = this; node != nullptr; node = node->father_) {
+    node->subtree_size_ += 1;
+  }
   return true;
 }
 
@@ -76,4 +74,6 @@ std::pair<int, int> MCTSNode::Select(double cpuct, double vloss) {
     }
 
   return ans;
-}
\ No newline at end of file
+}
+
+}  // namespace GOBANG_NS
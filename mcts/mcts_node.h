@@ -11,8 +11,11 @@
 #include "config.h"
 #include "static_queue.h"
 
+namespace GOBANG_NS {
+
 class MCTSNode {
   friend class MCTS;
+  friend class InferencePipeline;
 
  public:
   MCTSNode(const Chessboard &chessboard, MCTSNode *father);
@@ -47,6 +50,9 @@ class MCTSNode {
   inline void inc_vloss_cnt() { vloss_cnt_ += 1; }
   inline void dec_vloss_cnt() { vloss_cnt_ -= 1; }
 
+  // the number of nodes in the subtree, including this node
+  inline int subtree_size() const { return subtree_size_; }
+
   Chessboard chessboard() const { return chessboard_; }
 
  private:
@@ -66,6 +72,9 @@ class MCTSNode {
   double sigma_v_;
   int n_;
   int vloss_cnt_;
+  int subtree_size_;
 };
 
-#endif
\ No newline at end of file
+}  // namespace GOBANG_NS
+
+#endif
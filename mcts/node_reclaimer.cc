@@ -0,0 +1,77 @@
+#include "node_reclaimer.h"
+
+#ifdef _WIN32
+#include <process.h>
+#define getpid _getpid
+#else
+#include <sys/resource.h>
+#include <sys/syscall.h>
+#include <unistd.h>
+#endif
+
+#include <vector>
+
+namespace GOBANG_NS {
+
+NodeReclaimer* NodeReclaimer::Instance() {
+  static std::mutex mu;
+  static NodeReclaimer* instance = nullptr;
+  static int pid = 0;
+
+  std::lock_guard<std::mutex> lock(mu);
+  if (instance == nullptr || pid != getpid()) {
+    // the thread of the parent does not survive fork, the old instance is
+    // leaked on purpose, as is the instance at exit
+    instance = new NodeReclaimer();
+    pid = getpid();
+  }
+  return instance;
+}
+
+NodeReclaimer::NodeReclaimer() {
+  thread_ = std::thread(&NodeReclaimer::Loop, this);
+  thread_.detach();
+}
+
+void NodeReclaimer::Discard(std::unique_ptr<MCTSNode> node) {
+  if (node == nullptr) return;
+  {
+    std::lock_guard<std::mutex> lock(mu_);
+    queue_.push_back(std::move(node));
+  }
+  cv_.notify_one();
+}
+
+void NodeReclaimer::Destroy(std::unique_ptr<MCTSNode> node) {
+  std::vector<std::unique_ptr<MCTSNode>> stack;
+  if (node != nullptr) stack.push_back(std::move(node));
+  while (!stack.empty()) {
+    auto top = std::move(stack.back());
+    stack.pop_back();
+    for (int x = 0; x < CHESSBOARD_SIZE; x++)
+      for (int y = 0; y < CHESSBOARD_SIZE; y++) {
+        auto child = top->child_ownership(x, y);
+        if (child != nullptr) stack.push_back(std::move(child));
+      }
+    // top has no children left when it is destroyed here
+  }
+}
+
+void NodeReclaimer::Loop() {
+#ifdef __linux__
+  // freeing memory should not preempt the searching threads
+  setpriority(PRIO_PROCESS, syscall(SYS_gettid), 19);
+#endif
+  for (;;) {
+    std::unique_ptr<MCTSNode> node;
+    {
+      std::unique_lock<std::mutex> lock(mu_);
+      cv_.wait(lock, [this] { return !queue_.empty(); });
+      node = std::move(queue_.front());
+      queue_.pop_front();
+    }
+    Destroy(std::move(node));
+  }
+}
+
+}  // namespace GOBANG_NS
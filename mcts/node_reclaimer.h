@@ -0,0 +1,40 @@
+#ifndef MCTS_NODE_RECLAIMER_H_
+#define MCTS_NODE_RECLAIMER_H_
+
+#include <condition_variable>
+#include <deque>
+#include <memory>
+#include <mutex>
+#include <thread>
+
+#include "mcts_node.h"
+
+namespace GOBANG_NS {
+
+// Frees discarded subtrees on a background thread, so that dropping a subtree
+// is O(1) for the searching thread. Subtrees are destroyed iteratively, so
+// deep trees cannot overflow the stack.
+class NodeReclaimer {
+ public:
+  // the reclaimer of the current process, a new one is started after fork
+  static NodeReclaimer* Instance();
+
+  void Discard(std::unique_ptr<MCTSNode> node);
+
+  // frees the subtree on the calling thread
+  static void Destroy(std::unique_ptr<MCTSNode> node);
+
+ private:
+  NodeReclaimer();
+
+  void Loop();
+
+  std::mutex mu_;
+  std::condition_variable cv_;
+  std::deque<std::unique_ptr<MCTSNode>> queue_;
+  std::thread thread_;
+};
+
+}  // namespace GOBANG_NS
+
+#endif
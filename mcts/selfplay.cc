@@ -0,0 +1,108 @@
+#include "selfplay.h"
+
+#include <algorithm>
+#include <cmath>
+#include <cstring>
+#include <random>
+
+namespace GOBANG_NS {
+
+namespace {
+
+constexpr int LEN = CHESSBOARD_SIZE * CHESSBOARD_SIZE;
+
+void PackChessboard(const char* chessboard, uint8_t* out) {
+  // np.packbits, the first stone is the most significant bit
+  std::fill(out, out + kPackedChessboardBytes, 0);
+  for (int i = 0; i < 2 * LEN; i++)
+    if (chessboard[i] > 0) out[i / 8] |= 0x80 >> (i % 8);
+}
+
+double ResignScore(MCTS* mcts) {
+  const auto& stats = mcts->root_stats();
+  int most_visited = std::max_element(stats.n, stats.n + LEN) - stats.n;
+  return std::max(mcts->v(), stats.q[most_visited]);
+}
+
+bool ShouldResign(const SelfPlayConfig& config, const double* scores,
+                  int move) {
+  if (config.resign_consecutive_moves <= 0) return false;
+  int k = 0;
+  for (int i = move; i >= 0 && k < config.resign_consecutive_moves; i -= 2) {
+    if (std::isnan(scores[i])) continue;
+    if (scores[i] >= config.resign_threshold) return false;
+    k++;
+  }
+  return k == config.resign_consecutive_moves;
+}
+
+// like gobang_utils.action_from_prob, but never falls back to a move of
+// probability 0
+int SampleMove(const double* pi, std::mt19937_64* rng) {
+  double r = std::uniform_real_distribution<double>(0, 1)(*rng);
+  int move = LEN - 1;
+  for (int i = 0; i < LEN; i++) {
+    if (pi[i] <= 0) continue;
+    move = i;
+    if (r < pi[i]) break;
+    r -= pi[i];
+  }
+  return move;
+}
+
+}  // namespace
+
+void SelfPlay(MCTS* mcts, const SelfPlayConfig& config, char* records,
+              double* scores, SelfPlayResult* result) {
+  std::mt19937_64 rng(config.seed);
+  std::uniform_real_distribution<double> uniform(0, 1);
+  char chessboard[2 * LEN];
+  double pi[LEN];
+  float p[LEN];
+
+  result->num_records = 0;
+  result->num_sims = 0;
+  result->resigned = false;
+
+  int move = config.first_move;
+  while (!mcts->terminated()) {
+    char* record = records + result->num_records * kRecordBytes;
+    mcts->chessboard(chessboard);
+    PackChessboard(chessboard, reinterpret_cast<uint8_t*>(record));
+
+    bool full_search = uniform(rng) < config.full_search_prob;
+    if (full_search) {
+      result->num_sims += mcts->Search(
+          config.num_sims, config.cpuct,
+          move >= config.noise_from_move ? config.dirichlet_alpha : -1);
+    } else {
+      result->num_sims += mcts->Search(config.fast_num_sims, config.cpuct, -1);
+    }
+    mcts->GetPi(move < config.temperature_moves ? 1 : 0, pi);
+    std::copy(pi, pi + LEN, p);
+    std::memcpy(record + kPackedChessboardBytes, p, sizeof(p));
+    record[kRecordBytes - 1] = full_search;
+    result->num_records++;
+
+    scores[move] = ResignScore(mcts);
+    if (result->resign_move < 0 && ShouldResign(config, scores, move)) {
+      result->resign_move = move;
+      result->resigned = !config.playout;
+    }
+    if (result->resigned) break;
+
+    int action = SampleMove(pi, &rng);
+    mcts->StepForward(action / CHESSBOARD_SIZE, action % CHESSBOARD_SIZE);
+    move++;
+  }
+  result->num_moves = move;
+
+  // the game ends with the move of the winner or a draw
+  float v = result->resigned ? -1 : -mcts->v();
+  for (int i = result->num_records - 1; i >= 0; i--) {
+    std::memcpy(records + i * kRecordBytes + kRecordBytes - 5, &v, sizeof(v));
+    v = -v;
+  }
+}
+
+}  // namespace GOBANG_NS
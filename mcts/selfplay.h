@@ -0,0 +1,30 @@
+#ifndef MCTS_SELFPLAY_H_
+#define MCTS_SELFPLAY_H_
+
+#include <cstdint>
+
+#include "config.h"
+#include "engine.h"
+#include "mcts.h"
+
+namespace GOBANG_NS {
+
+// the layout of records.record_dtype(CHESSBOARD_SIZE): the np.packbits of the
+// chessboard, float32 p, float32 v and bool full_search, without padding
+constexpr int kPackedChessboardBytes =
+    (2 * CHESSBOARD_SIZE * CHESSBOARD_SIZE + 7) / 8;
+constexpr int kRecordBytes = kPackedChessboardBytes +
+                             4 * CHESSBOARD_SIZE * CHESSBOARD_SIZE + 4 + 1;
+
+// plays the game on mcts until it ends or the player to move resigns, and
+// packs a record of every position into records, which holds
+// CHESSBOARD_SIZE * CHESSBOARD_SIZE records. scores[i] is the resignation
+// score of move i, NaN if it has not been searched, the scores before
+// first_move are read to resign. v is filled in from the end of the game.
+// the policy callback of mcts is the only call back into the caller.
+void SelfPlay(MCTS* mcts, const SelfPlayConfig& config, char* records,
+              double* scores, SelfPlayResult* result);
+
+}  // namespace GOBANG_NS
+
+#endif
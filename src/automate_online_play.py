@@ -3,29 +3,35 @@ import os
 import logging
 import time
 import random
+import shlex
+import struct
+import subprocess
 
 import numpy as np
-from PIL import Image
 
 from players import NNMCTSAIPlayer
+from opening_book import load_opening_book
 from gobang_utils import config_log
 from gobang_vis import chessboard_str
 
 from config import ADB
 
-def get_median_color(img, xy, radius) -> np.array:
-    img = img.crop(
-        (xy[0] - radius, xy[1] - radius,
-         xy[0] + radius, xy[1] + radius)
-    )
-    arr = np.array(img.getdata())
-    color = np.median(arr, axis=0)[:-1]
-    return color
+def parse_raw_screencap(data: bytes) -> np.array:
+    """Decodes the output of "screencap" without -p into a (height, width, 4) RGBA array.
+    The header holds width, height and format, followed by a color space on newer devices.
+    """
+    width, height, _ = struct.unpack("<III", data[:12])
+    header_size = len(data) - width * height * 4
+    if header_size not in [12, 16]:
+        raise ValueError("unexpected screencap size {}".format(len(data)))
+    return np.frombuffer(data, dtype=np.uint8, offset=header_size)\
+        .reshape((height, width, 4))
 
 
 class OnlinePlatform:
-    def __init__(self, adb_device_id: Optional[str]):
+    def __init__(self, adb_device_id: Optional[str], adb: str = ADB):
         self.adb_device_id = adb_device_id
+        self.adb = adb
 
     def _device_str(self):
         if self.adb_device_id is None:
@@ -34,35 +40,33 @@ class OnlinePlatform:
             return "-s {}".format(self.adb_device_id)
 
     def _shell(self, cmd):
-        cmd = "{} {} shell {}".format(ADB, self._device_str(), cmd)
+        cmd = "{} {} shell {}".format(self.adb, self._device_str(), cmd)
         ret = os.system(cmd)
         if ret != 0:
             logging.warning("{} = {}".format(ret, cmd))
         return ret
 
-    def _pull(self, path):
+    def capture(self) -> Optional[np.array]:
+        """Streams a raw screenshot from the device into memory."""
+        cmd = shlex.split(self.adb) + shlex.split(self._device_str()) + ["exec-out", "screencap"]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            logging.warning("{} = {}".format(proc.returncode, " ".join(cmd)))
+            return None
         try:
-            os.makedirs("tmp")
-        except FileExistsError:
-            ...
-        cmd = "{} {} pull {} tmp".format(ADB, self._device_str(), path)
-        ret = os.system(cmd)
-        if ret != 0:
-            logging.warning("{} = {}".format(ret, cmd))
-        return ret
+            return parse_raw_screencap(proc.stdout)
+        except (ValueError, struct.error) as e:
+            logging.warning("cannot decode the screenshot: {}".format(e))
+            return None
 
     def wait_on_chessboard(self) -> Tuple[int, np.array]:
         while True:
-            ret = 1
-            while ret != 0:
-                ret = self._shell("screencap -p /sdcard/tmp/screenshot.png")
-                time.sleep(0.1)
-            ret = 1
-            while ret != 0:
-                ret = self._pull("/sdcard/tmp/screenshot.png")
+            img = self.capture()
+            while img is None:
                 time.sleep(0.1)
+                img = self.capture()
 
-            who, chessboard = self._detect_chessboard("tmp/screenshot.png")
+            who, chessboard = self._detect_chessboard(img)
             if who == 0:
                 if chessboard[1, :, :].sum() >= chessboard[0, :, :].sum():
                     return who, chessboard
@@ -75,7 +79,7 @@ class OnlinePlatform:
             logging.info("waiting for the opponent to place stone")
             time.sleep(0.5)
 
-    def _detect_chessboard(self, img_path: str) -> Tuple[int, np.array]:
+    def _detect_chessboard(self, img: np.array) -> Tuple[int, np.array]:
         raise NotImplementedError()
         return -1, np.empty((0,))
 
@@ -92,7 +96,28 @@ class TencentHappyGomoku(OnlinePlatform):
     Now it is only tested under MI 8 SE.
     """
 
-    def _chess_coordiante_at(self, x, y):
+    CHESS_RADIUS = 57.0 / 2
+    ROLE_LOCS = [(858, 1860), (230, 418)]
+    # the median color of a cell is estimated from SAMPLES x SAMPLES pixels
+    SAMPLES = 9
+    # cells whose sampled pixels change less than this are not re-detected
+    CHANGE_THRESHOLD = 8
+
+    def __init__(self, adb_device_id: Optional[str], adb: str = ADB):
+        super().__init__(adb_device_id, adb)
+        centers = [self._chess_coordiante_at(x, y) for x in range(15) for y in range(15)]
+        centers += self.ROLE_LOCS
+        centers = np.array(centers)
+        offsets = np.linspace(-self.CHESS_RADIUS, self.CHESS_RADIUS - 1, self.SAMPLES)
+        dx, dy = np.meshgrid(offsets, offsets)
+        # (cells, samples) pixel coordinates of the sampled grid
+        self.sample_xs = np.round(centers[:, 0:1] + dx.reshape((1, -1))).astype(np.int64)
+        self.sample_ys = np.round(centers[:, 1:2] + dy.reshape((1, -1))).astype(np.int64)
+        self.prev_samples = None
+        self.prev_brightness = None
+
+    @staticmethod
+    def _chess_coordiante_at(x, y):
         left = 42
         top = 696
         grid_height = 930.0 / 14
@@ -106,32 +131,36 @@ class TencentHappyGomoku(OnlinePlatform):
         time.sleep(0.1 + random.random() * 0.1)
         self._shell(cmd)
 
-    def _detect_chessboard(self, img_path: str) -> Tuple[int, np.array]:
-        img = Image.open(img_path)
-        chess_radius = 57.0 / 2
+    def _cell_brightness(self, img: np.array) -> np.array:
+        """Average over channels of the median color of every cell and role location,
+        only recomputing the cells which changed since the previous frame.
+        """
+        samples = img[self.sample_ys, self.sample_xs, :3].astype(np.int16)
+        if self.prev_samples is None or self.prev_samples.shape != samples.shape:
+            changed = np.ones((samples.shape[0],), dtype=bool)
+            brightness = np.zeros((samples.shape[0],))
+        else:
+            changed = np.abs(samples - self.prev_samples).max(axis=(1, 2)) > self.CHANGE_THRESHOLD
+            brightness = self.prev_brightness.copy()
+        if changed.any():
+            brightness[changed] = np.median(samples[changed], axis=1).mean(axis=-1) / 255
+        self.prev_samples = samples
+        self.prev_brightness = brightness
+        return brightness
+
+    def _detect_chessboard(self, img: np.array) -> Tuple[int, np.array]:
+        brightness = self._cell_brightness(img)
+        cells = brightness[:225].reshape((15, 15))
 
         chessboard = np.zeros((2, 15, 15)).astype(np.float32)
+        # black
+        chessboard[0][cells < 0.65] = 1
+        # white
+        chessboard[1][cells > 0.9] = 1
 
-        for i in range(15):
-            for j in range(15):
-                c = get_median_color(
-                    img, self._chess_coordiante_at(i, j),
-                    chess_radius
-                )
-                avg_c = np.average(c) / 255
-
-                if avg_c < 0.65:
-                    # black
-                    chessboard[0, i, j] = 1
-                elif avg_c > 0.9:
-                    # white
-                    chessboard[1, i, j] = 1
-
-        ROLE_LOCS = [(858, 1860), (230, 418)]
         roles = [-1] * 2
         for i in range(2):
-            c = get_median_color(img, ROLE_LOCS[i], chess_radius)
-            avg_c = np.average(c) / 255
+            avg_c = brightness[225 + i]
             if avg_c < 0.65:
                 # black
                 roles[i] = 0
@@ -158,7 +187,8 @@ class TencentHappyGomoku(OnlinePlatform):
 if __name__ == "__main__":
     config_log(None)
     platform = TencentHappyGomoku(None)
-    player = NNMCTSAIPlayer("/home/fucong/playground/rl-gobang/41270.pt")
+    player = NNMCTSAIPlayer(
+        "/home/fucong/playground/rl-gobang/41270.pt", ponder=True, book=load_opening_book())
 
     just_restarted = False
     while True:
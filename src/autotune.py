@@ -0,0 +1,151 @@
+from typing import List
+import argparse
+import json
+import logging
+import os
+import random
+import time
+
+import numpy as np
+import torch
+
+from config import \
+    CHESSBOARD_SIZE, CKPT_DIR, HOST_PROFILE_PATH, SELFPLAY_CPUCT, \
+    SELFPLAY_MCTS_BATCH, MCTS_VLOSS
+from gobang_utils import config_log, mcts_nn_policy_generator
+from mcts import MCTS, native_greedy_scores
+from resnet import ResNet, load_ckpt
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64, 128]
+VLOSSES = [0.25, 0.5, 1, 2, 3]
+
+
+def calibration_positions(num_positions: int, seed: int = 0) -> List[np.array]:
+    """A fixed set of positions from the perspective of the player to move,
+    played by the greedy scores among the 3 best moves from the center.
+    """
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < num_positions:
+        chessboard = np.zeros((2, CHESSBOARD_SIZE, CHESSBOARD_SIZE), dtype=np.float32)
+        chessboard[0, CHESSBOARD_SIZE // 2, CHESSBOARD_SIZE // 2] = 1
+        chessboard = chessboard[::-1].copy()
+        for _ in range(rng.randint(3, 20)):
+            scores = native_greedy_scores(chessboard).reshape((-1,))
+            x, y = divmod(int(rng.choice(np.argsort(-scores)[:3])), CHESSBOARD_SIZE)
+            chessboard[0, x, y] = 1
+            chessboard = chessboard[::-1].copy()
+        positions.append(chessboard)
+    return positions
+
+
+def tune_batch_size(network, device_id: str, tolerance: float) -> dict:
+    """Measures the latency of the network against the batch size.
+    Returns the smallest batch size within tolerance of the best positions/sec,
+    since larger batches make the search less selective.
+    """
+    throughputs = {}
+    with torch.no_grad():
+        for batch_size in BATCH_SIZES:
+            i = torch.rand((batch_size, 2, CHESSBOARD_SIZE, CHESSBOARD_SIZE), device=device_id)
+            for _ in range(3):
+                network(i)
+            repeat = max(4, 256 // batch_size)
+            if device_id.startswith("cuda"):
+                torch.cuda.synchronize(device_id)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                network(i)[1].cpu()
+            latency = (time.perf_counter() - start) / repeat
+            throughputs[batch_size] = batch_size / latency
+            logging.info("batch size {}: latency {:.2f} ms, {:.0f} positions/sec".format(
+                batch_size, latency * 1e3, throughputs[batch_size]))
+    best = max(throughputs.values())
+    batch_size = min(b for b, t in throughputs.items() if t >= (1 - tolerance) * best)
+    return {"batch_size": batch_size, "positions/sec": throughputs}
+
+
+def tune_vloss(policy, positions, batch_size: int, num_sims: int) -> dict:
+    """Searches the positions with each virtual loss at batch_size and
+    returns the virtual loss whose most visited moves agree the most with
+    a search of the same number of simulations without batching.
+    """
+    def best_move(t):
+        t.search(num_sims, SELFPLAY_CPUCT, None)
+        return int(t.root_stats().n.argmax())
+
+    with torch.no_grad():
+        references = [best_move(MCTS(position, 1, 1, policy)) for position in positions]
+        agreements = {}
+        for vloss in VLOSSES:
+            t = MCTS(positions[0], vloss, batch_size, policy)
+            agree = 0
+            for position, reference in zip(positions, references):
+                t.reset(position)
+                agree += best_move(t) == reference
+            agreements[vloss] = agree / len(positions)
+            logging.info("vloss {}: agreement {:.1%}".format(vloss, agreements[vloss]))
+    # the smallest virtual loss among the best ones
+    vloss = min(v for v, a in agreements.items() if a == max(agreements.values()))
+    return {"vloss": vloss, "agreements": agreements}
+
+
+def local_devices() -> List[str]:
+    if torch.cuda.is_available():
+        return ["cuda:{}".format(i) for i in range(torch.cuda.device_count())]
+    return ["cpu"]
+
+
+if __name__ == "__main__":
+    config_log(None)
+    parser = argparse.ArgumentParser(
+        description="measures the MCTS batch size and virtual loss for this host")
+    parser.add_argument("--ckpt", help="defaults to the best ckpt, or a random network")
+    parser.add_argument("--num-positions", type=int, default=32)
+    parser.add_argument("--num-sims", type=int, default=400)
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="the throughput the batch size may give up")
+    parser.add_argument("--workers-per-device", type=int, default=3)
+    parser.add_argument("--output", default=HOST_PROFILE_PATH)
+    args = parser.parse_args()
+
+    devices = local_devices()
+    device_id = devices[0]
+    ckpt_path = args.ckpt
+    if ckpt_path is None and os.path.isfile(os.path.join(CKPT_DIR, "best")):
+        with open(os.path.join(CKPT_DIR, "best"), "r") as f:
+            ckpt_path = os.path.join(CKPT_DIR, "{}.pt".format(int(f.read())))
+    network = load_ckpt(ckpt_path, device_id) if ckpt_path is not None \
+        else ResNet().to(device_id)
+    network.eval()
+    logging.info("tuning on {} with {}".format(device_id, ckpt_path or "a random network"))
+
+    batch = tune_batch_size(network, device_id, args.tolerance)
+    vloss = tune_vloss(
+        mcts_nn_policy_generator(network, device_id),
+        calibration_positions(args.num_positions), batch["batch_size"], args.num_sims)
+    logging.info("batch size {} (was {}), vloss {} (was {})".format(
+        batch["batch_size"], SELFPLAY_MCTS_BATCH, vloss["vloss"], MCTS_VLOSS))
+
+    profile = {
+        "SELFPLAY_MCTS_BATCH": batch["batch_size"],
+        # the evaluator and the players search one tree at a time like self-play
+        "EVAL_MCTS_BATCH": batch["batch_size"],
+        "PLAYER_MCTS_BATCH": batch["batch_size"],
+        "MCTS_VLOSS": vloss["vloss"],
+        "SELF_PLAY_DEVICE_IDS": [
+            device for device in devices for _ in range(args.workers_per_device)],
+        "INFER_DEVICE_ID": device_id,
+        "TRAIN_DEVICE_ID": devices[-1],
+        # the measurements the profile has been derived from
+        "calibration": {
+            "ckpt": ckpt_path,
+            "positions/sec": batch["positions/sec"],
+            "agreements": vloss["agreements"],
+            "num_sims": args.num_sims,
+        },
+    }
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(profile, f, indent=2)
+    logging.info("the profile has been written to {}".format(args.output))
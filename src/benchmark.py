@@ -0,0 +1,413 @@
+import argparse
+import logging
+import os
+import socket
+import sys
+import time
+
+import numpy as np
+
+from gobang_utils import config_log
+
+
+def _timeit(fn, repeat: int) -> float:
+    """Returns the average seconds of fn over repeat calls."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_online(args):
+    """Per-move latency of the online bot against fake_adb."""
+    from PIL import Image
+    from automate_online_play import TencentHappyGomoku
+    import fake_adb
+
+    frames_dir = os.path.join("tmp", "fake_adb")
+    if not os.path.isdir(frames_dir):
+        fake_adb.generate(frames_dir, 40, 0)
+    os.environ["FAKE_ADB_FRAMES"] = frames_dir
+    platform = TencentHappyGomoku(
+        None, adb="{} {}".format(sys.executable, os.path.join("src", "fake_adb.py")))
+
+    frames = [platform.capture() for _ in range(args.repeat)]
+    capture = _timeit(platform.capture, args.repeat)
+
+    def detect_full():
+        platform.prev_samples = None
+        for frame in frames:
+            platform._detect_chessboard(frame)
+            platform.prev_samples = None
+
+    def detect_incremental():
+        for frame in frames:
+            platform._detect_chessboard(frame)
+
+    def detect_legacy():
+        # crops and takes the median of every cell with PIL, as before the sampled grid
+        img = Image.fromarray(frames[0])
+        r = TencentHappyGomoku.CHESS_RADIUS
+        centers = [platform._chess_coordiante_at(x, y) for x in range(15) for y in range(15)]
+        for x, y in centers + TencentHappyGomoku.ROLE_LOCS:
+            arr = np.array(img.crop((x - r, y - r, x + r, y + r)).getdata())
+            np.median(arr, axis=0)
+
+    logging.info("capture: {:.2f} ms".format(capture * 1e3))
+    logging.info("legacy detection: {:.2f} ms".format(_timeit(detect_legacy, 1) * 1e3))
+    logging.info("full detection: {:.2f} ms".format(
+        _timeit(detect_full, 1) / len(frames) * 1e3))
+    logging.info("incremental detection: {:.2f} ms".format(
+        _timeit(detect_incremental, 1) / len(frames) * 1e3))
+
+
+def bench_step_forward(args):
+    """Latency of MCTS.step_forward after a search, with the discarded subtrees
+    freed synchronously or deferred to the reclamation thread.
+    """
+    from mcts import MCTS, EVALUATOR_HEURISTICS
+    from config import CHESSBOARD_SIZE
+
+    chessboard = np.zeros((2, CHESSBOARD_SIZE, CHESSBOARD_SIZE), dtype=np.float32)
+    for deferred in [False, True]:
+        latencies = []
+        for _ in range(args.repeat):
+            t = MCTS(chessboard, 1, 8, None, EVALUATOR_HEURISTICS)
+            t.set_deferred_reclamation(deferred)
+            t.search(args.num_sims, 2.5, None)
+            pi = t.get_pi(0)
+            x, y = np.unravel_index(pi.argmax(), pi.shape)
+            start = time.perf_counter()
+            t.step_forward(x, y)
+            latencies.append(time.perf_counter() - start)
+        logging.info("{} reclamation, {} sims: step_forward {:.3f} ms (max {:.3f} ms)".format(
+            "deferred" if deferred else "synchronous", args.num_sims,
+            np.mean(latencies) * 1e3, np.max(latencies) * 1e3))
+
+
+def bench_session(args):
+    """Latency of creating an MCTS against resetting an existing one,
+    the trees are searched before every reset so that there is a tree to recycle.
+    """
+    from mcts import MCTS, EVALUATOR_HEURISTICS
+    from config import CHESSBOARD_SIZE
+
+    chessboard = np.zeros((2, CHESSBOARD_SIZE, CHESSBOARD_SIZE), dtype=np.float32)
+    chessboard[0, CHESSBOARD_SIZE // 2, CHESSBOARD_SIZE // 2] = 1
+
+    construct = _timeit(lambda: MCTS(chessboard, 1, 8, None, EVALUATOR_HEURISTICS), args.repeat)
+    t = MCTS(chessboard, 1, 8, None, EVALUATOR_HEURISTICS)
+    latencies = []
+    for _ in range(args.repeat):
+        t.search(args.num_sims, 2.5, None)
+        start = time.perf_counter()
+        t.reset(chessboard)
+        latencies.append(time.perf_counter() - start)
+    logging.info("construction: {:.3f} ms, reset after {} sims: {:.3f} ms (max {:.3f} ms)".format(
+        construct * 1e3, args.num_sims, np.mean(latencies) * 1e3, np.max(latencies) * 1e3))
+
+
+def _stand_in_policy(latency: float):
+    """A policy of uniform priors and zero values which takes latency seconds
+    per batch, standing in for the network on hosts without a device.
+    """
+    def policy(chessboards):
+        time.sleep(latency)
+        n, size = chessboards.shape[0], chessboards.shape[-1]
+        return np.full((n, size, size), 1 / size ** 2, dtype=np.float32), \
+            np.zeros((n,), dtype=np.float32)
+    return policy
+
+
+def bench_pipeline(args):
+    """Sims/sec of a network guided search and the fraction of the wall time the
+    device spends in the network, from synchronous to pipelined inference.
+    With --policy-latency, a stand-in policy of that latency replaces the network.
+    """
+    from mcts import MCTS
+    from config import CHESSBOARD_SIZE, SELFPLAY_MCTS_BATCH, SELFPLAY_CPUCT, MCTS_VLOSS
+
+    if args.policy_latency is not None:
+        nn_policy = _stand_in_policy(args.policy_latency / 1e3)
+    else:
+        from gobang_utils import mcts_nn_policy_generator
+        from resnet import ResNet
+
+        network = ResNet().to(args.device)
+        network.eval()
+        nn_policy = mcts_nn_policy_generator(network, args.device)
+    busy = [0.0]
+
+    def policy(chessboard):
+        start = time.perf_counter()
+        ret = nn_policy(chessboard)
+        busy[0] += time.perf_counter() - start
+        return ret
+
+    chessboard = np.zeros((2, CHESSBOARD_SIZE, CHESSBOARD_SIZE), dtype=np.float32)
+    for depth in [1, 2, 3, 4]:
+        t = MCTS(chessboard, MCTS_VLOSS, SELFPLAY_MCTS_BATCH, policy)
+        t.set_pipeline_depth(depth)
+        busy[0] = 0
+        start = time.perf_counter()
+        num_sims = 0
+        for _ in range(args.repeat):
+            t.reset(chessboard)
+            num_sims += t.search(args.num_sims, SELFPLAY_CPUCT, None)
+        elapsed = time.perf_counter() - start
+        logging.info("pipeline depth {}: {:.0f} sims/sec, device busy {:.1%}".format(
+            depth, num_sims / elapsed, busy[0] / elapsed))
+
+
+def _synthetic_record_buffer(rng):
+    from config import CHESSBOARD_SIZE
+    from train import RecordBuffer
+
+    record_buffer = RecordBuffer(1024)
+    for _ in range(16):
+        chessboards = rng.integers(0, 2, size=(64, 2, CHESSBOARD_SIZE, CHESSBOARD_SIZE))
+        record_buffer.extend([{
+            "chessboard": chessboard,
+            "p": np.full((CHESSBOARD_SIZE, CHESSBOARD_SIZE), 1 / CHESSBOARD_SIZE ** 2),
+            "v": rng.choice([-1, 1]), "full_search": True
+        } for chessboard in chessboards])
+    return record_buffer
+
+
+def _train_rank(rank, num_ranks, port, args, result):
+    import torch
+    import torch.distributed as dist
+    from torch.nn.parallel import DistributedDataParallel
+    from config import TRAIN_BATCH_SIZE, TRAIN_LR
+    from resnet import ResNet
+    from train import FastTrainStep, train_step, init_data_parallel
+
+    torch.set_num_threads(args.threads_per_rank)
+    if num_ranks > 1:
+        init_data_parallel(rank, num_ranks, port)
+    record_buffer = _synthetic_record_buffer(np.random.default_rng(rank))
+    network = ResNet().to(args.device)
+    if num_ranks > 1:
+        network = DistributedDataParallel(network)
+    network.train()
+    optimizer = torch.optim.SGD(network.parameters(), lr=TRAIN_LR, weight_decay=1e-4)
+
+    if args.amp:
+        fast_step = FastTrainStep(network, optimizer, args.device, amp=True, compiled=False)
+
+    def step():
+        # the pacing of the replay ratio is not measured
+        if args.amp:
+            float(fast_step(record_buffer.sample(TRAIN_BATCH_SIZE, np.inf, precollated=True)))
+        else:
+            train_step(network, optimizer, record_buffer.sample(TRAIN_BATCH_SIZE, np.inf),
+                       args.device)
+
+    for _ in range(3):
+        step()
+    seconds = _timeit(step, args.repeat)
+    if rank == 0:
+        result.value = TRAIN_BATCH_SIZE * num_ranks / seconds
+    if num_ranks > 1:
+        dist.destroy_process_group()
+
+
+def bench_train_step(args):
+    """Samples/sec of the training step on synthetic positions, from the default step
+    adding the options of the throughput mode (TRAIN_FAST) one at a time.
+    """
+    import torch
+    from config import TRAIN_BATCH_SIZE, TRAIN_LR, TRAIN_PREFETCH_BATCHES
+    from resnet import ResNet
+    from train import BatchPrefetcher, FastTrainStep, train_step
+
+    batch_size = args.batch_size or TRAIN_BATCH_SIZE
+    record_buffer = _synthetic_record_buffer(np.random.default_rng(0))
+    options = [
+        ("default", {}),
+        ("+ pre-collated", {"precollated": True}),
+        ("+ pinned prefetch", {"prefetch": True}),
+        ("+ fused loss", {"fast": True}),
+        ("+ autocast", {"amp": True}),
+        ("+ compile", {"compiled": True}),
+    ]
+    option = {"precollated": False, "prefetch": False, "fast": False,
+              "amp": False, "compiled": False}
+    for name, update in options:
+        option.update(update)
+        network = ResNet().to(args.device)
+        network.train()
+        optimizer = torch.optim.SGD(network.parameters(), lr=TRAIN_LR, weight_decay=1e-4)
+        if option["prefetch"]:
+            # the pacing of the replay ratio is not measured
+            prefetcher = BatchPrefetcher(
+                record_buffer, batch_size, np.inf, TRAIN_PREFETCH_BATCHES,
+                args.device.startswith("cuda"))
+            sample = prefetcher.get
+        else:
+            def sample():
+                return record_buffer.sample(batch_size, np.inf, option["precollated"])
+        if option["fast"]:
+            step = FastTrainStep(network, optimizer, args.device, option["amp"], option["compiled"])
+        else:
+            def step(batch):
+                return train_step(network, optimizer, batch, args.device)
+
+        for _ in range(3):
+            step(sample())
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            loss = step(sample())
+        # waits for the steps queued on the device
+        float(loss)
+        elapsed = time.perf_counter() - start
+        logging.info("{}: {:.1f} samples/sec at batch size {}".format(
+            name, args.repeat * batch_size / elapsed, batch_size))
+
+
+def bench_train(args):
+    """Samples/sec of data-parallel training with 1 to --max-ranks ranks
+    on synthetic positions, each rank trains on TRAIN_BATCH_SIZE samples per step,
+    with --amp under the autocast of the throughput mode.
+    """
+    import multiprocessing as mp
+
+    ctx = mp.get_context("spawn")
+    for num_ranks in range(1, args.max_ranks + 1):
+        result = ctx.Value("d", 0)
+        # a fresh port per run, the port of the previous run may linger in TIME_WAIT
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        procs = [
+            ctx.Process(target=_train_rank, args=(rank, num_ranks, port, args, result))
+            for rank in range(num_ranks)
+        ]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        logging.info("{} ranks x {} threads{}: {:.1f} samples/sec".format(
+            num_ranks, args.threads_per_rank, ", autocast" if args.amp else "", result.value))
+
+
+def _produce_games(data_queue, num_games: int, game_length: int):
+    from config import CHESSBOARD_SIZE
+
+    rng = np.random.default_rng(os.getpid())
+    records = [{
+        "chessboard": rng.integers(0, 2, size=(2, CHESSBOARD_SIZE, CHESSBOARD_SIZE))
+        .astype(np.float32),
+        "p": np.full((CHESSBOARD_SIZE, CHESSBOARD_SIZE), 1 / CHESSBOARD_SIZE ** 2,
+                     dtype=np.float32),
+        "v": np.float32(1), "full_search": True
+    } for _ in range(game_length)]
+    for _ in range(num_games):
+        data_queue.put(records)
+
+
+def bench_transport(args):
+    """Records/sec from --producers self-play processes to the trainer,
+    through mp.Queue and through the shared-memory GameRing.
+    """
+    import multiprocessing as mp
+    from config import GAME_RING_SLOTS
+    from game_ring import GameRing
+
+    game_length = 60
+    num_games = args.repeat * 10
+    for name, data_queue in [("mp.Queue", mp.Queue(1 << 9)),
+                             ("GameRing", GameRing(max(GAME_RING_SLOTS, 1)))]:
+        procs = [
+            mp.Process(target=_produce_games, args=(data_queue, num_games, game_length))
+            for _ in range(args.producers)
+        ]
+        start = time.perf_counter()
+        for proc in procs:
+            proc.start()
+        for _ in range(num_games * args.producers):
+            data_queue.get()
+        elapsed = time.perf_counter() - start
+        for proc in procs:
+            proc.join()
+        logging.info("{}: {:.0f} records/sec with {} producers".format(
+            name, num_games * args.producers * game_length / elapsed, args.producers))
+
+
+def bench_game(args):
+    """Self-play games/sec of the per-move python loop self-play used to run against
+    MCTS.play_game, with the native heuristics as the evaluator so that only
+    the driver differs.
+    """
+    import random
+    from mcts import MCTS, EVALUATOR_HEURISTICS
+    from config import CHESSBOARD_SIZE
+    from gobang_utils import action_from_prob
+    from records import RECORD_DTYPE, pack_game
+
+    chessboard = np.zeros((2, CHESSBOARD_SIZE, CHESSBOARD_SIZE), dtype=np.float32)
+    fast_num_sims = max(args.num_sims // 8, 1)
+    t = MCTS(chessboard, 1, 8, None, EVALUATOR_HEURISTICS)
+
+    def python_game():
+        t.reset(chessboard)
+        records = []
+        i = 0
+        while not t.terminated():
+            full_search = random.random() < 0.25
+            t.search(args.num_sims if full_search else fast_num_sims, 3,
+                     0.03 if full_search and i >= 8 else None)
+            stats = t.root_stats()
+            max(float(t.v()), float(stats.q.flat[stats.n.argmax()]))
+            p = t.get_pi(float(i < 8))
+            records.append({"chessboard": t.chessboard(), "p": p, "v": None,
+                            "full_search": full_search})
+            t.step_forward(*action_from_prob(p))
+            i += 1
+        for record in records:
+            record["v"] = np.float32(0)
+        return pack_game(records)
+
+    def native_game():
+        t.reset(chessboard)
+        return t.play_game(args.num_sims, fast_num_sims, 0.25, 3, 0.03, 8, 8).records.tobytes()
+
+    for name, fn in [("python", python_game), ("native", native_game)]:
+        num_moves = 0
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            num_moves += len(fn()) // RECORD_DTYPE.itemsize
+        elapsed = time.perf_counter() - start
+        logging.info("{}: {:.1f} games/sec, {:.0f} moves/sec at {} sims".format(
+            name, args.repeat / elapsed, num_moves / elapsed, args.num_sims))
+
+
+BENCHMARKS = {
+    "online": bench_online,
+    "step_forward": bench_step_forward,
+    "session": bench_session,
+    "pipeline": bench_pipeline,
+    "train": bench_train,
+    "transport": bench_transport,
+    "game": bench_game,
+    "train_step": bench_train_step,
+}
+
+
+if __name__ == "__main__":
+    config_log(None)
+    parser = argparse.ArgumentParser(description="benchmark")
+    parser.add_argument("name", choices=list(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--num-sims", type=int, default=1600)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--max-ranks", type=int, default=4)
+    parser.add_argument("--threads-per-rank", type=int, default=1)
+    parser.add_argument("--producers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, help="defaults to TRAIN_BATCH_SIZE")
+    parser.add_argument("--amp", action="store_true",
+                        help="trains under autocast in the train benchmark")
+    parser.add_argument("--policy-latency", type=float,
+                        help="milliseconds per batch of a stand-in policy instead of the network")
+    args = parser.parse_args()
+    BENCHMARKS[args.name](args)
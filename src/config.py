@@ -1,40 +1,53 @@
-import ctypes
-import sys
+import json
+import os
+import socket
 
-# defines the game
-
-
-def _read_config_from_capi():
-    lib = ctypes.CDLL(
-        "bazel-bin/mcts/capi_shared.dll"
-        if sys.platform.startswith("win")
-        else "bazel-bin/mcts/capi_shared.so"
-    )
-
-    class Config(ctypes.Structure):
-        _fields_ = [
-            ("chessboard_size", ctypes.c_int),
-            ("in_a_row", ctypes.c_int),
-        ]
-
-    lib.global_GetConfig.argtypes = []
-    lib.global_GetConfig.restype = Config
-    ret = lib.global_GetConfig()
-    return ret.chessboard_size, ret.in_a_row
-
-
-CHESSBOARD_SIZE, IN_A_ROW = _read_config_from_capi()
+# defines the game, the native library searches any size of engine.supported_sizes(),
+# e.g. a network with SIZE_AGNOSTIC_HEADS can be bootstrapped on 9 before training on 15
+CHESSBOARD_SIZE = 15
+IN_A_ROW = 5
 
 # defines the network
 NUM_RESIDUAL_BLOCKS = 3
 NUM_FILTERS = 32
 VALUE_HEAD_HIDDEN_UNITS = 128
+# fully convolutional heads whose parameters do not depend on the size of the chessboard,
+# the checkpoints of the default heads only load on the size they have been trained on
+SIZE_AGNOSTIC_HEADS = False
+
+# the virtual loss of the searches with batched inference
+MCTS_VLOSS = 1
 
 # defines the self playing process
 SELFPLAY_NUM_SIMS = 1600
 SELFPLAY_CPUCT = 3
 SELFPLAY_ALPHA = 0.03
 SELFPLAY_MCTS_BATCH = 32
+# the first moves are sampled from the visits, the later ones are searched with
+# Dirichlet noise and played among the most visited moves
+SELFPLAY_TEMPERATURE_MOVES = 8
+SELFPLAY_NOISE_FROM_MOVE = 8
+# batches in flight during a self-play search, see MCTS.set_pipeline_depth
+SELFPLAY_PIPELINE_DEPTH = 2
+# playout cap randomization, the other moves are played after a fast search
+# of SELFPLAY_FAST_NUM_SIMS without noise and only serve as value targets
+SELFPLAY_FULL_SEARCH_PROB = 0.25
+SELFPLAY_FAST_NUM_SIMS = 200
+# self-play appends the leaf batches of its searches to a trace in this directory
+# for inference_trace.py, None disables tracing
+INFERENCE_TRACE_DIR = None
+INFERENCE_TRACE_MAX_BATCHES = 1 << 16
+# the player to move resigns once max(root value, q of the most visited move) stays below
+# the threshold on its last RESIGN_CONSECUTIVE_MOVES moves
+RESIGN_INIT_THRESHOLD = -0.9
+RESIGN_CONSECUTIVE_MOVES = 3
+# the fraction of games played out regardless, the threshold is recalibrated on them
+# to keep the rate of resigning games which would not have been lost below the target
+RESIGN_PLAYOUT_FRACTION = 0.1
+RESIGN_TARGET_FALSE_POSITIVE = 0.05
+RESIGN_MIN_PLAYOUTS = 20
+# seconds between two reports of the self-play throughput
+SELFPLAY_REPORT_INTERVAL = 600
 
 # defines the evaluation process
 EVAL_FREQ = 20
@@ -42,16 +55,117 @@ EVAL_NUM_SIMS = 1000
 EVAL_CPUCT = 3
 EVAL_MCTS_BATCH = 16
 
+# defines the pondering of players on the opponent's turn
+PONDER_NUM_SIMS = 20000
+# the memory budget of the search tree of a player in bytes
+PLAYER_MAX_TREE_BYTES = 1 << 30
+PLAYER_MCTS_BATCH = 16
+
+# defines the Piskvork engine of pbrain.py
+PBRAIN_CPUCT = 3
+# seconds kept from the time limit of a turn for the inference in flight and the protocol
+PBRAIN_TIME_MARGIN = 0.1
+# the share of the time left in the match spent on a move
+PBRAIN_MOVES_TO_GO = 20
+# the share of max_memory the search tree may take
+PBRAIN_MEMORY_FRACTION = 0.5
+
 # defines the training process
 TRAIN_LR = 1e-4
+TRAIN_BATCH_SIZE = 64
+# training samples consumed per self-play position produced,
+# the trainer sleeps when it gets ahead of self-play
+TRAIN_REPLAY_RATIO = 8
+# the number of most recent self-play positions to sample from
+REPLAY_BUFFER_SIZE = 1 << 16
+# seconds between two reports of the training throughput
+TRAIN_REPORT_INTERVAL = 60
+# data-parallel training ranks, each rank trains on its shard of the games with
+# TRAIN_BATCH_SIZE and the gradients are averaged with torch.distributed (gloo)
+TRAIN_NUM_RANKS = 1
+TRAIN_DIST_PORT = 29500
+# seconds the ranks wait for each other, rank 0 evaluates the network meanwhile
+TRAIN_DIST_TIMEOUT = 3600
+# the throughput mode of training, which trains on pre-collated batches prefetched
+# into pinned memory with a fused loss and only logs the periodic reports,
+# see benchmark.py train_step for the samples/sec of each option
+TRAIN_FAST = False
+TRAIN_PREFETCH_BATCHES = 4
+# bf16 autocast on cpu and cuda, or fp16 with loss scaling on the cuda devices without bf16
+TRAIN_AMP = True
+# compiles the network together with the loss with torch.compile
+TRAIN_COMPILE = True
 
 # path
 CKPT_DIR = "ckpts"
+# the trainer appends every received game here, None disables the archive
+GAME_ARCHIVE_DIR = "ckpts/games"
+
+# defines the opening book built from the game archive by opening_book.py
+OPENING_BOOK_PATH = "ckpts/book.npz"
+# the probability that self-play searches a position of the book anyway
+OPENING_BOOK_EXPLORATION = 0.25
+
+# the trainer accepts games from remote self-play clients at this address,
+# use "0.0.0.0" to accept clients from other hosts, INGEST_PORT = None disables the server
+INGEST_HOST = "127.0.0.1"
+INGEST_PORT = 7086
 
 # defines the master behaviour
+# self-play workers send games to the trainer through a shared-memory ring buffer
+# of GAME_RING_SLOTS games, or through an mp.Queue if it is 0
+GAME_RING_SLOTS = 64
+# the initial self-play workers, new workers are assigned the devices round-robin
 SELF_PLAY_DEVICE_IDS = ["cuda:0", "cuda:0", "cuda:0"]
 TRAIN_DEVICE_ID = "cuda:2"
 INFER_DEVICE_ID = "cuda:0"
+SELFPLAY_MIN_WORKERS = 1
+SELFPLAY_MAX_WORKERS = 8
+# each process is pinned to its own cores and uses as many torch threads
+SELFPLAY_CORES_PER_WORKER = 1
+TRAIN_NUM_CORES = 2
+# seconds between two checks of the supervisor
+SUPERVISOR_INTERVAL = 10
+# seconds between two changes of the number of self-play workers
+SUPERVISOR_SCALE_COOLDOWN = 120
+# self-play workers are removed if more games wait in the data queue
+SUPERVISOR_MAX_QUEUE_DEPTH = 64
+# or if the trainer is behind TRAIN_REPLAY_RATIO by more positions,
+# and added while the cpu utilization is below the threshold
+SUPERVISOR_MAX_BACKLOG = 20000
+SUPERVISOR_MAX_CPU_UTILIZATION = 0.9
+# seconds to wait for a process to finish its work in progress
+SUPERVISOR_SHUTDOWN_TIMEOUT = 600
+# the processes push their metrics over udp at METRICS_PORT to an aggregator in the supervisor,
+# which serves them at http://127.0.0.1:METRICS_HTTP_PORT/metrics in the Prometheus
+# text format, None disables the telemetry
+METRICS_PORT = 7087
+METRICS_HTTP_PORT = 7088
+METRICS_PUSH_INTERVAL = 5
+# the aggregator appends the metrics to a csv every METRICS_CSV_INTERVAL seconds and rotates it
+# to METRICS_CSV_PATH.1 once it grows over METRICS_CSV_MAX_BYTES, None disables the csv
+METRICS_CSV_PATH = "ckpts/metrics.csv"
+METRICS_CSV_INTERVAL = 60
+METRICS_CSV_MAX_BYTES = 1 << 26
 
 # adb
 ADB = "adb"
+
+# autotune.py writes the values measured on this host here, which override the above
+HOST_PROFILE_PATH = os.path.join(CKPT_DIR, "profiles", "{}.json".format(socket.gethostname()))
+# the constants a host profile may override
+HOST_PROFILE_KEYS = [
+    "SELFPLAY_MCTS_BATCH", "EVAL_MCTS_BATCH", "PLAYER_MCTS_BATCH", "MCTS_VLOSS",
+    "SELF_PLAY_DEVICE_IDS", "INFER_DEVICE_ID", "TRAIN_DEVICE_ID",
+]
+
+
+def _load_host_profile(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r") as f:
+        profile = json.load(f)
+    return {key: value for key, value in profile.items() if key in HOST_PROFILE_KEYS}
+
+
+globals().update(_load_host_profile(HOST_PROFILE_PATH))
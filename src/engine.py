@@ -0,0 +1,70 @@
+import sys
+from ctypes import *
+from typing import List
+
+# the process-wide handle of the native library, loaded and configured once
+# by library(), so that creating a search tree never touches the loader
+
+_lib = None
+
+
+# the evaluation callback of MCTS_new, see MCTS::PolicyCallback
+CALLBACK_T = CFUNCTYPE(
+    None,
+    c_int,
+    POINTER(POINTER(c_byte)),
+    POINTER(POINTER(c_double)),
+    POINTER(POINTER(c_double)),
+)
+
+
+def _declare(lib):
+    signatures = {
+        "global_SupportedSizes": ([POINTER(c_int), c_int], c_int),
+        "global_SimpleHeuristics": ([c_int, c_int, c_char_p], c_double),
+        "global_GreedyScores": ([c_int, c_int, c_char_p, POINTER(c_double)], None),
+        "global_NodeBytes": ([c_int], c_int64),
+        "global_RecordBytes": ([c_int], c_int64),
+        "MCTS_new": ([c_int, c_int, c_char_p, c_double, c_int, CALLBACK_T, c_int], c_void_p),
+        "MCTS_Reset": ([c_void_p, c_char_p], None),
+        "MCTS_Search": ([c_void_p, c_int, c_double, c_double], c_int),
+        "MCTS_SetInterrupted": ([c_void_p, c_bool], None),
+        "MCTS_GetPi": ([c_void_p, c_double, POINTER(c_double)], None),
+        "MCTS_terminated": ([c_void_p], c_bool),
+        "MCTS_chessboard": ([c_void_p, c_void_p], None),
+        "MCTS_SetDeferredReclamation": ([c_void_p, c_bool], None),
+        "MCTS_SetPipelineDepth": ([c_void_p, c_int], None),
+        "MCTS_SetNodeBudget": ([c_void_p, c_int64], None),
+        "MCTS_num_nodes": ([c_void_p], c_int64),
+        "MCTS_num_bytes": ([c_void_p], c_int64),
+        "MCTS_StepForward": ([c_void_p, c_int, c_int], None),
+        "MCTS_v": ([c_void_p], c_double),
+        # declared as c_void_p, mcts.py casts it to its RootStats structure
+        "MCTS_root_stats": ([c_void_p], c_void_p),
+        # the structures are declared in mcts.py and passed by address
+        "MCTS_SelfPlay": ([c_void_p, c_void_p, c_void_p, c_void_p, c_void_p], None),
+        "MCTS_delete": ([c_void_p], None),
+    }
+    for name, (argtypes, restype) in signatures.items():
+        fn = getattr(lib, name)
+        fn.argtypes = argtypes
+        fn.restype = restype
+
+
+def library():
+    global _lib
+    if _lib is None:
+        lib = CDLL(
+            "bazel-bin/mcts/capi_shared.dll"
+            if sys.platform.startswith("win")
+            else "bazel-bin/mcts/capi_shared.so"
+        )
+        _declare(lib)
+        _lib = lib
+    return _lib
+
+
+def supported_sizes() -> List[int]:
+    """The chessboard sizes the library has been compiled for, see mcts/BUILD."""
+    sizes = (c_int * 64)()
+    return list(sizes[:library().global_SupportedSizes(sizes, 64)])
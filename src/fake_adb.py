@@ -0,0 +1,119 @@
+"""A stand-in for adb serving canned screenshots, used to benchmark the online bot
+without a device.
+
+    # renders the screenshots of a random game into tmp/fake_adb
+    python src/fake_adb.py generate tmp/fake_adb
+    # then use "python src/fake_adb.py" in place of adb
+    FAKE_ADB_FRAMES=tmp/fake_adb python src/fake_adb.py exec-out screencap > frame.raw
+
+Every "exec-out screencap" streams the next frame of the directory in the raw
+screencap format, looping over the frames. Other commands succeed and do nothing.
+Serving avoids heavy imports so that the latency resembles the real adb.
+"""
+import argparse
+import glob
+import os
+import random
+import struct
+import sys
+
+SCREEN_WIDTH = 1080
+SCREEN_HEIGHT = 2244
+BOARD_COLOR = (230, 195, 140)
+LINE_COLOR = (90, 60, 30)
+STONE_COLORS = [(20, 20, 20), (250, 250, 250)]
+
+
+def _frames_dir() -> str:
+    return os.environ.get("FAKE_ADB_FRAMES", "tmp/fake_adb")
+
+
+def _serve_screencap():
+    frames = sorted(glob.glob(os.path.join(_frames_dir(), "*.raw")))
+    if len(frames) == 0:
+        sys.stderr.write("no frames in {}\n".format(_frames_dir()))
+        sys.exit(1)
+    index_path = os.path.join(_frames_dir(), "index")
+    try:
+        with open(index_path, "r") as f:
+            index = int(f.read())
+    except (OSError, ValueError):
+        index = 0
+    with open(index_path, "w") as f:
+        f.write(str((index + 1) % len(frames)))
+    with open(frames[index % len(frames)], "rb") as f:
+        sys.stdout.buffer.write(f.read())
+
+
+def render_screenshot(chessboard, roles):
+    """Renders a (SCREEN_HEIGHT, SCREEN_WIDTH, 4) screenshot of the chessboard
+    with the geometry of TencentHappyGomoku, roles holds the colors of
+    the player and the opponent.
+    """
+    import numpy as np
+    from automate_online_play import TencentHappyGomoku
+    coordinate_at = TencentHappyGomoku._chess_coordiante_at
+    radius = int(TencentHappyGomoku.CHESS_RADIUS)
+
+    img = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH, 4), dtype=np.uint8)
+    img[:, :] = BOARD_COLOR + (255,)
+    ys, xs = np.mgrid[0:SCREEN_HEIGHT, 0:SCREEN_WIDTH]
+
+    left, top = [int(round(v)) for v in coordinate_at(0, 0)]
+    right, bottom = [int(round(v)) for v in coordinate_at(14, 14)]
+    for i in range(15):
+        x, y = [int(round(v)) for v in coordinate_at(i, i)]
+        img[top: bottom + 1, x - 1: x + 1, :3] = LINE_COLOR
+        img[y - 1: y + 1, left: right + 1, :3] = LINE_COLOR
+
+    def draw_disk(center, color):
+        x, y = int(round(center[0])), int(round(center[1]))
+        window = (slice(y - radius, y + radius + 1), slice(x - radius, x + radius + 1))
+        mask = (xs[window] - x) ** 2 + (ys[window] - y) ** 2 <= radius ** 2
+        img[window][mask, :3] = color
+
+    for who in range(2):
+        for x, y in np.argwhere(chessboard[who] > 0):
+            draw_disk(coordinate_at(x, y), STONE_COLORS[who])
+    for i in range(2):
+        draw_disk(TencentHappyGomoku.ROLE_LOCS[i], STONE_COLORS[roles[i]])
+    return img
+
+
+def to_raw_screencap(img) -> bytes:
+    height, width, _ = img.shape
+    # RGBA_8888 and sRGB
+    return struct.pack("<IIII", width, height, 1, 1) + img.tobytes()
+
+
+def generate(path: str, num_moves: int, seed: int):
+    import numpy as np
+    os.makedirs(path, exist_ok=True)
+    rng = random.Random(seed)
+    chessboard = np.zeros((2, 15, 15), dtype=np.float32)
+    cells = [(x, y) for x in range(15) for y in range(15)]
+    rng.shuffle(cells)
+    for i in range(num_moves + 1):
+        with open(os.path.join(path, "frame-{:03d}.raw".format(i)), "wb") as f:
+            f.write(to_raw_screencap(render_screenshot(chessboard, [0, 1])))
+        if i < num_moves:
+            x, y = cells[i]
+            chessboard[i % 2, x, y] = 1
+
+
+def main(argv):
+    if len(argv) >= 2 and argv[0] == "-s":
+        argv = argv[2:]
+    if argv[:1] == ["generate"]:
+        parser = argparse.ArgumentParser(description="renders canned screenshots")
+        parser.add_argument("path")
+        parser.add_argument("--moves", type=int, default=40)
+        parser.add_argument("--seed", type=int, default=0)
+        args = parser.parse_args(argv[1:])
+        generate(args.path, args.moves, args.seed)
+    elif argv[:2] == ["exec-out", "screencap"]:
+        _serve_screencap()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
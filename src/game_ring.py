@@ -0,0 +1,163 @@
+from typing import List, Optional
+from contextlib import contextmanager
+import fcntl
+import multiprocessing as mp
+import os
+import queue
+import tempfile
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from config import CHESSBOARD_SIZE
+from records import RECORD_DTYPE, pack_game, unpack_game
+
+# the state of a slot
+_FREE = 0
+# reserved by a producer which is copying its game into the slot
+_WRITING = 1
+_READY = 2
+# being copied out by the consumer
+_READING = 3
+
+
+# the interval at which full and empty rings are polled
+_POLL_INTERVAL = 0.01
+
+# the descriptors of the lock files opened by this process and the locks of its threads,
+# record locks belong to a process and are not inherited by forked children
+_lock_files = {}
+_lock_files_lock = threading.Lock()
+
+
+def _lock_file(path: str):
+    with _lock_files_lock:
+        key = (os.getpid(), path)
+        if key not in _lock_files:
+            _lock_files[key] = (os.open(path, os.O_RDWR), threading.Lock())
+        return _lock_files[key]
+
+
+def _remove_lock_file(path: str, creator: int):
+    if os.getpid() == creator:
+        os.remove(path)
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class GameRing:
+    """GameRing
+    A shared-memory ring buffer of self-play games with the put, get and qsize
+    of mp.Queue, for any number of producers and a single consumer.
+    Each game is packed with records.pack_game into a fixed-size slot,
+    producers block while every slot is taken.
+
+    A slot is reserved and released under the lock, but copied outside of it.
+    A slot left half-written by a crashed producer is skipped once the consumer
+    reaches it, and a slot left by a crashed consumer is read again by the next one,
+    so a crash never exposes a corrupted game. The lock is a record lock on a
+    temporary file, which the kernel releases when its owner is killed, and it is
+    only held for a few assignments, ordered so that they leave the ring consistent
+    if the owner is killed in between. Waiting processes poll instead of waiting on
+    a condition, whose waiters could not recover from a killed process.
+    """
+
+    def __init__(self, num_slots: int, ctx=mp):
+        self.num_slots = num_slots
+        # a game has at most CHESSBOARD_SIZE ** 2 positions
+        self.slot_bytes = CHESSBOARD_SIZE ** 2 * RECORD_DTYPE.itemsize
+        self.data = ctx.RawArray("B", num_slots * self.slot_bytes)
+        self.lengths = ctx.RawArray("q", num_slots)
+        self.states = ctx.RawArray("i", num_slots)
+        self.writers = ctx.RawArray("i", num_slots)
+        # the next slot to read and to reserve, slot i is i % num_slots
+        self.head = ctx.RawValue("q", 0)
+        self.tail = ctx.RawValue("q", 0)
+        fd, self.lock_path = tempfile.mkstemp(prefix="game_ring-", suffix=".lock")
+        os.close(fd)
+        # removed when the creating process exits, the other processes keep it open
+        weakref.finalize(self, _remove_lock_file, self.lock_path, os.getpid())
+
+    @contextmanager
+    def _locked(self):
+        fd, thread_lock = _lock_file(self.lock_path)
+        with thread_lock:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+
+    def _slot(self, slot: int) -> np.ndarray:
+        start = slot * self.slot_bytes
+        return np.frombuffer(self.data, dtype=np.uint8)[start: start + self.slot_bytes]
+
+    def qsize(self) -> int:
+        return self.tail.value - self.head.value
+
+    def put(self, records: List[dict]):
+        self.put_packed(pack_game(records))
+
+    def put_packed(self, data: bytes):
+        """Puts a game packed by records.pack_game."""
+        if len(data) > self.slot_bytes:
+            raise ValueError("a game of {} bytes does not fit in a slot".format(len(data)))
+        while True:
+            with self._locked():
+                if self.tail.value - self.head.value < self.num_slots:
+                    slot = self.tail.value % self.num_slots
+                    self.states[slot] = _WRITING
+                    self.writers[slot] = os.getpid()
+                    self.tail.value += 1
+                    break
+            time.sleep(_POLL_INTERVAL)
+
+        self._slot(slot)[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+        self.lengths[slot] = len(data)
+
+        with self._locked():
+            self.states[slot] = _READY
+
+    def _pop(self):
+        # the slot is freed after head moves past it, a slot freed at head
+        # would be mistaken for a slot being written
+        slot = self.head.value % self.num_slots
+        self.head.value += 1
+        self.states[slot] = _FREE
+
+    def get(self, timeout: Optional[float] = None) -> List[dict]:
+        """Takes the oldest game, raises queue.Empty if there is none within timeout.
+        Games are taken in the order their slots have been reserved.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._locked():
+                if self.head.value < self.tail.value:
+                    head = self.head.value % self.num_slots
+                    if self.states[head] in (_READY, _READING):
+                        self.states[head] = _READING
+                        slot = head
+                        break
+                    if not _process_alive(self.writers[head]):
+                        # the producer died while copying its game
+                        self._pop()
+                        continue
+            if deadline is not None and time.time() >= deadline:
+                raise queue.Empty
+            time.sleep(_POLL_INTERVAL)
+
+        records = unpack_game(self._slot(slot)[:self.lengths[slot]])
+
+        with self._locked():
+            self._pop()
+        return records
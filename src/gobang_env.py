@@ -9,6 +9,7 @@ import numpy as np
 from config import CHESSBOARD_SIZE
 from atomic_value import AtomicValue
 from players import *
+from opening_book import load_opening_book
 from gobang_utils import stone_is_valid, get_winner, config_log
 from gobang_vis import save_history_img
 
@@ -100,7 +101,7 @@ class VisualArena:
 if __name__ == "__main__":
     config_log(None)
 
-    player = NNMCTSAIPlayer("./41270.pt")
+    player = NNMCTSAIPlayer("./41270.pt", ponder=True, book=load_opening_book())
     arena = VisualArena([player, HUMAN_PLAYER])
     arena.event_loop()
 
@@ -2,6 +2,8 @@ import sys
 import itertools
 import logging
 import random
+import threading
+import time
 from typing import Optional
 
 import numpy as np
@@ -53,6 +55,27 @@ def get_winner(chessboard):
     return -1
 
 
+def winner_after_move(chessboard, who, x, y) -> int:
+    """Same as get_winner, but only checks the lines through the stone
+    which has just been placed at (x, y) by who.
+    """
+    for d in _DIRS:
+        cnt = 1
+        for sign in [1, -1]:
+            nx, ny = x + sign * d[0], y + sign * d[1]
+            while 0 <= min(nx, ny) and max(nx, ny) < CHESSBOARD_SIZE \
+                    and chessboard[who, nx, ny] > 0:
+                cnt += 1
+                nx, ny = nx + sign * d[0], ny + sign * d[1]
+        if cnt >= IN_A_ROW:
+            return who
+
+    if chessboard.sum() >= CHESSBOARD_SIZE ** 2:
+        return -2
+
+    return -1
+
+
 def simple_heuristics(chessboard) -> float:
     assert chessboard.shape == (2, CHESSBOARD_SIZE, CHESSBOARD_SIZE)
 
@@ -86,7 +109,20 @@ def action_from_prob(prob):
     return CHESSBOARD_SIZE - 1, CHESSBOARD_SIZE - 1
 
 
+def augment(chessboard, p, option: int):
+    """Applies one of the 8 symmetries of the chessboard."""
+    if (option & 1) > 0:
+        chessboard = np.flip(chessboard, -1)
+        p = np.flip(p, -1)
+    rot_idx = option >> 1
+    chessboard = np.rot90(chessboard, rot_idx, (-2, -1))
+    p = np.rot90(p, rot_idx, (-2, -1))
+    return chessboard, p
+
+
 def mcts_nn_policy_generator(network, device_id: str):
+    # the policy may be called from the pipeline thread of the search
+    @torch.no_grad()
     def policy(chessboard):
         i = torch.from_numpy(chessboard.copy()).to(device_id)
         batch_size = i.size(0)
@@ -98,6 +134,91 @@ def mcts_nn_policy_generator(network, device_id: str):
     return policy
 
 
+class BatchedPolicy:
+    """Merges the inference requests of several concurrent MCTS searches
+    into one batch of the wrapped policy.
+
+    A batch is run once it has expected_clients requests, once no request has
+    arrived for idle_wait seconds, or at the latest max_wait seconds after its
+    first request. An exception of the policy is raised in every caller of the batch.
+    """
+
+    def __init__(self, policy, expected_clients: int, max_wait: float = 1e-3,
+                 idle_wait: float = 2e-4):
+        self.policy = policy
+        self.expected_clients = expected_clients
+        self.max_wait = max_wait
+        self.idle_wait = idle_wait
+        self.pending = []
+        self.closed = False
+        self.cv = threading.Condition()
+        self.thread = threading.Thread(target=self._inference_loop, daemon=True)
+        self.thread.start()
+
+    def __call__(self, chessboard):
+        request = {"chessboard": chessboard, "done": False, "result": None, "error": None}
+        with self.cv:
+            if self.closed:
+                raise RuntimeError("the batched policy has been closed")
+            self.pending.append(request)
+            self.cv.notify_all()
+            while not request["done"]:
+                self.cv.wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["result"]
+
+    def close(self):
+        """Stops the inference thread once the pending requests are served."""
+        with self.cv:
+            self.closed = True
+            self.cv.notify_all()
+        self.thread.join()
+
+    def _wait_for_batch(self):
+        deadline = time.time() + self.max_wait
+        while len(self.pending) < self.expected_clients and not self.closed:
+            num_pending = len(self.pending)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            self.cv.wait(min(self.idle_wait, remaining))
+            if len(self.pending) == num_pending:
+                return
+
+    def _inference_loop(self):
+        while True:
+            with self.cv:
+                while len(self.pending) == 0 and not self.closed:
+                    self.cv.wait()
+                if len(self.pending) == 0:
+                    return
+                self._wait_for_batch()
+                requests = self.pending
+                self.pending = []
+
+            sizes = [request["chessboard"].shape[0] for request in requests]
+            offsets = np.cumsum([0] + sizes)
+            try:
+                with torch.no_grad():
+                    x, y = self.policy(np.concatenate(
+                        [request["chessboard"] for request in requests]
+                    ))
+                results = [(x[offsets[i]: offsets[i + 1]], y[offsets[i]: offsets[i + 1]])
+                           for i in range(len(requests))]
+                error = None
+            except Exception as e:
+                results = [None] * len(requests)
+                error = e
+
+            with self.cv:
+                for request, result in zip(requests, results):
+                    request["result"] = result
+                    request["error"] = error
+                    request["done"] = True
+                self.cv.notify_all()
+
+
 def config_log(filename: Optional[str]):
     root = logging.getLogger()
     root.setLevel(logging.INFO)
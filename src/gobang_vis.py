@@ -1,45 +1,97 @@
 from typing import List, Tuple
-import copy
 
-from PIL import Image, ImageFont, ImageDraw, ImageEnhance
+from PIL import Image, ImageFont, ImageDraw, GifImagePlugin
 
 from gobang_utils import CHESSBOARD_SIZE
 
 
-def save_history_img(history: List[Tuple[int, int, int]], path: str):
-    assert path.endswith(".jpeg") or path.endswith(".gif")
+class HistoryRenderer:
+    """HistoryRenderer
+    Renders playing histories onto imgs/chessboard.png.
+    The background and the numbered stone sprites are rendered once and reused,
+    and every move only redraws the cells of its stone.
+    GIF frames are encoded and written one by one, so memory does not grow with
+    the length of the history.
+    """
+
+    RADIUS = 16
+    STONE_COLORS = [(0, 0, 0), (255, 255, 255)]
+    TEXT_COLORS = [(255, 255, 255), (0, 0, 0)]
 
-    background = Image.open("imgs/chessboard.png").convert("RGB")
-    draw = ImageDraw.Draw(background)
-    font = ImageFont.load_default()
+    def __init__(self):
+        self.background = Image.open("imgs/chessboard.png").convert("RGB")
+        self.font = ImageFont.load_default()
+        self.sprites = {}
 
-    BLACK = (0, 0, 0)
-    WHITE = (255, 255, 255)
-    stone_colors = [BLACK, WHITE]
-    text_colors = [WHITE, BLACK]
+        # the global palette of the GIFs, covering the background and both stones
+        sample = self.background.copy()
+        for who in range(2):
+            sprite = self._sprite(who, CHESSBOARD_SIZE ** 2)
+            sample.paste(sprite, self._box(0, who)[:2], sprite)
+        self.palette = sample.quantize(256, dither=Image.Dither.NONE)
 
-    all_imgs = [copy.deepcopy(background)]
+    def _sprite(self, who: int, number: int) -> Image.Image:
+        key = (who, number)
+        if key not in self.sprites:
+            r = self.RADIUS
+            sprite = Image.new("RGBA", (2 * r + 1, 2 * r + 1), (0, 0, 0, 0))
+            draw = ImageDraw.Draw(sprite)
+            draw.ellipse((0, 0, 2 * r, 2 * r), fill=self.STONE_COLORS[who])
+            msg = str(number)
+            w = draw.textlength(msg, font=self.font)
+            h = self.font.size
+            draw.text((r - w / 2, r - h / 2), msg, font=self.font, fill=self.TEXT_COLORS[who])
+            self.sprites[key] = sprite
+        return self.sprites[key]
 
-    r = 16
-    for i, (who, x, y) in enumerate(history):
+    def _box(self, x, y):
         img_x = 20 + y * 40
         img_y = 20 + x * 40
+        r = self.RADIUS
+        return (img_x - r, img_y - r, img_x + r + 1, img_y + r + 1)
+
+    def _frames(self, history: List[Tuple[int, int, int]]):
+        """Yields the canvas and the box updated by every move."""
+        canvas = self.background.copy()
+        yield canvas, (0, 0) + canvas.size
+        for i, (who, x, y) in enumerate(history):
+            box = self._box(x, y)
+            sprite = self._sprite(who, i + 1)
+            canvas.paste(sprite, box[:2], sprite)
+            yield canvas, box
+
+    def render(self, history: List[Tuple[int, int, int]]) -> Image.Image:
+        """Returns the image of the final chessboard."""
+        for canvas, _ in self._frames(history):
+            continue
+        return canvas
+
+    def save(self, history: List[Tuple[int, int, int]], path: str, duration: int = 1000):
+        assert path.endswith(".jpeg") or path.endswith(".gif")
+
+        if path.endswith(".jpeg"):
+            self.render(history).save(path, "jpeg")
+            return
 
-        draw.ellipse(
-            (img_x - r, img_y - r, img_x + r, img_y + r), fill=stone_colors[who]
-        )
-        msg = str(i + 1)
-        w = draw.textlength(msg, font=font)
-        h = font.size
-        draw.text((img_x - w / 2, img_y - h / 2), msg, font=font, fill=text_colors[who])
-        all_imgs.append(copy.deepcopy(background))
-
-    if path.endswith(".jpeg"):
-        background.save(path, "jpeg")
-    else:
-        all_imgs[0].save(
-            path, save_all=True, append_images=all_imgs[1:], duration=1000, loop=0
-        )
+        with open(path, "wb") as f:
+            for i, (canvas, box) in enumerate(self._frames(history)):
+                frame = canvas.crop(box).quantize(palette=self.palette, dither=Image.Dither.NONE)
+                if i == 0:
+                    header, _ = GifImagePlugin.getheader(
+                        frame, info={"loop": 0, "optimize": False})
+                    f.write(b"".join(header))
+                f.write(b"".join(GifImagePlugin.getdata(frame, box[:2], duration=duration)))
+            f.write(b";")
+
+
+_renderer = None
+
+
+def save_history_img(history: List[Tuple[int, int, int]], path: str):
+    global _renderer
+    if _renderer is None:
+        _renderer = HistoryRenderer()
+    _renderer.save(history, path)
 
 
 def chessboard_str(chessboard) -> str:
@@ -0,0 +1,192 @@
+from typing import Iterator, Tuple
+import argparse
+import importlib
+import logging
+import struct
+import threading
+import time
+
+import numpy as np
+
+from config import CHESSBOARD_SIZE
+from gobang_utils import config_log
+from records import PACKED_CHESSBOARD_BYTES
+
+# a trace starts with the magic and the CHESSBOARD_SIZE it has been recorded with,
+# followed by the leaf batches of the policy callback, each batch is a
+# _BATCH_DTYPE header followed by batch_size packed chessboards, the priors as
+# float16 and the values as float32 the traced policy returned
+_MAGIC = b"GBTRACE1"
+_FILE_HEADER = struct.Struct("<8si")
+_BATCH_DTYPE = np.dtype([
+    # seconds since the recorder has been created
+    ("timestamp", "<f8"),
+    ("batch_size", "<i4"),
+])
+
+
+class TraceRecorder:
+    """TraceRecorder
+    Appends the batches of the wrapped policies to a trace file.
+    Recording stops after max_batches batches so that traces stay bounded.
+    The wrapped policies may be called from several threads.
+    """
+
+    def __init__(self, path: str, max_batches: int = 1 << 16):
+        self.f = open(path, "wb")
+        self.f.write(_FILE_HEADER.pack(_MAGIC, CHESSBOARD_SIZE))
+        self.max_batches = max_batches
+        self.num_batches = 0
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+
+    def wrap(self, policy):
+        def traced_policy(chessboard):
+            timestamp = time.perf_counter() - self.start_time
+            x, y = policy(chessboard)
+            self._write(timestamp, chessboard, x, y)
+            return x, y
+        return traced_policy
+
+    def _write(self, timestamp, chessboard, x, y):
+        n = chessboard.shape[0]
+        header = np.array([(timestamp, n)], dtype=_BATCH_DTYPE)
+        data = b"".join([
+            header.tobytes(),
+            np.packbits(chessboard.reshape((n, -1)) > 0, axis=1).tobytes(),
+            np.asarray(x, dtype="<f2").tobytes(),
+            np.asarray(y, dtype="<f4").tobytes(),
+        ])
+        with self.lock:
+            if self.f.closed or self.num_batches >= self.max_batches:
+                return
+            self.f.write(data)
+            self.num_batches += 1
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+
+def read_trace(path: str) -> Iterator[Tuple[float, np.ndarray, np.ndarray, np.ndarray]]:
+    """Yields the timestamp, the chessboards, the priors and the values of every batch."""
+    with open(path, "rb") as f:
+        magic, size = _FILE_HEADER.unpack(f.read(_FILE_HEADER.size))
+        if magic != _MAGIC or size != CHESSBOARD_SIZE:
+            raise ValueError("{} is not a trace of a {}x{} chessboard".format(
+                path, CHESSBOARD_SIZE, CHESSBOARD_SIZE))
+        while True:
+            data = f.read(_BATCH_DTYPE.itemsize)
+            if len(data) < _BATCH_DTYPE.itemsize:
+                return
+            header = np.frombuffer(data, dtype=_BATCH_DTYPE)[0]
+            n = int(header["batch_size"])
+            packed = np.frombuffer(f.read(n * PACKED_CHESSBOARD_BYTES), dtype=np.uint8)
+            ps = np.frombuffer(f.read(n * CHESSBOARD_SIZE ** 2 * 2), dtype="<f2")
+            vs = np.frombuffer(f.read(n * 4), dtype="<f4")
+            if len(vs) < n:
+                # the recorder has been killed while writing the batch
+                return
+            chessboards = np.unpackbits(
+                packed.reshape((n, -1)), axis=1, count=2 * CHESSBOARD_SIZE ** 2
+            ).reshape((n, 2, CHESSBOARD_SIZE, CHESSBOARD_SIZE)).astype(np.float32)
+            yield float(header["timestamp"]), chessboards, \
+                ps.reshape((n, CHESSBOARD_SIZE, CHESSBOARD_SIZE)).astype(np.float32), \
+                vs.astype(np.float32)
+
+
+def nn_policy(ckpt_path: str, device_id: str):
+    """The default policy factory of the replay, the eager network of a checkpoint."""
+    from gobang_utils import mcts_nn_policy_generator
+    from resnet import load_ckpt
+
+    network = load_ckpt(ckpt_path, device_id)
+    network.eval()
+    return mcts_nn_policy_generator(network, device_id)
+
+
+def load_policy(spec: str, ckpt_path: str, device_id: str):
+    """Builds a policy with the factory named by spec as "module:function",
+    which is called with the checkpoint path and the device.
+    """
+    module, function = spec.split(":")
+    return getattr(importlib.import_module(module), function)(ckpt_path, device_id)
+
+
+def replay(path: str, policy, reference=None, warmup: int = 10) -> dict:
+    """Feeds the batches of a trace through policy.
+
+    Args:
+        path: The trace.
+        policy: The policy to measure.
+        reference: The policy to compare the outputs with,
+            the outputs recorded in the trace if None.
+        warmup: The number of leading batches which are not timed.
+
+    Returns:
+        The throughput and latency percentiles of policy, and the max and mean
+        absolute differences of the priors and values and the agreement of the
+        argmax of the priors against the reference.
+    """
+    latencies = []
+    num_positions = 0
+    elapsed = 0
+    p_diffs, v_diffs, agreements = [], [], []
+    trace_start, trace_end = None, None
+    for i, (timestamp, chessboards, ps, vs) in enumerate(read_trace(path)):
+        start = time.perf_counter()
+        x, y = policy(chessboards)
+        latency = time.perf_counter() - start
+        if i >= warmup:
+            latencies.append(latency)
+            num_positions += len(chessboards)
+            elapsed += latency
+            trace_start = timestamp if trace_start is None else trace_start
+            trace_end = timestamp
+        if reference is not None:
+            ps, vs = reference(chessboards)
+        x = np.asarray(x, dtype=np.float32).reshape(ps.shape)
+        y = np.asarray(y, dtype=np.float32).reshape(vs.shape)
+        p_diffs.append(np.abs(x - ps).reshape((len(ps), -1)).max(axis=1))
+        v_diffs.append(np.abs(y - vs))
+        agreements.append(
+            x.reshape((len(x), -1)).argmax(axis=1) == ps.reshape((len(ps), -1)).argmax(axis=1))
+
+    if len(latencies) == 0:
+        raise ValueError("{} has no more than {} batches".format(path, warmup))
+    p_diffs, v_diffs = np.concatenate(p_diffs), np.concatenate(v_diffs)
+    return {
+        "batches": len(latencies),
+        "positions/sec": num_positions / elapsed,
+        # the rate at which the traced search requested positions
+        "traced positions/sec": num_positions / max(trace_end - trace_start, 1e-9),
+        "latency p50 (ms)": float(np.percentile(latencies, 50)) * 1e3,
+        "latency p90 (ms)": float(np.percentile(latencies, 90)) * 1e3,
+        "latency p99 (ms)": float(np.percentile(latencies, 99)) * 1e3,
+        "max p diff": float(p_diffs.max()),
+        "mean p diff": float(p_diffs.mean()),
+        "max v diff": float(v_diffs.max()),
+        "mean v diff": float(v_diffs.mean()),
+        "argmax agreement": float(np.concatenate(agreements).mean()),
+    }
+
+
+if __name__ == "__main__":
+    config_log(None)
+    parser = argparse.ArgumentParser(description="replays an inference trace through a policy")
+    parser.add_argument("trace", help="the trace recorded by self-play")
+    parser.add_argument("--ckpt", required=True, help="the checkpoint passed to the policy")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--policy", default="inference_trace:nn_policy",
+                        help="the policy factory as module:function")
+    parser.add_argument("--reference", help="the policy factory to compare with, "
+                        "by default the outputs recorded in the trace")
+    parser.add_argument("--reference-ckpt", help="defaults to --ckpt")
+    parser.add_argument("--warmup", type=int, default=10)
+    args = parser.parse_args()
+
+    policy = load_policy(args.policy, args.ckpt, args.device)
+    reference = None if args.reference is None else load_policy(
+        args.reference, args.reference_ckpt or args.ckpt, args.device)
+    for key, value in replay(args.trace, policy, reference, args.warmup).items():
+        logging.info("{}: {:.4f}".format(key, value))
@@ -0,0 +1,267 @@
+from typing import Optional, Tuple
+import io
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+import multiprocessing as mp
+
+from config import CKPT_DIR, CHESSBOARD_SIZE
+from records import RECORD_VERSION, guess_record_version, unpack_game
+
+# every frame is a header followed by the payload
+_HEADER = struct.Struct("!4sBI")
+_MAGIC = b"GBNG"
+_MAX_PAYLOAD = 1 << 26
+
+# client -> server, payload: version of the client's checkpoint (int64)
+MSG_GET_CKPT = 1
+# server -> client, payload: best version (int64) followed by the checkpoint
+# file, which is empty if the client's checkpoint is up to date
+MSG_CKPT = 2
+# client -> server, payload: game id (16 bytes) followed by headerless records
+# of version 1 or 2, only sent by older clients
+MSG_GAME = 3
+# server -> client, payload: best version (int64), sent once the game is queued
+MSG_ACK = 4
+# client -> server, payload: game id (16 bytes), record version (uint16),
+# chessboard size (uint16) followed by records.pack_game
+MSG_VERSIONED_GAME = 5
+
+_VERSION = struct.Struct("!q")
+_GAME_ID_BYTES = 16
+_GAME_HEADER = struct.Struct("!HH")
+
+
+class ProtocolError(Exception):
+    ...
+
+
+def _recv_exactly(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while n > 0:
+        received = sock.recv_into(view[len(buf) - n:], n)
+        if received == 0:
+            raise ConnectionError("connection closed by peer")
+        n -= received
+    return bytes(buf)
+
+
+def send_frame(sock: socket.socket, msg_type: int, payload: bytes):
+    sock.sendall(_HEADER.pack(_MAGIC, msg_type, len(payload)) + payload)
+
+
+def recv_frame(sock: socket.socket) -> Tuple[int, bytes]:
+    magic, msg_type, length = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    if magic != _MAGIC or length > _MAX_PAYLOAD:
+        raise ProtocolError("malformed frame header")
+    return msg_type, _recv_exactly(sock, length)
+
+
+def _read_best_version() -> int:
+    with open(os.path.join(CKPT_DIR, "best"), "r") as f:
+        return int(f.read())
+
+
+class _IngestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        logging.info("self-play client {} connected".format(self.client_address))
+        try:
+            while True:
+                msg_type, payload = recv_frame(self.request)
+                if msg_type == MSG_GET_CKPT:
+                    self._send_ckpt(_VERSION.unpack(payload)[0])
+                elif msg_type in (MSG_GAME, MSG_VERSIONED_GAME):
+                    self._receive_game(msg_type, payload)
+                else:
+                    raise ProtocolError("unexpected message type {}".format(msg_type))
+        except (ConnectionError, ProtocolError, struct.error) as e:
+            logging.info("self-play client {} disconnected: {}".format(self.client_address, e))
+        except OSError as e:
+            # e.g. ckpts/best is missing, the client retries after reconnecting
+            logging.warning("dropping self-play client {}: {}".format(self.client_address, e))
+
+    def _receive_game(self, msg_type: int, payload: bytes):
+        server = self.server
+        game_id, data = payload[:_GAME_ID_BYTES], payload[_GAME_ID_BYTES:]
+        try:
+            if msg_type == MSG_VERSIONED_GAME:
+                version, chessboard_size = _GAME_HEADER.unpack_from(data)
+                data = data[_GAME_HEADER.size:]
+                if chessboard_size != CHESSBOARD_SIZE:
+                    raise ValueError("chessboard size {}".format(chessboard_size))
+            else:
+                version = guess_record_version(data)
+            records = unpack_game(data, version)
+        except (ValueError, struct.error) as e:
+            # acked, as resending a malformed game never helps
+            logging.warning("dropping a malformed game from {}: {}".format(self.client_address, e))
+            records = None
+        if records is not None and not server.seen(game_id):
+            # blocks while the trainer is behind, which delays the ack
+            # and eventually stalls the client
+            server.data_queue.put(records)
+        send_frame(self.request, MSG_ACK, _VERSION.pack(_read_best_version()))
+
+    def _send_ckpt(self, client_version: int):
+        best_version = _read_best_version()
+        ckpt = b""
+        if best_version != client_version:
+            with open(os.path.join(CKPT_DIR, "{}.pt".format(best_version)), "rb") as f:
+                ckpt = f.read()
+        send_frame(self.request, MSG_CKPT, _VERSION.pack(best_version) + ckpt)
+
+
+class IngestServer(socketserver.ThreadingTCPServer):
+    """IngestServer
+    Accepts finished games from remote self-play clients and puts them on
+    the data queue of the trainer. Serves the best checkpoint to the clients.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str, port: int, data_queue: mp.Queue):
+        super().__init__((host, port), _IngestHandler)
+        self.data_queue = data_queue
+        # ids of the recently received games, games resent after a reconnect are dropped
+        self.recent_ids = deque(maxlen=1 << 12)
+        self.recent_id_set = set()
+        self.lock = threading.Lock()
+
+    def seen(self, game_id: bytes) -> bool:
+        with self.lock:
+            if game_id in self.recent_id_set:
+                return True
+            if len(self.recent_ids) == self.recent_ids.maxlen:
+                self.recent_id_set.remove(self.recent_ids[0])
+            self.recent_ids.append(game_id)
+            self.recent_id_set.add(game_id)
+            return False
+
+
+def start_ingest_server(host: str, port: int, data_queue: mp.Queue) -> IngestServer:
+    server = IngestServer(host, port, data_queue)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logging.info("ingest server is listening on {}:{}".format(host, port))
+    return server
+
+
+class _Backoff:
+    """The exponential backoff between the retries of an exchange with the server,
+    reset once an exchange succeeds.
+    """
+
+    def __init__(self, initial: float = 0.5, maximum: float = 30):
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = initial
+
+    def sleep(self):
+        time.sleep(self.delay)
+        self.delay = min(self.delay * 2, self.maximum)
+
+    def reset(self):
+        self.delay = self.initial
+
+
+def connect(host: str, port: int, max_backoff: float = 30) -> socket.socket:
+    """Connects to the ingest server, retrying with exponential backoff."""
+    backoff = 0.5
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+        except OSError as e:
+            logging.warning("cannot connect to {}:{} ({}), retrying in {}s".format(
+                host, port, e, backoff))
+            time.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+
+
+def fetch_ckpt(host: str, port: int, version: int) -> Tuple[int, Optional[io.BytesIO]]:
+    """Returns the best version and its checkpoint file,
+    or None in place of the file if version is the best one.
+    """
+    # the server may accept the connection and drop it at once, e.g. without ckpts/best
+    backoff = _Backoff()
+    while True:
+        sock = connect(host, port)
+        try:
+            send_frame(sock, MSG_GET_CKPT, _VERSION.pack(version))
+            msg_type, payload = recv_frame(sock)
+            if msg_type != MSG_CKPT:
+                raise ProtocolError("unexpected message type {}".format(msg_type))
+        except (ConnectionError, ProtocolError, OSError, struct.error) as e:
+            logging.warning("failed to fetch the checkpoint: {}, retrying in {}s".format(
+                e, backoff.delay))
+            backoff.sleep()
+            continue
+        finally:
+            sock.close()
+        best_version = _VERSION.unpack(payload[:_VERSION.size])[0]
+        ckpt = payload[_VERSION.size:]
+        return best_version, (io.BytesIO(ckpt) if len(ckpt) > 0 else None)
+
+
+class GameUploader:
+    """GameUploader
+    Streams finished games to the ingest server from a background thread.
+    At most max_pending games are buffered, put blocks when the buffer is full.
+    Games are resent after reconnecting until they are acknowledged.
+    """
+
+    def __init__(self, host: str, port: int, max_pending: int = 64):
+        self.host = host
+        self.port = port
+        self.pending = deque()
+        self.max_pending = max_pending
+        self.cv = threading.Condition()
+        self.best_version = None
+        thread = threading.Thread(target=self._upload_loop, daemon=True)
+        thread.start()
+
+    def put(self, packed_game: bytes):
+        with self.cv:
+            while len(self.pending) >= self.max_pending:
+                self.cv.wait()
+            self.pending.append(uuid.uuid4().bytes +
+                                _GAME_HEADER.pack(RECORD_VERSION, CHESSBOARD_SIZE) + packed_game)
+            self.cv.notify_all()
+
+    def _upload_loop(self):
+        sock = None
+        backoff = _Backoff()
+        while True:
+            with self.cv:
+                while len(self.pending) == 0:
+                    self.cv.wait()
+                payload = self.pending[0]
+
+            if sock is None:
+                sock = connect(self.host, self.port)
+            try:
+                send_frame(sock, MSG_VERSIONED_GAME, payload)
+                msg_type, ack = recv_frame(sock)
+                if msg_type != MSG_ACK:
+                    raise ProtocolError("unexpected message type {}".format(msg_type))
+            except (ConnectionError, ProtocolError, OSError, struct.error) as e:
+                logging.warning("failed to upload a game: {}, retrying in {}s".format(
+                    e, backoff.delay))
+                sock.close()
+                sock = None
+                backoff.sleep()
+                continue
+
+            backoff.reset()
+            with self.cv:
+                self.pending.popleft()
+                self.best_version = _VERSION.unpack(ack)[0]
+                self.cv.notify_all()
@@ -2,14 +2,23 @@ import os
 import logging
 import glob
 import multiprocessing as mp
-import subprocess
 import json
 import signal
 import argparse
+import time
 
 import torch
 
-from config import SELF_PLAY_DEVICE_IDS, CKPT_DIR, TRAIN_DEVICE_ID
+from config import \
+    SELF_PLAY_DEVICE_IDS, CKPT_DIR, TRAIN_DEVICE_ID, \
+    SELFPLAY_MIN_WORKERS, SELFPLAY_MAX_WORKERS, SELFPLAY_CORES_PER_WORKER, \
+    TRAIN_NUM_CORES, TRAIN_NUM_RANKS, SUPERVISOR_INTERVAL, SUPERVISOR_SCALE_COOLDOWN, \
+    SUPERVISOR_MAX_QUEUE_DEPTH, SUPERVISOR_MAX_BACKLOG, \
+    SUPERVISOR_MAX_CPU_UTILIZATION, SUPERVISOR_SHUTDOWN_TIMEOUT, GAME_RING_SLOTS, \
+    METRICS_PORT
+from game_ring import GameRing
+import metrics
+from metrics import MetricsAggregator
 from gobang_utils import config_log
 from train import update_best_ckpt_idx, train_main
 from resnet import ResNet
@@ -24,6 +33,260 @@ def _best_ckpt_idx_file():
     return os.path.join(CKPT_DIR, "best")
 
 
+def _pinned_main(cores, target, *args):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    target(*args)
+
+
+class _CPUUtilization:
+    """Measures the utilization of all cores between two calls."""
+
+    def __init__(self):
+        self.prev = self._read()
+
+    @staticmethod
+    def _read():
+        with open("/proc/stat", "r") as f:
+            fields = [int(field) for field in f.readline().split()[1:]]
+        # idle and iowait
+        return fields[3] + fields[4], sum(fields)
+
+    def __call__(self) -> float:
+        idle, total = self._read()
+        prev_idle, prev_total = self.prev
+        self.prev = (idle, total)
+        if total == prev_total:
+            return 0
+        return 1 - (idle - prev_idle) / (total - prev_total)
+
+
+class _Worker:
+    def __init__(self, name, target, args, cores):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.cores = cores
+        self.stop_event = mp.Event()
+        self.proc = None
+        self.retire_time = None
+
+    def start(self):
+        self.stop_event.clear()
+        self.proc = mp.Process(
+            target=_pinned_main,
+            args=(self.cores, self.target, *self.args, self.stop_event, *self._extra_args()),
+            name=self.name
+        )
+        self.proc.start()
+        logging.info("{} started, pid = {}, cores = {}".format(
+            self.name, self.proc.pid, sorted(self.cores)))
+
+    def _extra_args(self):
+        return ()
+
+
+class _Trainer(_Worker):
+    def __init__(self, data_queue, cores, rank, num_ranks):
+        super().__init__(
+            "trainer" if num_ranks == 1 else "trainer rank {}".format(rank),
+            train_main, (), cores
+        )
+        self.backlog = mp.Value("d", 0)
+        self.data_queue = data_queue
+        self.rank = rank
+        self.num_ranks = num_ranks
+        self.shard_queues = []
+
+    def start(self):
+        # restarts from the best ckpt
+        with open(_best_ckpt_idx_file(), "r") as f:
+            best_idx = int(f.read())
+        self.args = (TRAIN_DEVICE_ID, best_idx, self.data_queue)
+        super().start()
+
+    def _extra_args(self):
+        return (self.backlog, self.rank, self.num_ranks, self.shard_queues)
+
+
+class Supervisor:
+    """Supervisor
+    Owns the self-play and training processes. Each process is pinned to its
+    own cores. Crashed processes are restarted, and self-play workers are added
+    or removed according to the depth of the data queue, the backlog of the
+    trainer and the CPU utilization.
+
+    On SIGTERM, the self-play workers finish and send their games in progress,
+    then the trainer trains on the remaining games and saves its replay buffer.
+    """
+
+    def __init__(self):
+        self.data_queue = GameRing(GAME_RING_SLOTS) if GAME_RING_SLOTS > 0 else mp.Queue(1 << 9)
+        # the number of processes pinned to each core
+        self.core_load = {core: 0 for core in sorted(os.sched_getaffinity(0))}
+        # rank 0 receives the games and deals them to the other ranks
+        self.trainers = [
+            _Trainer(self.data_queue, self._allocate_cores(TRAIN_NUM_CORES), rank, TRAIN_NUM_RANKS)
+            for rank in range(TRAIN_NUM_RANKS)
+        ]
+        self.trainer = self.trainers[0]
+        self.self_play_workers = []
+        # removed workers which are finishing their games in progress
+        self.retiring_workers = []
+        self.num_created_workers = 0
+        self.stopping = False
+        self.last_scale_time = time.time()
+        self.cpu_utilization = _CPUUtilization()
+
+    def _allocate_cores(self, n):
+        """Picks the n least loaded cores, cores are shared once all of them are taken."""
+        cores = sorted(self.core_load, key=lambda core: self.core_load[core])[:n]
+        for core in cores:
+            self.core_load[core] += 1
+        return set(cores)
+
+    def _release_cores(self, cores):
+        for core in cores:
+            self.core_load[core] -= 1
+
+    def _add_self_play_worker(self):
+        cores = self._allocate_cores(SELFPLAY_CORES_PER_WORKER)
+        device_id = SELF_PLAY_DEVICE_IDS[self.num_created_workers % len(SELF_PLAY_DEVICE_IDS)]
+        worker = _Worker(
+            "self-play #{}".format(self.num_created_workers),
+            self_play_main, (device_id, self.data_queue), cores
+        )
+        self.num_created_workers += 1
+        worker.start()
+        self.self_play_workers.append(worker)
+
+    def _remove_self_play_worker(self):
+        # the worker exits after sending its game in progress
+        worker = self.self_play_workers.pop()
+        worker.stop_event.set()
+        worker.retire_time = time.time()
+        self.retiring_workers.append(worker)
+        logging.info("removing {}".format(worker.name))
+
+    def _reap_retiring(self):
+        for worker in list(self.retiring_workers):
+            if worker.proc.is_alive() and \
+                    time.time() - worker.retire_time < SUPERVISOR_SHUTDOWN_TIMEOUT:
+                continue
+            if worker.proc.is_alive():
+                logging.warning("{} does not stop in time, killing".format(worker.name))
+                worker.proc.kill()
+            worker.proc.join()
+            self._release_cores(worker.cores)
+            self.retiring_workers.remove(worker)
+            logging.info("{} removed".format(worker.name))
+
+    def _start_trainers(self):
+        shard_queues = [mp.Queue(1 << 9) for _ in self.trainers[1:]]
+        self.trainer.shard_queues = shard_queues
+        for trainer, shard_queue in zip(self.trainers[1:], shard_queues):
+            trainer.data_queue = shard_queue
+        for trainer in self.trainers:
+            trainer.start()
+
+    def _restart_crashed(self):
+        for worker in self.self_play_workers:
+            if not worker.proc.is_alive():
+                logging.warning("{} exited with code {}, restarting".format(
+                    worker.name, worker.proc.exitcode))
+                metrics.inc("restarts_total", worker="selfplay")
+                worker.start()
+        crashed = [trainer for trainer in self.trainers if not trainer.proc.is_alive()]
+        if len(crashed) > 0:
+            for trainer in crashed:
+                logging.warning("{} exited with code {}, restarting".format(
+                    trainer.name, trainer.proc.exitcode))
+                metrics.inc("restarts_total", worker="trainer")
+            # the ranks cannot rejoin a running process group
+            for trainer in self.trainers:
+                if trainer.proc.is_alive():
+                    trainer.proc.kill()
+                trainer.proc.join()
+            self._start_trainers()
+
+    def _scale(self):
+        if time.time() - self.last_scale_time < SUPERVISOR_SCALE_COOLDOWN:
+            return
+        queue_depth = self.data_queue.qsize()
+        backlog = self.trainer.backlog.value
+        cpu_utilization = self.cpu_utilization()
+        metrics.set_gauge("cpu_utilization", cpu_utilization)
+        logging.info(
+            "self-play workers = {}, queue depth = {}, trainer backlog = {:.0f}, "
+            "cpu utilization = {:.2f}".format(
+                len(self.self_play_workers), queue_depth, backlog, cpu_utilization))
+
+        if queue_depth > SUPERVISOR_MAX_QUEUE_DEPTH or backlog > SUPERVISOR_MAX_BACKLOG:
+            # the trainer cannot keep up
+            if len(self.self_play_workers) > SELFPLAY_MIN_WORKERS:
+                self._remove_self_play_worker()
+                self.last_scale_time = time.time()
+        elif cpu_utilization < SUPERVISOR_MAX_CPU_UTILIZATION and \
+                len(self.self_play_workers) < SELFPLAY_MAX_WORKERS:
+            self._add_self_play_worker()
+            self.last_scale_time = time.time()
+
+    def _report_metrics(self):
+        metrics.set_gauge("data_queue_depth", self.data_queue.qsize())
+        metrics.set_gauge("selfplay_workers", len(self.self_play_workers))
+        metrics.set_gauge("selfplay_retiring_workers", len(self.retiring_workers))
+
+    def _on_sigterm(self, signum, frame):
+        self.stopping = True
+
+    def _shutdown(self):
+        logging.info("shutting down")
+        workers = self.self_play_workers + self.retiring_workers
+        for worker in workers:
+            worker.stop_event.set()
+        deadline = time.time() + SUPERVISOR_SHUTDOWN_TIMEOUT
+        for worker in workers:
+            worker.proc.join(max(deadline - time.time(), 0))
+            if worker.proc.is_alive():
+                logging.warning("{} does not stop in time, killing".format(worker.name))
+                worker.proc.kill()
+
+        # the other ranks stop with rank 0
+        self.trainer.stop_event.set()
+        deadline = time.time() + SUPERVISOR_SHUTDOWN_TIMEOUT
+        for trainer in self.trainers:
+            trainer.proc.join(max(deadline - time.time(), 0))
+            if trainer.proc.is_alive():
+                logging.warning("{} does not stop in time, killing".format(trainer.name))
+                trainer.proc.kill()
+        logging.info("all workers have stopped")
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_sigterm)
+        if METRICS_PORT is not None:
+            try:
+                MetricsAggregator().start()
+            except OSError as e:
+                logging.warning("the metrics aggregator cannot start: {}".format(e))
+            metrics.start_pushing("supervisor")
+        self._start_trainers()
+        num_workers = min(max(len(SELF_PLAY_DEVICE_IDS), SELFPLAY_MIN_WORKERS),
+                          SELFPLAY_MAX_WORKERS)
+        for _ in range(num_workers):
+            self._add_self_play_worker()
+
+        while not self.stopping:
+            time.sleep(SUPERVISOR_INTERVAL)
+            if self.stopping:
+                break
+            self._reap_retiring()
+            self._restart_crashed()
+            self._scale()
+            self._report_metrics()
+        self._shutdown()
+
+
 def start():
     if os.path.isfile(_master_hidden_file()):
         logging.warning('run "kill" first to terminate background training')
@@ -52,49 +315,58 @@ def start():
             best_idx = ckpts[-1]
         update_best_ckpt_idx(best_idx)
 
-    with open(_best_ckpt_idx_file(), "r") as f:
-        best_idx = int(f.read())
-
-    pids = []
-    self_play_procs = []
-    data_queue = mp.Queue(1 << 9)
-    for device_id in SELF_PLAY_DEVICE_IDS:
-        pids.append(mp.Value('i', 0))
-        self_play_procs.append(mp.Process(
-            target=self_play_main,
-            args=(device_id, data_queue, pids[-1])
-        ))
-        self_play_procs[-1].start()
-        self_play_procs[-1].join()
-
-    pids.append(mp.Value('i', 0))
-    train_proc = mp.Process(
-        target=train_main,
-        args=(TRAIN_DEVICE_ID, best_idx, data_queue, pids[-1])
-    )
-    train_proc.start()
-    train_proc.join()
-
-    for i in range(len(pids)):
-        pids[i] = pids[i].value
+    # the supervisor becomes a daemon with double fork
+    read_fd, write_fd = os.pipe()
+    fork_pid = os.fork()
+    if fork_pid != 0:
+        os.close(write_fd)
+        os.waitpid(fork_pid, 0)
+        with os.fdopen(read_fd, "r") as f:
+            supervisor_pid = int(f.read())
+        with open(_master_hidden_file(), "w") as f:
+            # the first child leads the session of the supervisor and the workers
+            json.dump({"supervisor": supervisor_pid, "pgid": fork_pid}, f)
+        logging.info("supervisor started, pid = {}".format(supervisor_pid))
+        return
 
-    with open(_master_hidden_file(), "w") as f:
-        json.dump(pids, f)
+    os.close(read_fd)
+    os.setsid()
+    if os.fork() != 0:
+        os._exit(0)
+    with os.fdopen(write_fd, "w") as f:
+        f.write(str(os.getpid()))
 
-    # self play and training processes become orphans
+    config_log("master-{}.log".format(os.getpid()))
+    Supervisor().run()
+    os._exit(0)
 
 
-def kill():
+def kill(force: bool):
     if not os.path.isfile(_master_hidden_file()):
         logging.warning("no background training process is found")
         return
 
     with open(_master_hidden_file(), "r") as f:
-        pids = json.load(f)
+        info = json.load(f)
+    pid = info["supervisor"]
 
-    logging.info("killing background processes")
-    for pid in pids:
-        os.kill(pid, signal.SIGKILL)
+    if force:
+        try:
+            # pid files written before the pgid was recorded
+            pgid = info["pgid"] if "pgid" in info else os.getpgid(pid)
+            logging.info("killing background processes")
+            os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            logging.warning("the background processes have already exited")
+    else:
+        try:
+            logging.info("waiting for background processes to stop")
+            os.kill(pid, signal.SIGTERM)
+            while True:
+                os.kill(pid, 0)
+                time.sleep(1)
+        except ProcessLookupError:
+            ...
     os.remove(_master_hidden_file())
 
 
@@ -105,8 +377,12 @@ if __name__ == "__main__":
         "instruction", help="the instruction to execute",
         choices=["start", "kill"]
     )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="kill the processes immediately instead of stopping them gracefully"
+    )
     args = parser.parse_args()
     if args.instruction == "start":
         start()
     elif args.instruction == "kill":
-        kill()
+        kill(args.force)
@@ -1,117 +1,342 @@
-import sys
-import itertools
 from ctypes import *
-from typing import Optional
+from functools import lru_cache
+import os
+from typing import Optional, NamedTuple
 
 import numpy as np
 
-from config import CHESSBOARD_SIZE
+from config import IN_A_ROW
+from engine import library, supported_sizes, CALLBACK_T
+from records import record_dtype
+
+# leaf evaluators of the native library, see MCTS::Evaluator
+EVALUATOR_CALLBACK = 0
+EVALUATOR_UNIFORM = 1
+EVALUATOR_HEURISTICS = 2
+
+
+def _chessboard_to_bytes(chessboard) -> bytes:
+    return (np.asarray(chessboard) > 0).astype(np.int8).tobytes()
+
+
+def _chessboard_size(chessboard) -> int:
+    """The size of a chessboard of shape (2, size, size), which the native library
+    must have been compiled for.
+    """
+    size = np.shape(chessboard)[-1]
+    if np.shape(chessboard) != (2, size, size) or size not in supported_sizes():
+        raise ValueError("the native library supports chessboards of shape (2, size, size) "
+                         "for size in {}, not {}".format(supported_sizes(), np.shape(chessboard)))
+    return size
+
+
+def native_simple_heuristics(chessboard, in_a_row: int = IN_A_ROW) -> float:
+    """The native counterpart of gobang_utils.simple_heuristics."""
+    return library().global_SimpleHeuristics(
+        _chessboard_size(chessboard), in_a_row, _chessboard_to_bytes(chessboard))
+
+
+def native_greedy_scores(chessboard, in_a_row: int = IN_A_ROW) -> np.array:
+    """Scores every cell by simple_heuristics after placing the stone of the
+    player to move there minus simple_heuristics after placing the stone of the
+    opponent there. Occupied cells are scored -inf.
+    """
+    size = _chessboard_size(chessboard)
+    out = np.empty((size, size), dtype=np.float64)
+    library().global_GreedyScores(
+        size, in_a_row, _chessboard_to_bytes(chessboard), out.ctypes.data_as(POINTER(c_double))
+    )
+    return out
+
+
+@lru_cache(maxsize=None)
+def _root_stats_type(size: int):
+    class _RootStats(Structure):
+        # mirrors MCTS::RootStats of the size
+        _fields_ = [
+            ("n", c_int32 * size ** 2),
+            ("q", c_double * size ** 2),
+            ("p", c_double * size ** 2),
+            ("vloss_cnt", c_int32 * size ** 2),
+            ("pv", c_int32 * 2 * size ** 2),
+            ("pv_length", c_int32),
+        ]
+    return _RootStats
+
+
+def _readonly_view(ctypes_arr, shape) -> np.array:
+    arr = np.ctypeslib.as_array(ctypes_arr).reshape(shape)
+    arr.flags.writeable = False
+    return arr
+
+
+class RootStats(NamedTuple):
+    """RootStats
+    Statistics of the moves at the root, all arrays except pv are of the shape
+    of the chessboard (size, size).
+    q is from the perspective of the player to move and is 0 for unvisited moves.
+    pv is the principal variation of shape (length, 2).
+    """
+    n: np.array
+    q: np.array
+    p: np.array
+    vloss_cnt: np.array
+    pv: np.array
+
+
+class _SelfPlayConfig(Structure):
+    # mirrors SelfPlayConfig of selfplay.h
+    _fields_ = [
+        ("num_sims", c_int),
+        ("fast_num_sims", c_int),
+        ("full_search_prob", c_double),
+        ("cpuct", c_double),
+        ("dirichlet_alpha", c_double),
+        ("noise_from_move", c_int),
+        ("temperature_moves", c_int),
+        ("resign_threshold", c_double),
+        ("resign_consecutive_moves", c_int),
+        ("playout", c_bool),
+        ("first_move", c_int),
+        ("seed", c_uint64),
+    ]
+
+
+class _SelfPlayResult(Structure):
+    # mirrors SelfPlayResult of selfplay.h
+    _fields_ = [
+        ("num_records", c_int),
+        ("num_moves", c_int),
+        ("num_sims", c_int),
+        ("resign_move", c_int),
+        ("resigned", c_bool),
+    ]
+
+
+class SelfPlayGame(NamedTuple):
+    """SelfPlayGame
+    A game played by MCTS.play_game.
+    records are of records.record_dtype(size), one per position from first_move on.
+    scores are the resignation scores indexed by the move, NaN for the moves
+    which have not been searched.
+    num_moves is the index of the move after the last one, the player to move
+    then lost if the game ended with a resignation.
+    """
+    records: np.ndarray
+    scores: np.array
+    num_moves: int
+    num_sims: int
+    resign_move: Optional[int]
+    resigned: bool
 
 
 class MCTS:
-    def __init__(self, chessboard, vloss, batch_size, policy):
-        self.lib = CDLL(
-            "bazel-bin/mcts/capi_shared.dll"
-            if sys.platform.startswith("win")
-            else "bazel-bin/mcts/capi_shared.so"
-        )
+    """MCTS
+    A search session on the process-wide library handle of engine.py.
+    A session can be reset to any position of its size and given another policy,
+    so that players keep one session instead of creating a tree per move.
+    """
 
-        char_arr_chessboard = bytearray(2 * CHESSBOARD_SIZE**2)
-        char_arr_t = c_char * len(char_arr_chessboard)
-        for who, x, y in itertools.product(
-            range(2), range(CHESSBOARD_SIZE), range(CHESSBOARD_SIZE)
-        ):
-            idx = (who * CHESSBOARD_SIZE + x) * CHESSBOARD_SIZE + y
-            char_arr_chessboard[idx] = int(chessboard[who][x][y] > 0)
-
-        callback_t = CFUNCTYPE(
-            None,
-            c_int,
-            POINTER(POINTER(c_byte)),
-            POINTER(POINTER(c_double)),
-            POINTER(POINTER(c_double)),
-        )
+    def __init__(self, chessboard, vloss, batch_size, policy, evaluator=EVALUATOR_CALLBACK,
+                 in_a_row: int = IN_A_ROW):
+        """Creates a search tree rooted at chessboard.
 
-        global callback
+        Args:
+            chessboard: A np.array of shape (2, size, size) for a size of
+                engine.supported_sizes(), the player to move owns the first channel.
+                The session searches chessboards of this size.
+            vloss: The virtual loss.
+            batch_size: The maximum number of leaves evaluated in one batch.
+            policy: Maps a batch of chessboards to the priors and values,
+                only used by EVALUATOR_CALLBACK.
+            evaluator: One of the EVALUATOR_* leaf evaluators.
+            in_a_row: The number of stones in a row which wins.
+        """
+        self.handle = None
+        self.lib = library()
+        self.policy = policy
+        self.size = _chessboard_size(chessboard)
+        self.in_a_row = in_a_row
+        size = self.size
 
-        @callback_t
+        @CALLBACK_T
         def callback(n, chessboards, probs, vs):
             i = np.stack(
                 [self._byte_ptr_to_chessboard(chessboards[i]) for i in range(n)]
             )
-            x, y = policy(i)
+            x, y = self.policy(i)
             for i in range(n):
-                memmove(
-                    probs[i],
-                    x[i].reshape((-1,)).astype(c_double).ctypes.get_data(),
-                    sizeof(c_double) * (CHESSBOARD_SIZE**2),
-                )
-                vs[i][0] = c_double(y[i])
-
-        self.lib.MCTS_new.argtypes = [char_arr_t, c_double, c_int, callback_t]
-        self.lib.MCTS_new.restype = c_void_p
-        self.lib.MCTS_Search.argtypes = [c_void_p, c_int, c_double, c_double]
-        self.lib.MCTS_Search.restype = None
-        self.lib.MCTS_GetPi.argtypes = [c_void_p, c_double, POINTER(c_double)]
-        self.lib.MCTS_GetPi.restype = None
-        self.lib.MCTS_terminated.argtypes = [c_void_p]
-        self.lib.MCTS_terminated.restype = c_bool
-        self.lib.MCTS_chessboard.argtypes = [c_void_p, POINTER(c_byte)]
-        self.lib.MCTS_chessboard.restype = None
-        self.lib.MCTS_StepForward.argtypes = [c_void_p, c_int, c_int]
-        self.lib.MCTS_StepForward.restype = None
-        self.lib.MCTS_v.argtypes = [c_void_p]
-        self.lib.MCTS_v.restype = c_double
-        self.lib.MCTS_delete.argtypes = [c_void_p]
-        self.lib.MCTS_delete.restype = None
+                np.ctypeslib.as_array(probs[i], shape=(size ** 2,))[:] = \
+                    np.reshape(x[i], (-1,))
+                vs[i][0] = float(np.reshape(y[i], ()))
+
+        # keeps the callback alive as long as the native tree
+        self._callback = callback if evaluator == EVALUATOR_CALLBACK else CALLBACK_T()
 
         self.handle = self.lib.MCTS_new(
-            char_arr_t.from_buffer(char_arr_chessboard),
+            c_int(size),
+            c_int(in_a_row),
+            _chessboard_to_bytes(chessboard),
             c_double(vloss),
             c_int(batch_size),
-            callback,
+            self._callback,
+            c_int(evaluator),
         )
 
-    def search(self, num_sims: int, cpuct: float, alpha: Optional[float]):
+        # views into the native memory, which is refreshed in place
+        self._root_stats = cast(
+            self.lib.MCTS_root_stats(self.handle), POINTER(_root_stats_type(size))).contents
+        shape = (size, size)
+        self._root_n = _readonly_view(self._root_stats.n, shape)
+        self._root_q = _readonly_view(self._root_stats.q, shape)
+        self._root_p = _readonly_view(self._root_stats.p, shape)
+        self._root_vloss_cnt = _readonly_view(self._root_stats.vloss_cnt, shape)
+        self._root_pv = _readonly_view(self._root_stats.pv, (-1, 2))
+        self._pi = np.zeros((size ** 2,), dtype=np.float64)
+        self._pi_ptr = self._pi.ctypes.data_as(POINTER(c_double))
+        self._chessboard = np.zeros((2 * size ** 2,), dtype=np.int8)
+
+    def reset(self, chessboard, policy=None):
+        """Restarts the search from chessboard, optionally with another policy.
+        The old tree is freed like the subtrees discarded by step_forward and
+        a pending interruption is cleared. chessboard must be of the size of the session.
+        """
+        if np.shape(chessboard) != (2, self.size, self.size):
+            raise ValueError("a session of size {} cannot be reset to a chessboard of shape {}"
+                             .format(self.size, np.shape(chessboard)))
+        if policy is not None:
+            self.policy = policy
+        self.lib.MCTS_Reset(self.handle, _chessboard_to_bytes(chessboard))
+
+    def search(self, num_sims: int, cpuct: float, alpha: Optional[float]) -> int:
         if alpha is None:
             alpha = -1
-        self.lib.MCTS_Search(
+        return self.lib.MCTS_Search(
             self.handle, c_int(num_sims), c_double(cpuct), c_double(alpha)
         )
 
+    def interrupt(self):
+        """Makes the running search return promptly. Safe to call from any thread.
+        Subsequent searches return immediately until resume or reset is called.
+        """
+        self.lib.MCTS_SetInterrupted(self.handle, c_bool(True))
+
+    def resume(self):
+        self.lib.MCTS_SetInterrupted(self.handle, c_bool(False))
+
     def get_pi(self, temperature):
-        pi = (c_double * (CHESSBOARD_SIZE**2))()
-        self.lib.MCTS_GetPi(
-            self.handle, c_double(temperature), cast(pi, POINTER(c_double))
+        self.lib.MCTS_GetPi(self.handle, c_double(temperature), self._pi_ptr)
+        return self._pi.astype(np.float32).reshape((self.size, self.size))
+
+    def root_stats(self) -> RootStats:
+        """Returns the statistics of the root as read-only views into the native memory
+        without copying. The views are overwritten by the next search or step and
+        must not be used after the tree is deleted, copy them to keep them.
+        """
+        return RootStats(
+            self._root_n, self._root_q, self._root_p, self._root_vloss_cnt,
+            self._root_pv[:self._root_stats.pv_length]
         )
-        pi = np.array(pi).reshape((CHESSBOARD_SIZE, CHESSBOARD_SIZE)).astype(np.float32)
-        return pi
 
     def step_forward(self, x, y):
         self.lib.MCTS_StepForward(self.handle, c_int(x), c_int(y))
 
+    def set_node_budget(self, num_nodes: int):
+        """Caps the number of nodes in the tree, 0 means unlimited.
+        Once the tree grows over the budget, the subtrees of the least visited nodes
+        off the principal variation are pruned until 3/4 of the budget is left.
+        The pruned nodes keep their visits and values.
+        """
+        self.lib.MCTS_SetNodeBudget(self.handle, c_int64(num_nodes))
+
+    def set_byte_budget(self, num_bytes: int):
+        self.set_node_budget(max(num_bytes // library().global_NodeBytes(self.size), 1))
+
+    def set_pipeline_depth(self, depth: int):
+        """Evaluates up to depth - 1 batches on a worker thread while the next batch
+        is selected, 1 (the default) evaluates every batch synchronously.
+        The policy is then called from the worker thread, so it must not rely on
+        thread-local state such as torch.no_grad of the searching thread.
+        Only EVALUATOR_CALLBACK is pipelined.
+        """
+        self.lib.MCTS_SetPipelineDepth(self.handle, c_int(depth))
+
+    def play_game(self, num_sims: int, fast_num_sims: int, full_search_prob: float,
+                  cpuct: float, alpha: float, temperature_moves: int, noise_from_move: int,
+                  resign_threshold: float = 0, resign_consecutive_moves: int = 0,
+                  playout: bool = False, first_move: int = 0, scores=None,
+                  resign_move: Optional[int] = None, seed: Optional[int] = None) -> SelfPlayGame:
+        """Plays self-play from the root to the end of the game in the native library,
+        the policy is the only call back into python.
+
+        Args:
+            num_sims: The simulations of a full search, which is taken with
+                probability full_search_prob and recorded as a policy target.
+            fast_num_sims: The simulations of the other moves, searched without noise.
+            cpuct: The cpuct of the searches.
+            alpha: The Dirichlet alpha of the full searches from noise_from_move on.
+            temperature_moves: The moves before are sampled from the visits,
+                the later ones among the most visited moves.
+            resign_threshold: The player to move resigns once the scores of its last
+                resign_consecutive_moves moves are below the threshold,
+                see selfplay.Resigner. resign_consecutive_moves of 0 never resigns.
+            playout: Keeps playing after the resignation.
+            first_move: The index of the move at the root, when the opening has
+                been played on the tree already.
+            scores: The scores of the moves before first_move, NaN if not searched.
+            resign_move: The move at which a player would have resigned before first_move.
+            seed: Seeds the playout caps and the sampled moves, but not the
+                Dirichlet noise. Random by default.
+        """
+        dtype = record_dtype(self.size)
+        if library().global_RecordBytes(self.size) != dtype.itemsize:
+            raise RuntimeError("the native record layout does not match record_dtype")
+        config = _SelfPlayConfig(
+            num_sims, fast_num_sims, full_search_prob, cpuct, alpha,
+            noise_from_move, temperature_moves, resign_threshold,
+            resign_consecutive_moves, playout, first_move,
+            seed if seed is not None else int.from_bytes(os.urandom(8), "little"),
+        )
+        result = _SelfPlayResult(resign_move=resign_move if resign_move is not None else -1)
+        records = np.zeros((self.size ** 2,), dtype=dtype)
+        game_scores = np.full((self.size ** 2,), np.nan)
+        if scores is not None:
+            game_scores[:first_move] = scores[:first_move]
+        self.lib.MCTS_SelfPlay(
+            self.handle, addressof(config), records.ctypes.data,
+            game_scores.ctypes.data, addressof(result)
+        )
+        return SelfPlayGame(
+            records[:result.num_records], game_scores, result.num_moves, result.num_sims,
+            result.resign_move if result.resign_move >= 0 else None, result.resigned
+        )
+
+    def num_nodes(self) -> int:
+        return self.lib.MCTS_num_nodes(self.handle)
+
+    def num_bytes(self) -> int:
+        return self.lib.MCTS_num_bytes(self.handle)
+
+    def set_deferred_reclamation(self, deferred: bool):
+        """Whether the subtrees discarded by step_forward are freed on a background
+        thread (the default) or synchronously.
+        """
+        self.lib.MCTS_SetDeferredReclamation(self.handle, c_bool(deferred))
+
     def terminated(self) -> bool:
         return bool(self.lib.MCTS_terminated(self.handle))
 
     def chessboard(self) -> np.array:
-        byte_arr = (c_byte * (2 * CHESSBOARD_SIZE**2))()
-        byte_ptr = cast(byte_arr, POINTER(c_byte))
-        self.lib.MCTS_chessboard(self.handle, byte_ptr)
-        return self._byte_ptr_to_chessboard(byte_ptr)
+        self.lib.MCTS_chessboard(self.handle, self._chessboard.ctypes.data)
+        return (self._chessboard > 0).astype(np.float32).reshape((2, self.size, self.size))
 
     def v(self) -> np.float32:
         return np.float32(self.lib.MCTS_v(self.handle))
 
     def __del__(self):
-        self.lib.MCTS_delete(self.handle)
-
-    @classmethod
-    def _byte_ptr_to_chessboard(cls, ptr) -> np.array:
-        ret = np.zeros((2, CHESSBOARD_SIZE, CHESSBOARD_SIZE)).astype(np.float32)
-        for who, x, y in itertools.product(
-            range(2), range(CHESSBOARD_SIZE), range(CHESSBOARD_SIZE)
-        ):
-            idx = (who * CHESSBOARD_SIZE + x) * CHESSBOARD_SIZE + y
-            if int(ptr[idx]) > 0:
-                ret[who][x][y] = 1
-        return ret
+        if self.handle is not None:
+            self.lib.MCTS_delete(self.handle)
+
+    def _byte_ptr_to_chessboard(self, ptr) -> np.array:
+        arr = np.ctypeslib.as_array(ptr, shape=(2 * self.size ** 2,))
+        return (arr > 0).astype(np.float32).reshape((2, self.size, self.size))
@@ -0,0 +1,272 @@
+from typing import Dict, List, Tuple
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import csv
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from config import \
+    METRICS_PORT, METRICS_HTTP_PORT, METRICS_PUSH_INTERVAL, \
+    METRICS_CSV_PATH, METRICS_CSV_INTERVAL, METRICS_CSV_MAX_BYTES
+
+SECONDS_BUCKETS = (0.01, 0.1, 1, 10, 60, 600, 3600)
+MOVES_BUCKETS = (10, 20, 30, 50, 80, 120, 225)
+
+# the gauges of a process which has not pushed for this many intervals are dropped,
+# the process has exited
+_GAUGE_TTL_INTERVALS = 3
+
+
+def _key(name: str, labels: dict) -> Tuple[str, tuple]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Registry:
+    """The counters and histograms recorded by this process since the last push
+    and the last values of its gauges.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        # buckets, counts per bucket and +Inf, sum, count
+        self.histograms = {}
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            counters, self.counters = self.counters, {}
+            gauges = dict(self.gauges)
+            histograms, self.histograms = self.histograms, {}
+        return {
+            "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+            "gauges": [[name, labels, value] for (name, labels), value in gauges.items()],
+            "histograms": [[name, labels, *h] for (name, labels), h in histograms.items()],
+        }
+
+
+_registry = _Registry()
+_process = None
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Adds value to a counter, whose name ends with _total by convention."""
+    key = _key(name, labels)
+    with _registry.lock:
+        _registry.counters[key] = _registry.counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Sets a gauge, which is pushed with every push until it is set again."""
+    key = _key(name, labels)
+    with _registry.lock:
+        _registry.gauges[key] = value
+
+
+def observe(name: str, value: float, buckets=SECONDS_BUCKETS, **labels):
+    """Counts value in a histogram of upper bounds buckets."""
+    key = _key(name, labels)
+    with _registry.lock:
+        h = _registry.histograms.get(key)
+        if h is None:
+            h = _registry.histograms[key] = [list(buckets), [0] * (len(buckets) + 1), 0, 0]
+        h[1][bisect_left(h[0], value)] += 1
+        h[2] += value
+        h[3] += 1
+
+
+def _resident_bytes() -> int:
+    with open("/proc/self/statm", "r") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def push():
+    """Sends the metrics recorded since the last push to the aggregator,
+    they are dropped if the aggregator is not running.
+    """
+    if _process is None:
+        return
+    set_gauge("process_resident_bytes", _resident_bytes(), pid=os.getpid())
+    msg = _registry.snapshot()
+    msg["process"] = _process
+    msg["pid"] = os.getpid()
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(json.dumps(msg).encode(), ("127.0.0.1", METRICS_PORT))
+    except OSError:
+        pass
+
+
+def _push_loop():
+    while True:
+        time.sleep(METRICS_PUSH_INTERVAL)
+        push()
+
+
+def start_pushing(process: str):
+    """Pushes the metrics of this process every METRICS_PUSH_INTERVAL seconds on
+    a daemon thread, labeled with process. The metrics recorded before, such as
+    those inherited from the parent process, are dropped.
+    """
+    global _registry, _process
+    if METRICS_PORT is None:
+        return
+    _registry = _Registry()
+    _process = process
+    threading.Thread(target=_push_loop, daemon=True).start()
+
+
+def _format_labels(labels) -> str:
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(
+        k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class MetricsAggregator:
+    """MetricsAggregator
+    Sums the metrics pushed by the processes over udp at METRICS_PORT. Serves them
+    at http://127.0.0.1:METRICS_HTTP_PORT/metrics in the Prometheus text format and
+    appends them to the csv at METRICS_CSV_PATH every METRICS_CSV_INTERVAL seconds,
+    which is rotated to METRICS_CSV_PATH.1 once it grows over METRICS_CSV_MAX_BYTES.
+    Every metric is labeled with the process which pushed it.
+    """
+
+    def __init__(self, port=METRICS_PORT, http_port=METRICS_HTTP_PORT,
+                 csv_path=METRICS_CSV_PATH):
+        self.port = port
+        self.http_port = http_port
+        self.csv_path = csv_path
+        self.lock = threading.Lock()
+        self.counters: Dict[tuple, float] = {}
+        # the value and the pid which pushed it
+        self.gauges: Dict[tuple, Tuple[float, int]] = {}
+        # the time of the last push of every pid
+        self.last_pushes: Dict[int, float] = {}
+        self.histograms: Dict[tuple, list] = {}
+
+    def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", self.port))
+        threading.Thread(target=self._receive_loop, args=(sock,), daemon=True).start()
+
+        aggregator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = aggregator.expose().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                ...
+
+        server = ThreadingHTTPServer(("127.0.0.1", self.http_port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        if self.csv_path is not None:
+            threading.Thread(target=self._csv_loop, daemon=True).start()
+        logging.info("metrics are served at http://127.0.0.1:{}/metrics".format(self.http_port))
+
+    def _receive_loop(self, sock):
+        while True:
+            data, _ = sock.recvfrom(1 << 16)
+            try:
+                self.merge(json.loads(data))
+            except (ValueError, KeyError, TypeError):
+                logging.warning("dropping a malformed metrics message")
+
+    def merge(self, msg: dict):
+        now = time.time()
+        process = ("process", msg["process"])
+
+        def key(name, labels):
+            return name, tuple(sorted([process] + [tuple(label) for label in labels]))
+
+        with self.lock:
+            self.last_pushes[msg["pid"]] = now
+            for name, labels, value in msg["counters"]:
+                k = key(name, labels)
+                self.counters[k] = self.counters.get(k, 0) + value
+            for name, labels, value in msg["gauges"]:
+                self.gauges[key(name, labels)] = (value, msg["pid"])
+            for name, labels, buckets, counts, total, count in msg["histograms"]:
+                k = key(name, labels)
+                h = self.histograms.get(k)
+                if h is None or h[0] != buckets:
+                    h = self.histograms[k] = [buckets, [0] * len(counts), 0, 0]
+                h[1] = [a + b for a, b in zip(h[1], counts)]
+                h[2] += total
+                h[3] += count
+
+    def _expire_gauges(self):
+        deadline = time.time() - _GAUGE_TTL_INTERVALS * METRICS_PUSH_INTERVAL
+        for pid in [pid for pid, t in self.last_pushes.items() if t < deadline]:
+            del self.last_pushes[pid]
+        for k in [k for k, (_, pid) in self.gauges.items() if pid not in self.last_pushes]:
+            del self.gauges[k]
+
+    def samples(self) -> List[Tuple[str, str, tuple, float]]:
+        """(type, sample name, labels, value) of every sample, histograms are
+        expanded into their cumulative buckets, sum and count.
+        """
+        samples = []
+        with self.lock:
+            self._expire_gauges()
+            for (name, labels), value in sorted(self.counters.items()):
+                samples.append(("counter", name, labels, value))
+            for (name, labels), (value, _) in sorted(self.gauges.items()):
+                samples.append(("gauge", name, labels, value))
+            for (name, labels), (buckets, counts, total, count) in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, n in zip(buckets + [float("inf")], counts):
+                    cumulative += n
+                    samples.append(("histogram", name + "_bucket",
+                                    labels + (("le", _format_value(bound)),), cumulative))
+                samples.append(("histogram", name + "_sum", labels, total))
+                samples.append(("histogram", name + "_count", labels, count))
+        return samples
+
+    def expose(self) -> str:
+        lines = []
+        declared = set()
+        for kind, name, labels, value in self.samples():
+            family = name
+            if kind == "histogram":
+                family = name.rsplit("_", 1)[0]
+            if family not in declared:
+                declared.add(family)
+                lines.append("# TYPE {} {}".format(family, kind))
+            lines.append("{}{} {}".format(name, _format_labels(labels), _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+    def _csv_loop(self):
+        while True:
+            time.sleep(METRICS_CSV_INTERVAL)
+            self.write_csv()
+
+    def write_csv(self):
+        if os.path.isfile(self.csv_path) and os.path.getsize(self.csv_path) > METRICS_CSV_MAX_BYTES:
+            os.replace(self.csv_path, self.csv_path + ".1")
+        new_file = not os.path.isfile(self.csv_path)
+        now = round(time.time(), 3)
+        with open(self.csv_path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(["time", "name", "labels", "value"])
+            for _, name, labels, value in self.samples():
+                writer.writerow([now, name, ";".join("{}={}".format(k, v) for k, v in labels), value])
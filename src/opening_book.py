@@ -0,0 +1,151 @@
+from typing import List, Optional, Tuple
+import argparse
+import logging
+import os
+
+import numpy as np
+
+from config import CHESSBOARD_SIZE, OPENING_BOOK_PATH
+from gobang_utils import config_log, augment
+from records import PACKED_CHESSBOARD_BYTES, read_archive
+
+_KEY_DTYPE = "S{}".format(PACKED_CHESSBOARD_BYTES)
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def canonicalize(chessboards: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Maps chessboards of shape (n, 2, CHESSBOARD_SIZE, CHESSBOARD_SIZE) to the least
+    of their 8 symmetries in the order of the packed bytes.
+
+    Returns:
+        The packed canonical chessboards as keys of dtype _KEY_DTYPE, and a mask of
+        shape (n, 8) of the options of augment which map the chessboards to
+        the canonical ones. Symmetric chessboards have more than one option.
+    """
+    n = chessboards.shape[0]
+    # (n, 8, 64) with zero padding, compared as 8 big endian words
+    packed = np.zeros((n, 8, 64), dtype=np.uint8)
+    for option in range(8):
+        variant, _ = augment(chessboards, chessboards, option)
+        packed[:, option, :PACKED_CHESSBOARD_BYTES] = \
+            np.packbits(variant.reshape((n, -1)) > 0, axis=1)
+    words = packed.view(">u8")
+
+    least = np.ones((n, 8), dtype=bool)
+    for i in range(words.shape[-1]):
+        word = np.where(least, words[:, :, i], np.iinfo(np.uint64).max)
+        least &= word == word.min(axis=1, keepdims=True)
+
+    keys = np.ascontiguousarray(
+        packed[np.arange(n), least.argmax(axis=1), :PACKED_CHESSBOARD_BYTES])
+    return keys.view(_KEY_DTYPE).reshape((n,)), least
+
+
+def _inverse_augment(p, option: int):
+    p = np.rot90(p, -(option >> 1), (-2, -1))
+    if (option & 1) > 0:
+        p = np.flip(p, -1)
+    return p
+
+
+class OpeningBook:
+    """OpeningBook
+    The mean visit distributions and values of the early positions in the game archive,
+    merged under the 8 symmetries and indexed by the canonical packed chessboards.
+    """
+
+    def __init__(self, path: str):
+        with np.load(path) as f:
+            self.keys = f["keys"]
+            self.ps = f["ps"]
+            self.vs = f["vs"]
+            self.counts = f["counts"]
+            self.max_plies = int(f["max_plies"])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, chessboard) -> Optional[Tuple[np.array, float, int]]:
+        """Looks up a chessboard of which the player to move owns the first channel.
+
+        Returns:
+            The visit distribution of shape (CHESSBOARD_SIZE, CHESSBOARD_SIZE),
+            the value and the number of occurrences of the position,
+            or None if the position is not in the book.
+        """
+        chessboard = np.asarray(chessboard)
+        if (chessboard > 0).sum() >= self.max_plies:
+            return None
+        keys, options = canonicalize(chessboard[None])
+        idx = np.searchsorted(self.keys, keys[0])
+        if idx == len(self.keys) or self.keys[idx] != keys[0]:
+            return None
+        p = _inverse_augment(
+            self.ps[idx].reshape((CHESSBOARD_SIZE, CHESSBOARD_SIZE)), options[0].argmax())
+        return p.copy(), float(self.vs[idx]), int(self.counts[idx])
+
+
+def load_opening_book(path: str = OPENING_BOOK_PATH) -> Optional[OpeningBook]:
+    if path is None or not os.path.isfile(path):
+        return None
+    book = OpeningBook(path)
+    if book.ps.shape[1:] != (CHESSBOARD_SIZE ** 2,):
+        logging.warning("skipping the opening book {} of another chessboard size".format(path))
+        return None
+    logging.info("{} positions of the opening book have been loaded".format(len(book)))
+    return book
+
+
+def build(archives: List[str], max_plies: int, min_count: int) -> dict:
+    """Aggregates the positions with less than max_plies stones in the archives.
+    Self-play samples the first moves with temperature 1, so the p of these positions
+    are the visit distributions of the search. Fast searches are left out.
+    """
+    records = np.concatenate([read_archive(path) for path in archives])
+    num_stones = _POPCOUNT[records["chessboard"]].sum(axis=1, dtype=np.int64)
+    records = records[(num_stones < max_plies) & records["full_search"]]
+    logging.info("{} positions with less than {} stones".format(len(records), max_plies))
+
+    chessboards = np.unpackbits(records["chessboard"], axis=1, count=2 * CHESSBOARD_SIZE ** 2)\
+        .reshape((-1, 2, CHESSBOARD_SIZE, CHESSBOARD_SIZE))
+    keys, options = canonicalize(chessboards)
+    # symmetric chessboards take the mean over the options,
+    # so that the distributions are as symmetric as the chessboards
+    ps = records["p"].reshape((-1, CHESSBOARD_SIZE, CHESSBOARD_SIZE))
+    canonical_ps = np.zeros_like(ps)
+    for option in range(8):
+        mask = options[:, option]
+        canonical_ps[mask] += augment(ps[mask], ps[mask], option)[1]
+    canonical_ps /= options.sum(axis=1)[:, None, None]
+
+    unique_keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    order = np.argsort(inverse, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    p_sums = np.add.reduceat(
+        canonical_ps.reshape((-1, CHESSBOARD_SIZE ** 2))[order], starts, axis=0)
+    v_sums = np.bincount(inverse, weights=records["v"], minlength=len(unique_keys))
+
+    keep = counts >= min_count
+    return {
+        "keys": unique_keys[keep],
+        "ps": (p_sums[keep] / counts[keep, None]).astype(np.float32),
+        "vs": (v_sums[keep] / counts[keep]).astype(np.float32),
+        "counts": counts[keep],
+        "max_plies": max_plies,
+    }
+
+
+if __name__ == "__main__":
+    config_log(None)
+    parser = argparse.ArgumentParser(description="builds the opening book from game archives")
+    parser.add_argument("archives", nargs="+", help="the archives written by the trainer")
+    parser.add_argument("--max-plies", type=int, default=8,
+                        help="positions with less stones are kept")
+    parser.add_argument("--min-count", type=int, default=16,
+                        help="positions occurring less often are dropped")
+    parser.add_argument("--output", default=OPENING_BOOK_PATH)
+    args = parser.parse_args()
+
+    book = build(args.archives, args.max_plies, args.min_count)
+    np.savez(args.output, **book)
+    logging.info("{} positions have been written to {}".format(len(book["keys"]), args.output))
@@ -0,0 +1,225 @@
+import os
+import sys
+
+# the native library is loaded relative to the repository, while the match
+# managers start engines from anywhere, the paths of the arguments are
+# relative to the directory the engine was started from
+_START_DIR = os.getcwd()
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from typing import Optional, Tuple
+import argparse
+import logging
+import threading
+import time
+
+import numpy as np
+import torch
+
+from config import \
+    CHESSBOARD_SIZE, CKPT_DIR, INFER_DEVICE_ID, MCTS_VLOSS, PLAYER_MCTS_BATCH, \
+    PLAYER_MAX_TREE_BYTES, \
+    PBRAIN_CPUCT, PBRAIN_TIME_MARGIN, PBRAIN_MOVES_TO_GO, PBRAIN_MEMORY_FRACTION
+from gobang_utils import mcts_nn_policy_generator
+from mcts import MCTS
+from resnet import load_ckpt
+
+# the protocol does not limit the search, it is stopped by the time limit
+_MAX_SIMS = 1 << 30
+
+
+class PiskvorkEngine:
+    """PiskvorkEngine
+    Plays through the Piskvork protocol used by Gomocup on stdin and stdout.
+    The search tree is kept between turns and advanced with both moves.
+    Each move is searched until its share of the time limits is spent, and the
+    tree is pruned to a fraction of max_memory.
+    """
+
+    def __init__(self, network, device_id: str, out=sys.stdout):
+        self.policy = mcts_nn_policy_generator(network, device_id)
+        self.out = out
+        self.tree = None
+        # the first channel owns the stones of the player to move
+        self.chessboard = np.zeros((2, CHESSBOARD_SIZE, CHESSBOARD_SIZE), dtype=np.float32)
+        # whether the tree is rooted at self.chessboard
+        self.tree_follows_game = False
+        # in milliseconds, a timeout_turn of 0 means as fast as possible and
+        # a timeout_match of 0 means no limit
+        self.timeout_turn = 5000
+        self.timeout_match = 0
+        self.time_left = None
+        self.max_memory = 0
+
+    def send(self, line: str):
+        self.out.write(line + "\n")
+        self.out.flush()
+
+    def _reset_tree(self) -> MCTS:
+        if self.tree is None:
+            self.tree = MCTS(self.chessboard, MCTS_VLOSS, PLAYER_MCTS_BATCH, self.policy)
+        else:
+            self.tree.reset(self.chessboard)
+        self.tree.set_byte_budget(
+            int(self.max_memory * PBRAIN_MEMORY_FRACTION) if self.max_memory > 0
+            else PLAYER_MAX_TREE_BYTES)
+        self.tree_follows_game = True
+        return self.tree
+
+    def _turn_seconds(self) -> float:
+        budget = self.timeout_turn
+        if self.time_left is not None and self.timeout_match > 0:
+            budget = min(budget, self.time_left / PBRAIN_MOVES_TO_GO)
+        return max(budget / 1000 - PBRAIN_TIME_MARGIN, 0.01)
+
+    def place(self, who: int, x: int, y: int):
+        """Places a stone of the player to move (0) or the other one (1)."""
+        self.chessboard[who, x, y] = 1
+        if self.tree_follows_game:
+            self.tree.step_forward(x, y)
+
+    def think(self) -> Tuple[int, int]:
+        t = self.tree if self.tree_follows_game else self._reset_tree()
+        timer = threading.Timer(self._turn_seconds(), t.interrupt)
+        start = time.perf_counter()
+        timer.start()
+        with torch.no_grad():
+            num_sims = t.search(_MAX_SIMS, PBRAIN_CPUCT, None)
+        timer.cancel()
+        t.resume()
+        stats = t.root_stats()
+        x, y = self._choose(stats)
+        self.send("MESSAGE {} sims in {:.2f} s, value {:.3f}, {} nodes".format(
+            num_sims, time.perf_counter() - start, float(stats.q[x, y]), t.num_nodes()))
+        self.place(0, x, y)
+        # the opponent moves next
+        self.chessboard = self.chessboard[::-1].copy()
+        return x, y
+
+    def _choose(self, stats) -> Tuple[int, int]:
+        """The most visited empty cell, or the empty cell of the highest prior if the
+        search was interrupted before visiting any, which is any empty cell if the
+        root has not been evaluated either.
+        """
+        empty = self.chessboard.sum(axis=0) == 0
+        scores = np.where(empty, stats.n, -1)
+        if scores.max() <= 0:
+            scores = np.where(empty, stats.p, -np.inf)
+        x, y = np.unravel_index(int(scores.argmax()), scores.shape)
+        return int(x), int(y)
+
+    def opponent_moves(self, x: int, y: int):
+        self.place(0, x, y)
+        # the engine moves next
+        self.chessboard = self.chessboard[::-1].copy()
+
+    def _parse_xy(self, text: str) -> Optional[Tuple[int, int]]:
+        try:
+            x, y = [int(v) for v in text.split(",")[:2]]
+        except ValueError:
+            return None
+        if not (0 <= x < CHESSBOARD_SIZE and 0 <= y < CHESSBOARD_SIZE) or \
+                self.chessboard[:, x, y].sum() > 0:
+            return None
+        return x, y
+
+    def _restart(self):
+        self.chessboard = np.zeros((2, CHESSBOARD_SIZE, CHESSBOARD_SIZE), dtype=np.float32)
+        self.tree_follows_game = False
+
+    def _play(self):
+        x, y = self.think()
+        self.send("{},{}".format(x, y))
+
+    def run(self, lines):
+        """Answers the commands of lines until END. Between turns, self.chessboard
+        is seen by the player to move.
+        """
+        lines = iter(lines)
+        for line in lines:
+            tokens = line.strip().split(maxsplit=1)
+            if len(tokens) == 0:
+                continue
+            command, arg = tokens[0].upper(), tokens[1] if len(tokens) > 1 else ""
+            if command == "START":
+                if arg.strip() != str(CHESSBOARD_SIZE):
+                    self.send("ERROR only {}x{} boards are supported".format(
+                        CHESSBOARD_SIZE, CHESSBOARD_SIZE))
+                    continue
+                self._restart()
+                self.send("OK")
+            elif command == "RESTART":
+                self._restart()
+                self.send("OK")
+            elif command == "INFO":
+                self._info(arg)
+            elif command == "BEGIN":
+                self._play()
+            elif command == "TURN":
+                xy = self._parse_xy(arg)
+                if xy is None:
+                    self.send("ERROR invalid move {}".format(arg))
+                    continue
+                self.opponent_moves(*xy)
+                self._play()
+            elif command == "BOARD":
+                self._board(lines)
+                self._play()
+            elif command == "ABOUT":
+                self.send('name="rl-gobang", version="1.0", country="CN", '
+                          'www="https://github.com/tigert1998/rl-gobang"')
+            elif command == "END":
+                break
+            else:
+                self.send("UNKNOWN {}".format(command))
+
+    def _info(self, arg: str):
+        tokens = arg.split()
+        if len(tokens) != 2:
+            return
+        key, value = tokens
+        try:
+            value = int(value)
+        except ValueError:
+            return
+        if key == "timeout_turn":
+            self.timeout_turn = value
+        elif key == "timeout_match":
+            self.timeout_match = value
+        elif key == "time_left":
+            self.time_left = value
+        elif key == "max_memory":
+            self.max_memory = value
+
+    def _board(self, lines):
+        """Reads "x,y,who" up to DONE, who is 1 for the engine and 2 for the opponent."""
+        self._restart()
+        for line in lines:
+            if line.strip().upper() == "DONE":
+                break
+            try:
+                x, y, who = [int(v) for v in line.split(",")]
+            except ValueError:
+                continue
+            self.chessboard[0 if who == 1 else 1, x, y] = 1
+
+
+if __name__ == "__main__":
+    # stdout is reserved for the protocol
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Piskvork protocol engine")
+    parser.add_argument("--ckpt", help="defaults to the best ckpt")
+    parser.add_argument("--device", default=INFER_DEVICE_ID)
+    args = parser.parse_args()
+
+    ckpt_path = args.ckpt
+    if ckpt_path is not None:
+        ckpt_path = os.path.join(_START_DIR, ckpt_path)
+    else:
+        with open(os.path.join(CKPT_DIR, "best"), "r") as f:
+            ckpt_path = os.path.join(CKPT_DIR, "{}.pt".format(int(f.read())))
+    network = load_ckpt(ckpt_path, args.device)
+    network.eval()
+    logging.info("{} has been loaded".format(ckpt_path))
+
+    PiskvorkEngine(network, args.device).run(sys.stdin)
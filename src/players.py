@@ -9,9 +9,11 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 
-from gobang_utils import stone_is_valid, simple_heuristics, mcts_nn_policy_generator
-from config import CHESSBOARD_SIZE, INFER_DEVICE_ID
-from mcts import MCTS
+from gobang_utils import stone_is_valid, mcts_nn_policy_generator
+from config import \
+    CHESSBOARD_SIZE, INFER_DEVICE_ID, PONDER_NUM_SIMS, PLAYER_MAX_TREE_BYTES, \
+    PLAYER_MCTS_BATCH, MCTS_VLOSS
+from mcts import MCTS, EVALUATOR_UNIFORM, EVALUATOR_HEURISTICS, native_greedy_scores
 from resnet import ResNet
 
 
@@ -79,14 +81,23 @@ def _random_policy(chessboard):
 RANDOM_PLAYER = AIPlayer(_random_policy)
 
 
-def _basic_mcts_policy(chessboard):
-    def base_policy(chessboard):
-        n = chessboard.shape[0]
-        policy = np.ones((n, CHESSBOARD_SIZE, CHESSBOARD_SIZE)) / CHESSBOARD_SIZE**2
-        value = np.zeros((n,))
-        return policy, value
+# the search sessions of the heuristic players, one per thread and evaluator
+_sessions = threading.local()
+
+
+def _session(chessboard, evaluator) -> MCTS:
+    if not hasattr(_sessions, "trees"):
+        _sessions.trees = {}
+    t = _sessions.trees.get(evaluator)
+    if t is None:
+        t = _sessions.trees[evaluator] = MCTS(chessboard, 1, 1, None, evaluator)
+    else:
+        t.reset(chessboard)
+    return t
 
-    t = MCTS(chessboard, 1, 1, base_policy)
+
+def _basic_mcts_policy(chessboard):
+    t = _session(chessboard, EVALUATOR_UNIFORM)
     t.search(1600, 3, None)
     pi = t.get_pi(0)
     choices = []
@@ -103,34 +114,16 @@ def _greedy_policy(chessboard):
     if not (chessboard.sum() > 0):
         return CHESSBOARD_SIZE // 2, CHESSBOARD_SIZE // 2
 
-    highest = -np.inf
-    choice = None
-    for x, y in itertools.product(range(CHESSBOARD_SIZE), range(CHESSBOARD_SIZE)):
-        if chessboard[:, x, y].sum() > 0:
-            continue
-        new_chessboard = chessboard.copy()
-        new_chessboard[0, x, y] = 1
-        v = simple_heuristics(new_chessboard)
-        new_chessboard[0, x, y] = 0
-        new_chessboard[1, x, y] = 1
-        v -= simple_heuristics(new_chessboard)
-        if v > highest:
-            highest = v
-            choice = (x, y)
-    return choice
+    scores = native_greedy_scores(chessboard)
+    x, y = np.unravel_index(np.argmax(scores), scores.shape)
+    return int(x), int(y)
 
 
 GREEDY_PLAYER = AIPlayer(_greedy_policy)
 
 
 def _greedy_mcts_policy(chessboard):
-    def base_policy(chessboard):
-        n = chessboard.shape[0]
-        policy = np.ones((n, CHESSBOARD_SIZE, CHESSBOARD_SIZE)) / CHESSBOARD_SIZE**2
-        value = np.array([simple_heuristics(chessboard[i]) for i in range(n)])
-        return policy, value
-
-    t = MCTS(chessboard, 1, 1, base_policy)
+    t = _session(chessboard, EVALUATOR_HEURISTICS)
     t.search(800, 3, None)
     pi = t.get_pi(0)
     choices = []
@@ -144,25 +137,111 @@ GREEDY_MCTS_PLAYER = AIPlayer(_greedy_mcts_policy)
 
 
 class NNMCTSAIPlayer(AIPlayer):
-    def __init__(self, ckpt_path):
-        ckpt = torch.load(ckpt_path, map_location=INFER_DEVICE_ID, weights_only=True)
+    """NNMCTSAIPlayer
+    With ponder enabled, the player keeps its search tree between moves and
+    keeps searching in a background thread while the opponent is thinking.
+    The tree is advanced with the opponent's move once it arrives
+    so that the accumulated visits are reused.
+    The tree is pruned to stay within PLAYER_MAX_TREE_BYTES.
+    One search session is kept for the lifetime of the player and reset to
+    the positions which do not follow the tree. Without ponder, the player may
+    play games on several threads at once, such as in tournament, with one
+    session per thread.
+    Positions of the opening book are played without searching.
+    """
+
+    def __init__(self, ckpt_path, ponder=False, device_id=INFER_DEVICE_ID, num_sims=1600,
+                 book=None):
+        ckpt = torch.load(ckpt_path, map_location=device_id, weights_only=True)
         self.network = ResNet()
         self.network.load_state_dict(ckpt)
         self.network.eval()
-        self.network.to(INFER_DEVICE_ID)
-
-        base_policy = mcts_nn_policy_generator(self.network, INFER_DEVICE_ID)
-
-        def policy(chessboard):
-            t = MCTS(chessboard, 1, 16, base_policy)
-            t.search(1600, 3, None)
-            pi = t.get_pi(0)
-            choices = []
-            for x, y in itertools.product(
-                range(CHESSBOARD_SIZE), range(CHESSBOARD_SIZE)
-            ):
-                if pi[x, y] > 0:
-                    choices.append((x, y))
-            return choices[random.randint(0, len(choices) - 1)]
-
-        super().__init__(policy)
+        self.network.to(device_id)
+
+        self.base_policy = mcts_nn_policy_generator(self.network, device_id)
+        self.num_sims = num_sims
+        self.ponder = ponder
+        self.book = book
+        self.tree = None
+        # the sessions of the threads playing without ponder
+        self._sessions = threading.local()
+        # whether the tree is rooted at the position after our previous move
+        self.tree_follows_game = False
+        self.ponder_thread = None
+
+        super().__init__(self._policy)
+
+    def _policy(self, chessboard):
+        self._stop_pondering()
+        entry = self.book.lookup(chessboard) if self.book is not None else None
+        if entry is not None:
+            # the tree is reset to the next position out of the book
+            self.tree_follows_game = False
+            x, y = np.unravel_index(entry[0].argmax(), entry[0].shape)
+            return int(x), int(y)
+        if self.ponder:
+            t = self._advance_tree(chessboard)
+        else:
+            t = self._reset_tree(chessboard)
+        with torch.no_grad():
+            t.search(self.num_sims, 3, None)
+        pi = t.get_pi(0)
+        choices = []
+        for x, y in itertools.product(
+            range(CHESSBOARD_SIZE), range(CHESSBOARD_SIZE)
+        ):
+            if pi[x, y] > 0:
+                choices.append((x, y))
+        choice = choices[random.randint(0, len(choices) - 1)]
+
+        if self.ponder:
+            t.step_forward(*choice)
+            self.tree_follows_game = True
+            if not t.terminated():
+                self._start_pondering()
+        return choice
+
+    def _advance_tree(self, chessboard) -> MCTS:
+        if self.tree_follows_game:
+            diff = chessboard - self.tree.chessboard()[::-1, :, :]
+            if diff.min() >= 0 and diff[0].sum() == 0 and diff[1].sum() == 1:
+                x, y = np.argwhere(diff[1] > 0)[0]
+                self.tree.step_forward(int(x), int(y))
+                return self.tree
+            logging.info("the chessboard does not follow the pondered tree")
+        return self._reset_tree(chessboard)
+
+    def _reset_tree(self, chessboard) -> MCTS:
+        # a pondering player follows a single game
+        owner = self if self.ponder else self._sessions
+        if getattr(owner, "tree", None) is None:
+            owner.tree = MCTS(chessboard, MCTS_VLOSS, PLAYER_MCTS_BATCH, self.base_policy)
+            owner.tree.set_byte_budget(PLAYER_MAX_TREE_BYTES)
+        else:
+            owner.tree.reset(chessboard)
+        self.tree_follows_game = False
+        return owner.tree
+
+    def _start_pondering(self):
+        def ponder_loop(t):
+            with torch.no_grad():
+                num_sims = t.search(PONDER_NUM_SIMS, 3, None)
+            logging.info("pondered {} simulations".format(num_sims))
+
+        self.tree.resume()
+        self.ponder_thread = threading.Thread(
+            target=ponder_loop, args=(self.tree,), daemon=True
+        )
+        self.ponder_thread.start()
+
+    def _stop_pondering(self, wait=True):
+        if self.ponder_thread is None:
+            return
+        self.tree.interrupt()
+        if wait:
+            self.ponder_thread.join()
+            self.ponder_thread = None
+            self.tree.resume()
+
+    def kill(self):
+        self._stop_pondering(wait=False)
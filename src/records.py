@@ -0,0 +1,127 @@
+from typing import List
+import struct
+
+import numpy as np
+
+from config import CHESSBOARD_SIZE
+
+PACKED_CHESSBOARD_BYTES = (2 * CHESSBOARD_SIZE ** 2 + 7) // 8
+
+
+def record_dtype(chessboard_size: int) -> np.dtype:
+    """A self-play position of chessboard_size, the chessboard is stored as np.packbits
+    of the (2, chessboard_size, chessboard_size) stones, p is only a policy target if
+    full_search is set.
+    """
+    return np.dtype([
+        ("chessboard", np.uint8, ((2 * chessboard_size ** 2 + 7) // 8,)),
+        ("p", np.float32, (chessboard_size ** 2,)),
+        ("v", np.float32),
+        ("full_search", np.bool_),
+    ])
+
+
+# 962 bytes on 15x15
+RECORD_DTYPE = record_dtype(CHESSBOARD_SIZE)
+
+# the version of the layout of RECORD_DTYPE, version 1 had no full_search
+RECORD_VERSION = 2
+
+# archives begin with the magic, the record version and the chessboard size,
+# archives written before the header are plain records of version 1 or 2
+_ARCHIVE_HEADER = struct.Struct("<4sHH")
+_ARCHIVE_MAGIC = b"GBRA"
+
+
+def _record_dtype_v1(chessboard_size: int) -> np.dtype:
+    return np.dtype([
+        ("chessboard", np.uint8, ((2 * chessboard_size ** 2 + 7) // 8,)),
+        ("p", np.float32, (chessboard_size ** 2,)),
+        ("v", np.float32),
+    ])
+
+
+def records_from_bytes(data, version: int = RECORD_VERSION) -> np.ndarray:
+    """Reads records of a version into RECORD_DTYPE, the positions of version 1
+    all come from full searches.
+    """
+    if version == RECORD_VERSION:
+        return np.frombuffer(data, dtype=RECORD_DTYPE)
+    if version != 1:
+        raise ValueError("unknown record version {}".format(version))
+    old = np.frombuffer(data, dtype=_record_dtype_v1(CHESSBOARD_SIZE))
+    arr = np.zeros(old.shape, dtype=RECORD_DTYPE)
+    for name in old.dtype.names:
+        arr[name] = old[name]
+    arr["full_search"] = True
+    return arr
+
+
+def guess_record_version(data) -> int:
+    """The version of headerless records, such as the games sent by older clients.
+    The lengths of the versions only coincide every 961 records, in which case
+    the records are read as version 2 if their full_search bytes are booleans.
+    """
+    itemsize_v1 = _record_dtype_v1(CHESSBOARD_SIZE).itemsize
+    is_v1 = len(data) % itemsize_v1 == 0
+    is_v2 = len(data) % RECORD_DTYPE.itemsize == 0
+    if is_v1 and is_v2:
+        n = RECORD_DTYPE.itemsize
+        full_searches = np.frombuffer(data, dtype=np.uint8)[n - 1::n]
+        is_v1 = not np.all(full_searches <= 1)
+        is_v2 = not is_v1
+    if is_v2:
+        return 2
+    if is_v1:
+        return 1
+    raise ValueError("{} bytes are not a whole number of records".format(len(data)))
+
+
+def pack_game(records: List[dict]) -> bytes:
+    """Packs the records of one self-play game into bytes of RECORD_VERSION."""
+    arr = np.zeros((len(records),), dtype=RECORD_DTYPE)
+    for i, record in enumerate(records):
+        arr[i]["chessboard"] = np.packbits(record["chessboard"].reshape((-1,)) > 0)
+        arr[i]["p"] = record["p"].reshape((-1,))
+        arr[i]["v"] = record["v"]
+        arr[i]["full_search"] = record["full_search"]
+    return arr.tobytes()
+
+
+def archive_game(path: str, records: List[dict]):
+    """Appends the records of a game to an archive, which begins with a header
+    of the record version and can be read with read_archive.
+    """
+    with open(path, "ab") as f:
+        if f.tell() == 0:
+            f.write(_ARCHIVE_HEADER.pack(_ARCHIVE_MAGIC, RECORD_VERSION, CHESSBOARD_SIZE))
+        f.write(pack_game(records))
+
+
+def read_archive(path: str) -> np.ndarray:
+    """Reads an archive into RECORD_DTYPE, including the archives written before
+    the header.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(_ARCHIVE_MAGIC)] != _ARCHIVE_MAGIC:
+        return records_from_bytes(data, guess_record_version(data))
+    _, version, chessboard_size = _ARCHIVE_HEADER.unpack_from(data)
+    if chessboard_size != CHESSBOARD_SIZE:
+        raise ValueError("the archive {} is of chessboard size {}".format(path, chessboard_size))
+    return records_from_bytes(data[_ARCHIVE_HEADER.size:], version)
+
+
+def unpack_game(data, version: int = RECORD_VERSION) -> List[dict]:
+    """Inverse of pack_game, also reads the records of older versions."""
+    arr = records_from_bytes(data, version)
+    chessboards = np.unpackbits(arr["chessboard"], axis=1, count=2 * CHESSBOARD_SIZE ** 2)\
+        .reshape((-1, 2, CHESSBOARD_SIZE, CHESSBOARD_SIZE)).astype(np.float32)
+    ps = arr["p"].reshape((-1, CHESSBOARD_SIZE, CHESSBOARD_SIZE))
+    return [
+        {
+            "chessboard": chessboards[i], "p": ps[i].copy(),
+            "v": np.float32(arr[i]["v"]), "full_search": bool(arr[i]["full_search"])
+        }
+        for i in range(len(arr))
+    ]
@@ -0,0 +1,51 @@
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+
+from tqdm import tqdm
+
+from gobang_utils import config_log
+from gobang_vis import save_history_img
+
+
+def load_histories(path: str):
+    """Reads the game file, one json per line holding the history as a list of
+    (who, x, y), either directly or in the "history" field like tournament writes.
+    """
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            game = json.loads(line)
+            yield game["history"] if isinstance(game, dict) else game
+
+
+def _render(task):
+    history, path = task
+    save_history_img(history, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="renders games to images")
+    parser.add_argument("games", help="the game file in json lines")
+    parser.add_argument("output_dir")
+    parser.add_argument("--format", choices=["gif", "jpeg"], default="gif")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    tasks = (
+        (history, os.path.join(args.output_dir, "{}.{}".format(i, args.format)))
+        for i, history in enumerate(load_histories(args.games))
+    )
+    with mp.Pool(args.workers) as pool:
+        for _ in tqdm(pool.imap_unordered(_render, tasks, chunksize=16)):
+            ...
+    logging.info("games have been rendered to {}".format(args.output_dir))
+
+
+if __name__ == "__main__":
+    config_log(None)
+    main()
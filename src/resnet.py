@@ -1,3 +1,5 @@
+import logging
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -28,10 +30,18 @@ class ResidualBlock(nn.Module):
 
 
 class ResNet(nn.Module):
-    def __init__(self):
+    def __init__(self, chessboard_size: int = config.CHESSBOARD_SIZE,
+                 size_agnostic: bool = config.SIZE_AGNOSTIC_HEADS):
+        """The policy and value network.
+
+        Args:
+            chessboard_size: The size of the chessboards of the fully connected heads.
+            size_agnostic: Whether the heads are convolutional and pooled instead,
+                so that the network evaluates chessboards of any size and its
+                checkpoints transfer between sizes.
+        """
         super(ResNet, self).__init__()
         c = config.NUM_FILTERS
-        chessboard_size = config.CHESSBOARD_SIZE
         hidden_units = config.VALUE_HEAD_HIDDEN_UNITS
 
         self.module_list = nn.Sequential(
@@ -40,6 +50,25 @@ class ResNet(nn.Module):
             nn.ReLU(),
             *[ResidualBlock() for _ in range(config.NUM_RESIDUAL_BLOCKS)]
         )
+        if size_agnostic:
+            self.policy_head = nn.Sequential(
+                nn.Conv2d(c, 2, 1),
+                nn.BatchNorm2d(2),
+                nn.ReLU(),
+                nn.Conv2d(2, 1, 1),
+            )
+            self.value_head = nn.Sequential(
+                nn.Conv2d(c, c, 1),
+                nn.BatchNorm2d(c),
+                nn.ReLU(),
+                nn.AdaptiveAvgPool2d(1),
+                Flatten(),
+                nn.Linear(c, hidden_units),
+                nn.ReLU(),
+                nn.Linear(hidden_units, 1),
+                nn.Tanh(),
+            )
+            return
         self.policy_head = nn.Sequential(
             nn.Conv2d(c, 2, 1),
             nn.BatchNorm2d(2),
@@ -60,16 +89,31 @@ class ResNet(nn.Module):
 
     def forward(self, x):
         net = self.module_list(x)
-        ret0 = self.policy_head(net).view(
-            -1, config.CHESSBOARD_SIZE, config.CHESSBOARD_SIZE
-        )
+        ret0 = self.policy_head(net).view(-1, x.shape[-2], x.shape[-1])
         ret1 = self.value_head(net)[:, 0]
         return (ret0, ret1)
 
 
-def load_ckpt(path: str, device_id: str) -> ResNet:
+def load_ckpt(path, device_id: str, transfer: bool = False, **kwargs) -> ResNet:
+    """Loads a ResNet from a checkpoint path or a file-like object.
+
+    Args:
+        path: The checkpoint.
+        device_id: The device to load the network onto.
+        transfer: Whether the checkpoint may come from a network of another size or
+            heads, the parameters of mismatching shapes are left initialized.
+        kwargs: The arguments of ResNet.
+    """
     ckpt = torch.load(path, map_location=device_id, weights_only=True)
-    network = ResNet()
-    network.load_state_dict(ckpt)
+    network = ResNet(**kwargs)
+    if transfer:
+        state = network.state_dict()
+        skipped = [k for k, v in ckpt.items() if k not in state or state[k].shape != v.shape]
+        network.load_state_dict(
+            {k: v for k, v in ckpt.items() if k not in skipped}, strict=False)
+        if len(skipped) > 0:
+            logging.warning("parameters not transferred: {}".format(", ".join(skipped)))
+    else:
+        network.load_state_dict(ckpt)
     network.to(device_id)
     return network
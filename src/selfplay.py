@@ -3,15 +3,24 @@ import multiprocessing as mp
 import time
 import os
 import logging
+from collections import deque
 
-import torch
-import torch.nn.functional as F
 import numpy as np
 
 from config import \
     CHESSBOARD_SIZE, CKPT_DIR, SELFPLAY_NUM_SIMS, \
-    SELFPLAY_CPUCT, SELFPLAY_ALPHA, SELFPLAY_MCTS_BATCH
+    SELFPLAY_CPUCT, SELFPLAY_ALPHA, SELFPLAY_MCTS_BATCH, OPENING_BOOK_EXPLORATION, \
+    RESIGN_INIT_THRESHOLD, RESIGN_CONSECUTIVE_MOVES, RESIGN_PLAYOUT_FRACTION, \
+    RESIGN_TARGET_FALSE_POSITIVE, RESIGN_MIN_PLAYOUTS, SELFPLAY_REPORT_INTERVAL, \
+    SELFPLAY_FULL_SEARCH_PROB, SELFPLAY_FAST_NUM_SIMS, SELFPLAY_PIPELINE_DEPTH, \
+    SELFPLAY_TEMPERATURE_MOVES, SELFPLAY_NOISE_FROM_MOVE, \
+    INFERENCE_TRACE_DIR, INFERENCE_TRACE_MAX_BATCHES, MCTS_VLOSS
+from game_ring import GameRing
+import metrics
 from mcts import MCTS
+from inference_trace import TraceRecorder
+from opening_book import load_opening_book
+from records import RECORD_DTYPE, pack_game, unpack_game
 from gobang_utils import action_from_prob, config_log, mcts_nn_policy_generator
 from resnet import load_ckpt
 
@@ -26,52 +35,178 @@ def get_best_ckpt_idx() -> int:
             time.sleep(0.25)
 
 
-def self_play(device_id, network):
+class Resigner:
+    """Resigner
+    Holds the threshold under which MCTS.play_game resigns for the player to move
+    (see RESIGN_CONSECUTIVE_MOVES), and recalibrates the threshold on
+    the games played out regardless so that the fraction of resignations by
+    players who would not have lost stays below RESIGN_TARGET_FALSE_POSITIVE.
+    Also accounts the simulations of the games to report the throughput.
+    """
+
+    def __init__(self):
+        self.threshold = RESIGN_INIT_THRESHOLD
+        # the highest threshold at which each player who did not lose
+        # a played out game would not have resigned
+        self.criticals = deque(maxlen=1000)
+        # the moves played out after the first resignation
+        self.moves_after_resign = deque(maxlen=1000)
+        self.num_games = 0
+        self.num_moves = 0
+        self.num_resigned = 0
+        self.num_playouts = 0
+        self.num_false_positives = 0
+        self.num_sims = 0
+        self.start_time = time.time()
+        self.report_time = self.start_time
+
+    @staticmethod
+    def _critical(scores) -> float:
+        k = RESIGN_CONSECUTIVE_MOVES
+        return min(
+            (max(scores[i: i + k]) for i in range(len(scores) - k + 1)),
+            default=float("inf")
+        )
+
+    def record(self, scores, num_moves: int, num_sims: int, playout: bool, resigned: bool,
+               resign_move, loser):
+        """Records a finished game.
+
+        Args:
+            scores: The scores of the moves of both players, indexed by the parity of the move.
+            num_moves: The number of moves played.
+            num_sims: The number of simulations performed.
+            playout: Whether the game has been played out regardless of resignation.
+            resigned: Whether the game ended with a resignation.
+            resign_move: The move at which a player resigned or would have resigned.
+            loser: The parity of the player who lost, or None for a draw.
+        """
+        self.num_games += 1
+        self.num_moves += num_moves
+        self.num_sims += num_sims
+        if resigned:
+            self.num_resigned += 1
+            return
+        if not playout:
+            return
+
+        self.num_playouts += 1
+        if resign_move is not None:
+            self.moves_after_resign.append(num_moves - resign_move)
+        for parity in range(2):
+            if parity == loser:
+                continue
+            critical = self._critical(scores[parity])
+            self.criticals.append(critical)
+            if critical < self.threshold:
+                self.num_false_positives += 1
+        if len(self.criticals) >= RESIGN_MIN_PLAYOUTS:
+            # never resigns a position the search considers even
+            self.threshold = min(float(np.quantile(
+                self.criticals, RESIGN_TARGET_FALSE_POSITIVE, method="lower")), 0)
+
+    def report(self):
+        if time.time() - self.report_time < SELFPLAY_REPORT_INTERVAL:
+            return
+        self.report_time = time.time()
+        # estimated by the games played out after a resignation
+        saved_sims = self.num_resigned * self.num_sims / max(self.num_moves, 1) * (
+            np.mean(self.moves_after_resign) if len(self.moves_after_resign) > 0 else 0)
+        logging.info(
+            "games = {}, games/hour = {:.1f}, resigned = {}, playouts = {}, "
+            "false positives = {}, resign threshold = {:.3f}, sims/game = {:.0f}, "
+            "saved sims = {:.1%} ({:.2f}x games/hour)".format(
+                self.num_games,
+                self.num_games / (time.time() - self.start_time) * 3600,
+                self.num_resigned, self.num_playouts, self.num_false_positives,
+                self.threshold, self.num_sims / max(self.num_games, 1),
+                saved_sims / max(self.num_sims + saved_sims, 1),
+                (self.num_sims + saved_sims) / max(self.num_sims, 1)
+            ))
+
+
+def self_play(device_id, network, book=None, resigner=None, trace=None) -> bytes:
+    """Plays a game against itself and returns its records packed by records.pack_game.
+    The visit distributions of the opening book are played in place of
+    searching until the game leaves the book, or at each position with probability
+    OPENING_BOOK_EXPLORATION. The rest of the game is played by MCTS.play_game.
+    With a resigner, the game stops once the player to move resigns,
+    except for the games played out to calibrate the resigner.
+    Only a fraction SELFPLAY_FULL_SEARCH_PROB of the moves is searched fully and
+    recorded as policy targets, see config.py.
+    With a TraceRecorder as trace, the leaf batches of the searches are recorded.
+    """
+    start_time = time.time()
     records = []
+    policy = mcts_nn_policy_generator(network, device_id)
     t = MCTS(
         np.zeros((2, CHESSBOARD_SIZE, CHESSBOARD_SIZE)).astype(np.float32),
-        1, SELFPLAY_MCTS_BATCH,
-        mcts_nn_policy_generator(network, device_id)
+        MCTS_VLOSS, SELFPLAY_MCTS_BATCH,
+        policy if trace is None else trace.wrap(policy)
     )
+    t.set_pipeline_depth(SELFPLAY_PIPELINE_DEPTH)
 
-    def get_temperature(i): return float(i < 8)
-    def get_alpha(i): return SELFPLAY_ALPHA if i >= 8 else None
+    while book is not None and not t.terminated() and \
+            random.random() >= OPENING_BOOK_EXPLORATION:
+        chessboard = t.chessboard()
+        entry = book.lookup(chessboard)
+        if entry is None:
+            break
+        records.append({"chessboard": chessboard, "p": entry[0], "v": None, "full_search": True})
+        t.step_forward(*action_from_prob(entry[0]))
 
-    i = 0
-    while not t.terminated():
-        with torch.no_grad():
-            t.search(
-                SELFPLAY_NUM_SIMS, SELFPLAY_CPUCT,
-                get_alpha(i)
-            )
-        p = t.get_pi(get_temperature(i))
-        records.append({
-            "chessboard": t.chessboard(),
-            "p": p,
-            "v": None
-        })
-        x, y = action_from_prob(p)
-        t.step_forward(x, y)
-        i += 1
-
-    records[-1]["v"] = -t.v()
-    for i in reversed(range(len(records) - 1)):
-        records[i]["v"] = -records[i + 1]["v"]
-    return records
-
-
-def self_play_main(device_id: str, data_queue: mp.Queue, pid: mp.Value):
-    # double fork
-    fork_pid = os.fork()
-    if fork_pid != 0:
-        pid.value = fork_pid
-        return
+    playout = random.random() < RESIGN_PLAYOUT_FRACTION
+    game = t.play_game(
+        SELFPLAY_NUM_SIMS, SELFPLAY_FAST_NUM_SIMS, SELFPLAY_FULL_SEARCH_PROB,
+        SELFPLAY_CPUCT, SELFPLAY_ALPHA, SELFPLAY_TEMPERATURE_MOVES, SELFPLAY_NOISE_FROM_MOVE,
+        resigner.threshold if resigner is not None else 0,
+        RESIGN_CONSECUTIVE_MOVES if resigner is not None else 0,
+        playout, len(records)
+    )
+
+    if game.resigned:
+        loser = game.num_moves % 2
+    else:
+        # the game ends with the move of the winner or a draw
+        loser = game.num_moves % 2 if t.v() < 0 else None
+    if resigner is not None:
+        scores = [
+            [float(score) for score in game.scores[parity::2] if not np.isnan(score)]
+            for parity in range(2)
+        ]
+        resigner.record(scores, game.num_moves, game.num_sims, playout, game.resigned,
+                        game.resign_move, loser)
+    # the value of the position after the opening
+    v = game.records[0]["v"] if len(game.records) > 0 else t.v()
+    for record in reversed(records):
+        v = -v
+        record["v"] = np.float32(v)
+
+    metrics.inc("selfplay_games_total", result="resigned" if game.resigned else "finished")
+    metrics.inc("selfplay_positions_total", len(records) + len(game.records))
+    metrics.inc("selfplay_book_positions_total", len(records))
+    metrics.inc("selfplay_sims_total", game.num_sims)
+    metrics.observe("selfplay_game_seconds", time.time() - start_time)
+    metrics.observe("selfplay_game_moves", game.num_moves, metrics.MOVES_BUCKETS)
+    return pack_game(records) + game.records.tobytes()
 
+
+def self_play_main(device_id: str, data_queue: mp.Queue, stop_event: mp.Event):
     config_log("selfplay-{}.log".format(os.getpid()))
+    metrics.start_pushing("selfplay")
 
     network = None
     prev_best_idx = None
-    while True:
+    resigner = Resigner()
+    trace = None
+    if INFERENCE_TRACE_DIR is not None:
+        os.makedirs(INFERENCE_TRACE_DIR, exist_ok=True)
+        trace = TraceRecorder(
+            os.path.join(INFERENCE_TRACE_DIR, "selfplay-{}.trace".format(os.getpid())),
+            INFERENCE_TRACE_MAX_BATCHES
+        )
+    # the game in progress is finished and sent before stopping
+    while not stop_event.is_set():
         best_idx = get_best_ckpt_idx()
         if best_idx != prev_best_idx:
             logging.info("found a new best ckpt index: {}".format(best_idx))
@@ -81,8 +216,19 @@ def self_play_main(device_id: str, data_queue: mp.Queue, pid: mp.Value):
                 device_id
             )
             network.eval()
+            book = load_opening_book()
 
-        records = self_play(device_id, network)
-        logging.info("sending records: len(records) = {}".format(len(records)))
-        data_queue.put(records)
+        game = self_play(device_id, network, book, resigner, trace)
+        logging.info("sending records: len(records) = {}".format(
+            len(game) // RECORD_DTYPE.itemsize))
+        if isinstance(data_queue, GameRing):
+            data_queue.put_packed(game)
+        else:
+            data_queue.put(unpack_game(game))
+        resigner.report()
         prev_best_idx = best_idx
+
+    if trace is not None:
+        trace.close()
+    metrics.push()
+    logging.info("stopped")
@@ -0,0 +1,48 @@
+import argparse
+import logging
+
+from config import INGEST_PORT
+from gobang_utils import config_log
+from inference_trace import TraceRecorder
+from ingest import GameUploader, fetch_ckpt
+from opening_book import load_opening_book
+from records import RECORD_DTYPE
+from resnet import load_ckpt
+from selfplay import self_play, Resigner
+
+
+def self_play_client_main(host: str, port: int, device_id: str, book_path=None,
+                          trace_path=None):
+    uploader = GameUploader(host, port)
+    trace = TraceRecorder(trace_path) if trace_path is not None else None
+    book = load_opening_book(book_path)
+    resigner = Resigner()
+    network = None
+    version = -1
+    while True:
+        if network is None or \
+                (uploader.best_version is not None and uploader.best_version != version):
+            new_version, ckpt = fetch_ckpt(host, port, version)
+            if ckpt is not None:
+                logging.info("found a new best ckpt index: {}".format(new_version))
+                network = load_ckpt(ckpt, device_id)
+                network.eval()
+            version = new_version
+
+        game = self_play(device_id, network, book, resigner, trace)
+        logging.info("sending records: len(records) = {}".format(
+            len(game) // RECORD_DTYPE.itemsize))
+        uploader.put(game)
+        resigner.report()
+
+
+if __name__ == "__main__":
+    config_log(None)
+    parser = argparse.ArgumentParser(description="remote self-play client")
+    parser.add_argument("--host", default="127.0.0.1", help="host of the trainer")
+    parser.add_argument("--port", type=int, default=INGEST_PORT)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--book", help="path to a local copy of the opening book")
+    parser.add_argument("--trace", help="records the leaf batches for inference_trace.py")
+    args = parser.parse_args()
+    self_play_client_main(args.host, args.port, args.device, args.book, args.trace)
@@ -0,0 +1,254 @@
+from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing as mp
+import os
+import random
+import threading
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from config import CHESSBOARD_SIZE
+from gobang_utils import stone_is_valid, winner_after_move, config_log, BatchedPolicy
+from players import \
+    RANDOM_PLAYER, GREEDY_PLAYER, BASIC_MCTS_PLAYER, GREEDY_MCTS_PLAYER, \
+    NNMCTSAIPlayer
+
+BUILTIN_PLAYERS = {
+    "random": RANDOM_PLAYER,
+    "greedy": GREEDY_PLAYER,
+    "basic_mcts": BASIC_MCTS_PLAYER,
+    "greedy_mcts": GREEDY_MCTS_PLAYER,
+}
+
+# players are built lazily once per worker process
+_worker_players = {}
+_worker_players_lock = threading.Lock()
+_worker_config = {}
+
+
+def _init_worker(num_sims: int, concurrency: int):
+    torch.set_num_threads(1)
+    _worker_config["num_sims"] = num_sims
+    _worker_config["concurrency"] = concurrency
+
+
+def _get_player(spec: str):
+    # the game threads of a worker ask for the players at once
+    with _worker_players_lock:
+        if spec not in _worker_players:
+            if spec in BUILTIN_PLAYERS:
+                player = BUILTIN_PLAYERS[spec]
+            else:
+                player = NNMCTSAIPlayer(
+                    spec, device_id="cpu", num_sims=_worker_config["num_sims"]
+                )
+                # the games running concurrently in this process share one batch,
+                # which rarely fills up as the games alternate between two players,
+                # it is run once no game has sent a request for idle_wait
+                player.base_policy = BatchedPolicy(
+                    player.base_policy, _worker_config["concurrency"]
+                )
+            _worker_players[spec] = player
+    return _worker_players[spec]
+
+
+def random_opening(rng: random.Random, num_plies: int) -> List[Tuple[int, int, int]]:
+    center = CHESSBOARD_SIZE // 2
+    cells = list(itertools.product(
+        range(center - 3, center + 4), range(center - 3, center + 4)
+    ))
+    return [(i % 2, x, y) for i, (x, y) in enumerate(rng.sample(cells, num_plies))]
+
+
+def play_game(black: str, white: str, opening: List[Tuple[int, int, int]]) -> dict:
+    players = [_get_player(black), _get_player(white)]
+    chessboard = np.zeros((2, CHESSBOARD_SIZE, CHESSBOARD_SIZE)).astype(np.float32)
+    history = []
+    for who, x, y in opening:
+        chessboard[who, x, y] = 1
+        history.append((who, x, y))
+
+    who = len(opening) % 2
+    winner = -1
+    while winner == -1:
+        x, y = players[who].evaluate(who, chessboard)
+        x, y = int(x), int(y)
+        if not stone_is_valid(chessboard, x, y):
+            logging.error("invalid stone placed by {} at ({}, {})".format(
+                [black, white][who], x, y))
+            winner = 1 - who
+            break
+        chessboard[who, x, y] = 1
+        history.append((who, x, y))
+        winner = winner_after_move(chessboard, who, x, y)
+        who = 1 - who
+
+    return {"black": black, "white": white, "winner": winner, "history": history}
+
+
+def _play_games(task) -> List[dict]:
+    black, white, openings = task
+    if len(openings) == 0:
+        return []
+    # the exception of a game is raised in the worker instead of leaving a hole
+    with ThreadPoolExecutor(max_workers=len(openings)) as executor:
+        futures = [executor.submit(play_game, black, white, opening) for opening in openings]
+        return [future.result() for future in futures]
+
+
+def fit_elo(num_players: int, games: List[Tuple[int, int, float]], prior_sd=1000.0):
+    """Fits Bradley-Terry ratings on the Elo scale.
+
+    Args:
+        num_players: The number of players.
+        games: A list of (i, j, score of i), where the score is 1, 0.5 or 0.
+        prior_sd: The standard deviation of the Gaussian prior in Elo, which
+            keeps the ratings finite for players winning or losing every game.
+
+    Returns:
+        The ratings centered on zero and their standard deviations.
+    """
+    scale = np.log(10) / 400
+    inv_var = 1 / (prior_sd * scale) ** 2
+    n = np.zeros((num_players, num_players))
+    w = np.zeros((num_players, num_players))
+    for i, j, score in games:
+        n[i, j] += 1
+        n[j, i] += 1
+        w[i, j] += score
+        w[j, i] += 1 - score
+
+    s = np.zeros((num_players,))
+    for _ in range(100):
+        p = 1 / (1 + np.exp(s[None, :] - s[:, None]))
+        grad = (w - n * p).sum(axis=1) - s * inv_var
+        fisher = n * p * (1 - p)
+        hessian = fisher - np.diag(fisher.sum(axis=1) + inv_var)
+        step = np.linalg.solve(hessian, grad)
+        s -= step
+        if np.abs(step).max() < 1e-9:
+            break
+
+    p = 1 / (1 + np.exp(s[None, :] - s[:, None]))
+    fisher = n * p * (1 - p)
+    cov = np.linalg.inv(np.diag(fisher.sum(axis=1) + inv_var) - fisher)
+    return (s - s.mean()) / scale, np.sqrt(np.diag(cov)) / scale
+
+
+def schedule(specs: List[str], mode: str, num_games: int, opening_plies: int,
+             concurrency: int, seed: int):
+    if mode == "gauntlet":
+        pairs = [(0, j) for j in range(1, len(specs))]
+    else:
+        pairs = list(itertools.combinations(range(len(specs)), 2))
+
+    rng = random.Random(seed)
+    tasks = []
+    for a, b in pairs:
+        # every opening is played twice with the colours swapped
+        games = []
+        for k in range(num_games):
+            if k % 2 == 0:
+                opening = random_opening(rng, opening_plies)
+            black, white = (a, b) if k % 2 == 0 else (b, a)
+            games.append((specs[black], specs[white], opening))
+        games.sort(key=lambda game: game[:2])
+        for (black, white), group in itertools.groupby(games, key=lambda game: game[:2]):
+            openings = [game[2] for game in group]
+            for i in range(0, len(openings), concurrency):
+                tasks.append((black, white, openings[i: i + concurrency]))
+    return pairs, tasks
+
+
+def summarize(specs: List[str], pairs, games: List[dict]) -> dict:
+    index = {spec: i for i, spec in enumerate(specs)}
+    pair_results = {
+        pair: {"a": specs[pair[0]], "b": specs[pair[1]], "games": 0,
+               "a_wins": 0, "b_wins": 0, "draws": 0, "a_black_wins": 0, "b_black_wins": 0}
+        for pair in pairs
+    }
+    scores = []
+    for game in games:
+        i, j = index[game["black"]], index[game["white"]]
+        result = pair_results[(min(i, j), max(i, j))]
+        result["games"] += 1
+        if game["winner"] == -2:
+            result["draws"] += 1
+            scores.append((i, j, 0.5))
+            continue
+        scores.append((i, j, float(game["winner"] == 0)))
+        winner = [i, j][game["winner"]]
+        prefix = "a" if winner == min(i, j) else "b"
+        result[prefix + "_wins"] += 1
+        if game["winner"] == 0:
+            result[prefix + "_black_wins"] += 1
+
+    elo, sd = fit_elo(len(specs), scores)
+    ratings = [
+        {"player": spec, "elo": elo[i],
+         "ci_low": elo[i] - 1.96 * sd[i], "ci_high": elo[i] + 1.96 * sd[i]}
+        for i, spec in enumerate(specs)
+    ]
+    ratings.sort(key=lambda rating: -rating["elo"])
+    return {"pairs": list(pair_results.values()), "ratings": ratings}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tournament")
+    parser.add_argument(
+        "players", nargs="+",
+        help="builtin players ({}) or checkpoint paths".format(", ".join(BUILTIN_PLAYERS))
+    )
+    parser.add_argument("--mode", choices=["round-robin", "gauntlet"], default="round-robin",
+                        help="gauntlet only plays the first player against the others")
+    parser.add_argument("--games", type=int, default=20, help="number of games per pair")
+    parser.add_argument("--opening-plies", type=int, default=2,
+                        help="number of random stones placed before the game starts")
+    parser.add_argument("--num-sims", type=int, default=800,
+                        help="number of simulations per move of checkpoint players")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="number of games played concurrently by each worker")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="tournament.json")
+    parser.add_argument("--games-output", default=None,
+                        help="optionally writes the game histories as json lines")
+    args = parser.parse_args()
+
+    pairs, tasks = schedule(
+        args.players, args.mode, args.games, args.opening_plies,
+        args.concurrency, args.seed
+    )
+    logging.info("playing {} games with {} workers".format(
+        len(pairs) * args.games, args.workers))
+
+    games = []
+    with mp.Pool(
+        args.workers, initializer=_init_worker,
+        initargs=(args.num_sims, args.concurrency)
+    ) as pool:
+        for result in tqdm(pool.imap_unordered(_play_games, tasks), total=len(tasks)):
+            games.extend(result)
+
+    summary = summarize(args.players, pairs, games)
+    with open(args.output, "w") as f:
+        json.dump(summary, f, indent=2)
+    if args.games_output is not None:
+        with open(args.games_output, "w") as f:
+            for game in games:
+                f.write(json.dumps(game) + "\n")
+
+    for rating in summary["ratings"]:
+        logging.info("{:>8.1f} [{:>8.1f}, {:>8.1f}] {}".format(
+            rating["elo"], rating["ci_low"], rating["ci_high"], rating["player"]))
+
+
+if __name__ == "__main__":
+    config_log(None)
+    main()
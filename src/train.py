@@ -1,22 +1,34 @@
 import multiprocessing as mp
+import queue
 import threading
 import os
 import logging
 import tempfile
 import shutil
+import time
+import datetime
 
 import numpy as np
 import torch
-from torch.utils.data import Dataset, DataLoader
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import Dataset, default_collate
 import torch.nn.functional as F
 
 from config import \
     CKPT_DIR, CHESSBOARD_SIZE, EVAL_FREQ, \
     EVAL_CPUCT, EVAL_NUM_SIMS, EVAL_MCTS_BATCH, \
-    TRAIN_LR
+    TRAIN_LR, TRAIN_BATCH_SIZE, TRAIN_REPLAY_RATIO, TRAIN_REPORT_INTERVAL, \
+    REPLAY_BUFFER_SIZE, INGEST_HOST, INGEST_PORT, GAME_ARCHIVE_DIR, \
+    TRAIN_DIST_PORT, TRAIN_DIST_TIMEOUT, MCTS_VLOSS, \
+    TRAIN_FAST, TRAIN_PREFETCH_BATCHES, TRAIN_AMP, TRAIN_COMPILE
 from resnet import load_ckpt
 from mcts import MCTS
-from gobang_utils import config_log, action_from_prob, mcts_nn_policy_generator
+from gobang_utils import config_log, action_from_prob, mcts_nn_policy_generator, augment
+from ingest import start_ingest_server
+import metrics
+from opening_book import load_opening_book
+from records import archive_game
 
 
 def update_best_ckpt_idx(new_best):
@@ -28,67 +40,208 @@ def update_best_ckpt_idx(new_best):
 
 
 class GobangSelfPlayDataset(Dataset):
-    def __init__(self, records, num_games):
-        self.records = records
-        self.num_games = num_games
-        self._augument()
-        for record in self.records:
-            for name in ["chessboard", "p"]:
-                record[name] = record[name].copy()
+    """GobangSelfPlayDataset
+    A replay window keeping the most recent capacity positions.
+    Every position is augmented with the 8 symmetries of the chessboard on access.
+    The policy weight of a position is 1 if p comes from a full search and 0 otherwise.
+    """
+
+    def __init__(self, capacity):
+        self.chessboards = np.zeros(
+            (capacity, 2, CHESSBOARD_SIZE, CHESSBOARD_SIZE), dtype=np.uint8)
+        self.ps = np.zeros(
+            (capacity, CHESSBOARD_SIZE, CHESSBOARD_SIZE), dtype=np.float32)
+        self.vs = np.zeros((capacity,), dtype=np.float32)
+        self.full_searches = np.zeros((capacity,), dtype=np.bool_)
+        self.capacity = capacity
+        self.size = 0
+        self.cursor = 0
+
+    def extend(self, records):
+        for record in records:
+            self.chessboards[self.cursor] = record["chessboard"]
+            self.ps[self.cursor] = record["p"]
+            self.vs[self.cursor] = record["v"]
+            self.full_searches[self.cursor] = record["full_search"]
+            self.cursor = (self.cursor + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
 
     def __len__(self):
-        return len(self.records)
+        return self.size * 8
+
+    def save(self, path: str):
+        np.savez(
+            path, chessboards=self.chessboards[:self.size],
+            ps=self.ps[:self.size], vs=self.vs[:self.size],
+            full_searches=self.full_searches[:self.size], cursor=self.cursor
+        )
+
+    def load(self, path: str):
+        """Loads a replay buffer saved by save, one of another chessboard size
+        such as that of an earlier stage of a curriculum is skipped.
+        """
+        with np.load(path) as f:
+            if f["chessboards"].shape[1:] != self.chessboards.shape[1:]:
+                logging.warning("skipping the replay buffer {} of chessboards of shape {}".format(
+                    path, f["chessboards"].shape[1:]))
+                return
+            size = min(f["vs"].shape[0], self.capacity)
+            self.chessboards[:size] = f["chessboards"][:size]
+            self.ps[:size] = f["ps"][:size]
+            self.vs[:size] = f["vs"][:size]
+            # replay buffers saved before playout cap randomization
+            self.full_searches[:size] = \
+                f["full_searches"][:size] if "full_searches" in f else True
+            self.size = size
+            self.cursor = int(f["cursor"]) % self.capacity
+
+    def batch(self, indices) -> dict:
+        """The positions of indices collated into contiguous tensors at once,
+        equal to default_collate of the items.
+        """
+        record_indices, options = np.divmod(indices, 8)
+        chessboards = self.chessboards[record_indices]
+        ps = self.ps[record_indices]
+        for option in np.unique(options):
+            mask = options == option
+            chessboards[mask], ps[mask] = augment(chessboards[mask], ps[mask], option)
+        return {
+            "chessboard": torch.from_numpy(chessboards.astype(np.float32)),
+            "p": torch.from_numpy(ps),
+            "v": torch.from_numpy(self.vs[record_indices]),
+            "policy_weight": torch.from_numpy(
+                self.full_searches[record_indices].astype(np.float32))
+        }
 
     def __getitem__(self, idx):
-        return self.records[idx]
-
-    def _augument(self):
-        ret = []
-        for record in self.records:
-            chessboard, p, v = record["chessboard"], record["p"], record["v"]
-            for option in range(8):
-                new_chessboard = chessboard
-                new_p = p
-                if (option & 1) > 0:
-                    new_chessboard = np.flip(new_chessboard, -1)
-                    new_p = np.flip(new_p, -1)
-                rot_idx = option >> 1
-                new_chessboard = np.rot90(new_chessboard, rot_idx, (-2, -1))
-                new_p = np.rot90(new_p, rot_idx, (-2, -1))
-                ret.append({"chessboard": new_chessboard, "p": new_p, "v": v})
-        np.random.shuffle(ret)
-        self.records = ret
+        record_idx, option = divmod(idx, 8)
+        chessboard, p = augment(
+            self.chessboards[record_idx], self.ps[record_idx], option)
+        return {
+            "chessboard": chessboard.astype(np.float32),
+            "p": p.copy(),
+            "v": self.vs[record_idx],
+            "policy_weight": np.float32(self.full_searches[record_idx])
+        }
 
 
 class RecordBuffer:
-    def __init__(self):
-        self.records = []
+    """RecordBuffer
+    Accumulates the self-play records in a replay window and
+    counts the positions produced by self-play and consumed by training.
+    With data-parallel training, each rank keeps its shard of the games.
+    """
+
+    def __init__(self, capacity=REPLAY_BUFFER_SIZE):
+        self.dataset = GobangSelfPlayDataset(capacity)
+        # including the games sent to other ranks
         self.num_games = 0
+        self.num_produced = 0
+        self.num_consumed = 0
+        self.closed = False
         self.cv = threading.Condition()
 
-    def extend(self, records):
+    def extend(self, records, local=True):
+        """Adds a game, games of the shards of other ranks are only counted."""
         self.cv.acquire()
-        self.records.extend(records)
         self.num_games += 1
+        if local:
+            self.dataset.extend(records)
+            self.num_produced += len(records)
         self.cv.notify_all()
         self.cv.release()
 
-    def get_dataset(self) -> GobangSelfPlayDataset:
+    def close(self):
         self.cv.acquire()
-        while len(self.records) == 0:
-            self.cv.wait()
-        records = self.records
-        num_games = self.num_games
-        self.records = []
-        self.num_games = 0
+        self.closed = True
+        self.cv.notify_all()
         self.cv.release()
-        return GobangSelfPlayDataset(records, num_games)
 
-
-def get_data_loop(record_buffer: RecordBuffer, data_queue: mp.Queue):
+    def backlog(self, replay_ratio: float) -> float:
+        """The number of self-play positions the trainer is behind replay_ratio."""
+        return self.num_produced - self.num_consumed / replay_ratio
+
+    def sample(self, batch_size: int, replay_ratio: float, precollated: bool = False):
+        """Samples a minibatch uniformly from the replay window.
+        Blocks while consuming the minibatch would exceed replay_ratio
+        training samples per self-play position.
+        Returns None once the buffer has been closed.
+        With precollated, the minibatch is collated by GobangSelfPlayDataset.batch.
+        """
+        self.cv.acquire()
+        while not self.closed and (
+            self.dataset.size == 0 or
+            self.num_consumed + batch_size > replay_ratio * self.num_produced
+        ):
+            self.cv.wait()
+        if self.closed:
+            self.cv.release()
+            return None
+        indices = np.random.randint(len(self.dataset), size=batch_size)
+        if precollated:
+            batch = self.dataset.batch(indices)
+        else:
+            batch = default_collate([self.dataset[idx] for idx in indices])
+        self.num_consumed += batch_size
+        self.cv.release()
+        return batch
+
+
+class BatchPrefetcher:
+    """BatchPrefetcher
+    Samples pre-collated minibatches of a RecordBuffer ahead on a background thread
+    and pins them, so that sampling and the copies to the device overlap the training steps.
+    The prefetched minibatches count as consumed for the replay ratio.
+    """
+
+    def __init__(self, record_buffer: RecordBuffer, batch_size: int, replay_ratio: float,
+                 num_batches: int, pin_memory: bool):
+        self.record_buffer = record_buffer
+        self.batch_size = batch_size
+        self.replay_ratio = replay_ratio
+        self.pin_memory = pin_memory
+        self.queue = queue.Queue(maxsize=num_batches)
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _loop(self):
+        while True:
+            batch = self.record_buffer.sample(self.batch_size, self.replay_ratio, precollated=True)
+            if batch is not None and self.pin_memory:
+                batch = {key: value.pin_memory() for key, value in batch.items()}
+            self.queue.put(batch)
+            if batch is None:
+                break
+
+    def get(self):
+        """The next minibatch, None once the record buffer has been closed."""
+        return self.queue.get()
+
+
+def get_data_loop(record_buffer: RecordBuffer, data_queue: mp.Queue, stop_event: mp.Event,
+                  archive_path=None, shard_queues=()):
+    """Receives the games of data_queue until it is empty after stop_event is set
+    or None is received. The games are dealt round-robin to this rank and the
+    other ranks through shard_queues, which get None once the loop is over.
+    """
+    num_shards = len(shard_queues) + 1
     while True:
-        records = data_queue.get()
-        record_buffer.extend(records)
+        try:
+            records = data_queue.get(timeout=1)
+        except queue.Empty:
+            if stop_event.is_set():
+                break
+            continue
+        if records is None:
+            break
+        shard = record_buffer.num_games % num_shards
+        if shard > 0:
+            shard_queues[shard - 1].put(records)
+        record_buffer.extend(records, local=shard == 0)
+        if archive_path is not None:
+            archive_game(archive_path, records)
+    for shard_queue in shard_queues:
+        shard_queue.put(None)
+    record_buffer.close()
 
 
 def evaluate_against_best_ckpt(candidate_network, device_id) -> bool:
@@ -104,92 +257,287 @@ def evaluate_against_best_ckpt(candidate_network, device_id) -> bool:
         lambda network: mcts_nn_policy_generator(network, device_id),
         [best_network, candidate_network]
     ))
+    book = load_opening_book()
 
     who = 0
     chessboard = np.zeros((2, CHESSBOARD_SIZE, CHESSBOARD_SIZE))\
         .astype(np.float32)
+    # one session per player, reset to every position
+    trees = [MCTS(chessboard, MCTS_VLOSS, EVAL_MCTS_BATCH, policy) for policy in policies]
     while True:
-        t = MCTS(
-            chessboard if who == 0 else chessboard[::-1, :, :],
-            1, EVAL_MCTS_BATCH,
-            policies[who]
-        )
+        t = trees[who]
+        t.reset(chessboard if who == 0 else chessboard[::-1, :, :])
         if t.terminated():
             return who == 0
-        t.search(EVAL_NUM_SIMS, EVAL_CPUCT, None)
-        pi = t.get_pi(0)
-        x, y = action_from_prob(pi)
+        entry = book.lookup(t.chessboard()) if book is not None else None
+        if entry is not None:
+            pi = entry[0]
+            x, y = np.unravel_index(pi.argmax(), pi.shape)
+        else:
+            t.search(EVAL_NUM_SIMS, EVAL_CPUCT, None)
+            pi = t.get_pi(0)
+            x, y = action_from_prob(pi)
         chessboard[who][x][y] = 1
         who = 1 - who
 
     return False
 
 
-def train_main(device_id: str, init_ckpt_idx: int, data_queue: mp.Queue, pid: mp.Value):
-    # double fork
-    fork_pid = os.fork()
-    if fork_pid != 0:
-        pid.value = fork_pid
-        return
+def _replay_buffer_path(rank=0):
+    if rank == 0:
+        return os.path.join(CKPT_DIR, "replay.npz")
+    return os.path.join(CKPT_DIR, "replay-{}.npz".format(rank))
+
+
+def train_step(network, optimizer, batch, device_id) -> float:
+    """Performs an optimization step on a minibatch of RecordBuffer.sample,
+    returns the loss.
+    """
+    chessboard = batch["chessboard"].to(device_id)
+    p = batch["p"].to(device_id)
+    v = batch["v"].to(device_id)
+    policy_weight = batch["policy_weight"].to(device_id)
+
+    optimizer.zero_grad()
+    out_p, out_v = network(chessboard)
 
+    # fast searches only contribute to the value loss
+    policy_loss = -torch.sum(
+        F.log_softmax(out_p.view((-1, CHESSBOARD_SIZE ** 2)), dim=-1) *
+        p.view((-1, CHESSBOARD_SIZE ** 2)),
+        dim=1
+    )
+    loss = F.mse_loss(v, out_v) + \
+        torch.sum(policy_loss * policy_weight) / torch.clamp(policy_weight.sum(), min=1)
+
+    loss.backward()
+    optimizer.step()
+    return loss.item()
+
+
+def policy_value_loss(out_p, out_v, p, v, policy_weight):
+    """The loss of train_step with the policy loss as a single cross entropy kernel
+    over the soft targets.
+    """
+    policy_loss = F.cross_entropy(
+        out_p.view((-1, CHESSBOARD_SIZE ** 2)), p.view((-1, CHESSBOARD_SIZE ** 2)),
+        reduction="none"
+    )
+    return F.mse_loss(v, out_v) + \
+        torch.sum(policy_loss * policy_weight) / torch.clamp(policy_weight.sum(), min=1)
+
+
+def autocast_dtype(device_id: str):
+    """bf16, or fp16 on the cuda devices without bf16, None on the devices
+    without autocast.
+    """
+    device_type = torch.device(device_id).type
+    if device_type == "cuda":
+        return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    if device_type == "cpu":
+        return torch.bfloat16
+    return None
+
+
+class FastTrainStep:
+    """FastTrainStep
+    train_step of the throughput mode on the minibatches of BatchPrefetcher.
+    The forward pass runs under autocast_dtype if amp is set, and is compiled
+    together with policy_value_loss if compiled is set. The loss is returned
+    as a tensor so that the step never waits for the device.
+    """
+
+    def __init__(self, network, optimizer, device_id: str, amp: bool = True,
+                 compiled: bool = True):
+        self.network = network
+        self.optimizer = optimizer
+        self.device_id = device_id
+        self.dtype = autocast_dtype(device_id) if amp else None
+        # fp16 gradients underflow without loss scaling
+        self.scaler = torch.cuda.amp.GradScaler() if self.dtype == torch.float16 else None
+        self.loss = torch.compile(self._loss) if compiled else self._loss
+
+    def _loss(self, chessboard, p, v, policy_weight):
+        with torch.autocast(torch.device(self.device_id).type, dtype=self.dtype,
+                            enabled=self.dtype is not None):
+            out_p, out_v = self.network(chessboard)
+        return policy_value_loss(out_p.float(), out_v.float(), p, v, policy_weight)
+
+    def __call__(self, batch) -> torch.Tensor:
+        batch = {
+            key: value.to(self.device_id, non_blocking=True) for key, value in batch.items()
+        }
+        self.optimizer.zero_grad(set_to_none=True)
+        loss = self.loss(batch["chessboard"], batch["p"], batch["v"], batch["policy_weight"])
+        if self.scaler is None:
+            loss.backward()
+            self.optimizer.step()
+        else:
+            self.scaler.scale(loss).backward()
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
+        return loss.detach()
+
+
+def init_data_parallel(rank: int, num_ranks: int, port: int = TRAIN_DIST_PORT):
+    dist.init_process_group(
+        "gloo", init_method="tcp://127.0.0.1:{}".format(port),
+        rank=rank, world_size=num_ranks,
+        # the other ranks wait for rank 0 while it evaluates the network
+        timeout=datetime.timedelta(seconds=TRAIN_DIST_TIMEOUT)
+    )
+
+
+def all_ranks_have_batch(batch) -> bool:
+    flag = torch.tensor([int(batch is not None)])
+    dist.all_reduce(flag, op=dist.ReduceOp.MIN)
+    return bool(flag.item())
+
+
+def train_main(device_id: str, init_ckpt_idx: int, data_queue: mp.Queue,
+               stop_event: mp.Event, backlog: mp.Value, rank: int = 0, num_ranks: int = 1,
+               shard_queues=()):
+    """The training process, or one rank of data-parallel training.
+
+    Args:
+        device_id: The device to train on.
+        init_ckpt_idx: The index of the checkpoint to start from.
+        data_queue: The queue of self-play games, the queue of the shard of
+            this rank if rank > 0.
+        stop_event: Once set, the process stops training, adds the games left in
+            data_queue to the replay buffer, saves it and exits. Only rank 0 needs it, the other
+            ranks stop with rank 0.
+        backlog: Written with the number of self-play positions
+            the trainer is behind TRAIN_REPLAY_RATIO.
+        rank: The rank, only rank 0 receives the games, evaluates the network
+            and writes checkpoints.
+        num_ranks: The number of ranks, whose gradients are averaged.
+        shard_queues: The queues of the shards of ranks 1 to num_ranks - 1, only for rank 0.
+    """
     config_log("train-{}.log".format(os.getpid()))
-    record_buffer = RecordBuffer()
+    metrics.start_pushing("trainer")
+    if rank == 0:
+        metrics.set_gauge("best_ckpt_index", init_ckpt_idx)
+    if num_ranks > 1:
+        init_data_parallel(rank, num_ranks)
+        logging.info("rank {} of {} has joined".format(rank, num_ranks))
+    record_buffer = RecordBuffer(REPLAY_BUFFER_SIZE // num_ranks)
+    if os.path.isfile(_replay_buffer_path(rank)):
+        record_buffer.dataset.load(_replay_buffer_path(rank))
+        logging.info("{} positions of the replay buffer have been loaded".format(
+            record_buffer.dataset.size))
+
+    archive_path = None
+    if GAME_ARCHIVE_DIR is not None and rank == 0:
+        os.makedirs(GAME_ARCHIVE_DIR, exist_ok=True)
+        archive_path = os.path.join(
+            GAME_ARCHIVE_DIR, "{}-{}.bin".format(int(time.time()), os.getpid()))
+        logging.info("archiving games to {}".format(archive_path))
 
     get_data_loop_thread = threading.Thread(
         target=get_data_loop,
-        args=(record_buffer, data_queue)
+        args=(record_buffer, data_queue, stop_event, archive_path, shard_queues)
     )
     get_data_loop_thread.start()
 
+    if INGEST_PORT is not None and rank == 0:
+        start_ingest_server(INGEST_HOST, INGEST_PORT, data_queue)
+
     network = load_ckpt(
         os.path.join(CKPT_DIR, "{}.pt".format(init_ckpt_idx)),
         device_id
     )
     logging.info("ckpt #{} has been loaded".format(init_ckpt_idx))
 
+    module = network
+    if num_ranks > 1:
+        # the parameters of rank 0 are broadcast to the other ranks
+        network = DistributedDataParallel(network)
+
     optimizer = torch.optim.SGD(
         network.parameters(),
         lr=TRAIN_LR,
         weight_decay=1e-4
     )
 
+    if TRAIN_FAST:
+        prefetcher = BatchPrefetcher(
+            record_buffer, TRAIN_BATCH_SIZE, TRAIN_REPLAY_RATIO, TRAIN_PREFETCH_BATCHES,
+            device_id.startswith("cuda"))
+        step = FastTrainStep(network, optimizer, device_id, TRAIN_AMP, TRAIN_COMPILE)
+        logging.info("training in the throughput mode, autocast = {}, compile = {}".format(
+            step.dtype, TRAIN_COMPILE))
+
     last_ckpt_idx = 0
     ckpt_idx = init_ckpt_idx
+    batch_idx = 0
+    report_time = time.time()
+    report_batch_idx = 0
+    network.train()
     while True:
-        dataset = record_buffer.get_dataset()
-        data_loader = DataLoader(dataset, batch_size=64, shuffle=True)
-
-        network.train()
-        for batch_idx, batch in enumerate(data_loader):
-            chessboard = batch["chessboard"].to(device_id)
-            p = batch["p"].to(device_id)
-            v = batch["v"].to(device_id)
-            logging.info("batch #{}, size = {}".format(batch_idx, v.size(0)))
-
-            optimizer.zero_grad()
-            out_p, out_v = network(chessboard)
-
-            loss = F.mse_loss(v, out_v) - \
-                torch.mean(torch.sum(
-                    F.log_softmax(out_p.view((-1, CHESSBOARD_SIZE ** 2)), dim=-1) *
-                    p.view((-1, CHESSBOARD_SIZE ** 2)),
-                    dim=1
+        # the positions of the other shards are about as many
+        backlog.value = record_buffer.backlog(TRAIN_REPLAY_RATIO) * num_ranks
+        if TRAIN_FAST:
+            batch = prefetcher.get()
+        else:
+            batch = record_buffer.sample(TRAIN_BATCH_SIZE, TRAIN_REPLAY_RATIO)
+        # every rank stops once one of them runs out of games
+        if num_ranks > 1 and not all_ranks_have_batch(batch):
+            break
+        if batch is None:
+            break
+        step_time = time.perf_counter()
+        if TRAIN_FAST:
+            step(batch)
+        else:
+            logging.info("batch #{}, size = {}".format(batch_idx, batch["v"].size(0)))
+            train_step(network, optimizer, batch, device_id)
+        batch_idx += 1
+        metrics.inc("train_steps_total")
+        metrics.inc("train_samples_total", batch["v"].size(0))
+        metrics.observe("train_step_seconds", time.perf_counter() - step_time)
+
+        now = time.time()
+        if now - report_time >= TRAIN_REPORT_INTERVAL:
+            steps_per_sec = (batch_idx - report_batch_idx) / (now - report_time)
+            logging.info(
+                "steps/sec = {:.2f}, samples/sec = {:.1f} over {} ranks, "
+                "replay ratio = {:.2f} (target {})".format(
+                    steps_per_sec, steps_per_sec * TRAIN_BATCH_SIZE * num_ranks, num_ranks,
+                    record_buffer.num_consumed / record_buffer.num_produced,
+                    TRAIN_REPLAY_RATIO
                 ))
-
-            loss.backward()
-            optimizer.step()
-
-        ckpt_idx += dataset.num_games
-        logging.info("ckpt #{} has been trained".format(ckpt_idx))
+            report_time = now
+            report_batch_idx = batch_idx
+
+        if rank > 0:
+            continue
+        metrics.set_gauge("train_backlog_positions", backlog.value)
+        metrics.set_gauge("replay_buffer_positions", record_buffer.dataset.size * num_ranks)
+        if init_ckpt_idx + record_buffer.num_games > ckpt_idx:
+            ckpt_idx = init_ckpt_idx + record_buffer.num_games
+            logging.info("ckpt #{} has been trained".format(ckpt_idx))
         if ckpt_idx - last_ckpt_idx >= EVAL_FREQ:
             last_ckpt_idx = ckpt_idx
             logging.info(
                 "evaluating ckpt #{} against best ckpt".format(ckpt_idx))
-            if evaluate_against_best_ckpt(network, device_id):
+            eval_time = time.time()
+            accepted = evaluate_against_best_ckpt(module, device_id)
+            metrics.observe("gating_seconds", time.time() - eval_time)
+            metrics.inc("gating_total", result="accepted" if accepted else "rejected")
+            if accepted:
                 torch.save(
-                    network.state_dict(),
+                    module.state_dict(),
                     os.path.join(CKPT_DIR, "{}.pt".format(ckpt_idx))
                 )
                 update_best_ckpt_idx(ckpt_idx)
+                metrics.set_gauge("best_ckpt_index", ckpt_idx)
             else:
                 logging.info("fail to win the best ckpt")
+            network.train()
+
+    record_buffer.dataset.save(_replay_buffer_path(rank))
+    if num_ranks > 1:
+        dist.destroy_process_group()
+    metrics.push()
+    logging.info("stopped, the replay buffer has been saved")